@@ -0,0 +1,154 @@
+"""
+    authlib.integrations.sqla_oauth2.auth_context
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    What the stateful checks of a request know about its access token: the
+    token, its client, the policy and the update program rows, loaded once per
+    request and kept on ``flask.g``.
+"""
+import time
+import threading
+from collections import OrderedDict
+
+from flask import g
+from sqlalchemy import inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+
+class AuthContext(object):
+    """Rows of one access token, each loaded at most once per request::
+
+        context = get_auth_context(session, access_token, cache)
+        token = context.get('token', lambda: session.query(Token).filter_by(...).first())
+        client = context.get('client', lambda: ...)
+
+    A row found in ``cache`` (an :class:`AuthContextCache`) is merged into the
+    request's session without a query; a row loaded from the database is
+    stored there for the next requests of the same token.
+    """
+    def __init__(self, session, access_token, cache=None):
+        self.session = session
+        self.access_token = access_token
+        self.cache = cache
+        # deserialized policy module, once the validator loaded it
+        self.policy_module = None
+        # the client's HMAC key, read when the client is loaded: the row itself is
+        # expired by the commits of the resource API
+        self.hmac_key = None
+        self._rows = {}
+
+    def get(self, name, load):
+        """Row ``name`` (``token``, ``client``, ``policy``, ``update_program``), from
+        this request, the cache or ``load()``, in that order."""
+        if name in self._rows:
+            return self._rows[name]
+        row = None
+        cached = self.cache.get(self.access_token, name) if self.cache is not None else None
+        if cached is not None:
+            row = self.session.merge(cached, load=False)
+        else:
+            row = load()
+            if row is not None and self.cache is not None:
+                self.cache.put(self.access_token, name, row)
+        self._rows[name] = row
+        if name == 'client' and row is not None:
+            self.hmac_key = row.hmac_key
+        return row
+
+
+def get_auth_context(session, access_token, cache=None):
+    """The :class:`AuthContext` of the current request, created on first use."""
+    context = g.get('auth_context')
+    if context is None or context.access_token != access_token:
+        context = AuthContext(session, access_token, cache)
+        g.auth_context = context
+    return context
+
+
+class AuthContextCache(object):
+    """Short-lived per-process copies of the rows of recently seen access tokens.
+
+    Entries expire ``ttl`` seconds after the token's rows were first loaded and
+    are dropped when the token is revoked (:meth:`invalidate`), so a revocation
+    takes effect on the next request; rows changed any other way are picked up
+    within ``ttl``. Rows are kept detached, as copies of their loaded columns.
+
+    :param maxsize: Maximum number of access tokens kept. ``0`` disables caching.
+    :param ttl: Seconds an entry is reused.
+    """
+    def __init__(self, maxsize=1024, ttl=5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, access_token, name):
+        """A detached copy of row ``name`` of ``access_token``, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get(access_token)
+            if entry is not None and entry[1] < time.time():
+                del self._entries[access_token]
+                entry = None
+            row = entry[0].get(name) if entry is not None else None
+            if row is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(access_token)
+            self.hits += 1
+            return row
+
+    def put(self, access_token, name, row):
+        """Keep a copy of ``row`` as row ``name`` of ``access_token``."""
+        if self.maxsize <= 0:
+            return
+        copy = _detached_copy(row)
+        with self._lock:
+            entry = self._entries.get(access_token)
+            if entry is None or entry[1] < time.time():
+                entry = ({}, time.time() + self.ttl)
+                self._entries[access_token] = entry
+            entry[0][name] = copy
+            self._entries.move_to_end(access_token)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, access_token=None):
+        """Forget one access token, or all of them."""
+        with self._lock:
+            if access_token is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(access_token, None)
+
+    def stats(self):
+        """Return the hit/miss counters of this cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _detached_copy(row):
+    # Loaded columns only: deferred ones (module BLOBs) stay unloaded and are
+    # fetched if a request reads them.
+    state = inspect(row)
+    values = {
+        attr.key: getattr(row, attr.key)
+        for attr in state.mapper.column_attrs
+        if attr.key not in state.unloaded
+    }
+    copy = state.mapper.class_manager.new_instance()
+    for key, value in values.items():
+        setattr(copy, key, value)
+    make_transient_to_detached(copy)
+    return copy
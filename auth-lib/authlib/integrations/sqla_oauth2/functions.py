@@ -1,17 +1,24 @@
 import time
 from authlib.oauth2.rfc6750.errors import (
-    PolicyFailedError, BadPolicyEndpointError, PolicyHashMismatchError, PolicyCrashedError, InvalidHistoryError
+    PolicyFailedError, BadPolicyEndpointError, PolicyHashMismatchError, PolicyCrashedError,
+    PolicyBudgetExceededError, InvalidHistoryError
 )
 
 import time
 
-from flask import jsonify, g, current_app
+from flask import jsonify, g, current_app, request as flask_request
 
 from authlib.oauth2.stateful.validator_helper import (
-    run_policy, build_request_JSON
+    run_policy, build_request_JSON, resolve_verdicts
 )
+from authlib.oauth2.stateful.decision_cache import parse_projection
+from authlib.oauth2.stateful.artifact_store import load_module
+from authlib.oauth2.stateful.budget import is_budget_exhausted
+from sqlalchemy.orm import defer
 from wasmtime import Config, Engine, Linker, Module
 from historylib.batch_history_list import BatchHistoryList
+from historylib.wire import WireFormatError
+from .auth_context import get_auth_context
 
 from historylib.macaroon_utils import *
 
@@ -114,7 +121,22 @@ def create_bearer_token_validator(session, token_model):
 
     return _BearerTokenValidator
 
-def create_bearer_token_validator_stateful(wasm_linker, session, token_model, client_model, policy_model, macaroon_model, is_proxy=False, is_macaroon=False):
+def create_bearer_token_validator_stateful(wasm_linker, session, token_model, client_model, policy_model, macaroon_model=None, is_proxy=False, is_macaroon=False, module_cache=None, instance_pool=None, decision_cache=None, budgets=None, auth_context_cache=None):
+    """Create a stateful bearer token validator class with SQLAlchemy session
+    and models.
+
+    :param module_cache: Optional :class:`~authlib.oauth2.stateful.module_cache.ModuleCache`
+        holding deserialized policy modules across requests.
+    :param instance_pool: Optional :class:`~authlib.oauth2.stateful.instance_pool.InstancePool`
+        of pre-instantiated policies.
+    :param decision_cache: Optional :class:`~authlib.oauth2.stateful.decision_cache.DecisionCache`
+        of verdicts of the policies declared deterministic.
+    :param budgets: Optional :class:`~authlib.oauth2.stateful.budget.ExecutionBudgets`
+        bounding the fuel and time a policy (and the update program) may use.
+    :param auth_context_cache: Optional :class:`~authlib.integrations.sqla_oauth2.auth_context.AuthContextCache`
+        of the token, client and policy rows across requests. Within a request they
+        are always loaded once, into ``g.auth_context``.
+    """
 
     from authlib.oauth2.stateful import BearerTokenValidatorStateful
 
@@ -129,14 +151,17 @@ def create_bearer_token_validator_stateful(wasm_linker, session, token_model, cl
                 else:
                     raise Exception("macaroon does not verify") 
             else:
+                # token, client, policy and update program rows of this request, see auth_context
+                context = get_auth_context(session, token_string, auth_context_cache)
                 q = session.query(token_model)
-                return q.filter_by(access_token=token_string).first()
+                return context.get('token', lambda: q.filter_by(access_token=token_string).first())
         
         # extra stateful checks 
         def validate_token_stateful(self, token, scopes, request,):
 
+            context = get_auth_context(session, token.access_token, auth_context_cache)
             q = session.query(client_model)
-            client = q.filter_by(client_id=token.client_id).first()
+            client = context.get('client', lambda: q.filter_by(client_id=token.client_id).first())
 
             # LOGGING
             if 'ENABLE_LOGGING' in current_app.config and current_app.config['ENABLE_LOGGING'] \
@@ -169,10 +194,27 @@ def create_bearer_token_validator_stateful(wasm_linker, session, token_model, cl
                 policy_execution_start = time.time()
                 
             if not is_macaroon:
-                # get module from some db
-                policy_q = session.query(policy_model)
-                policy = policy_q.filter_by(policy_hash=token.policy).first()
-                policy_module = Module.deserialize(wasm_linker.engine, policy.serialized_module)
+                # the BLOB is only fetched if the policy has no precompiled artifact on disk
+                policy_q = session.query(policy_model).options(defer(policy_model.serialized_module))
+                load_policy = lambda: context.get('policy', lambda: policy_q.filter_by(policy_hash=token.policy).first())
+                if decision_cache is not None:
+                    # with the policy row, so that a module cache hit keeps the registration current
+                    policy = load_policy()
+                    if getattr(policy, 'deterministic', False):
+                        decision_cache.register(policy.policy_hash, parse_projection(policy.input_projection),
+                                                policy.decision_ttl)
+                # get module from the per-process cache, fall back to the db on a miss
+                policy_module = module_cache.get(token.policy) if module_cache is not None else None
+                policy_cache_hit = policy_module is not None
+                if policy_module is None:
+                    policy = load_policy()
+                    serialized_module = lambda: policy.serialized_module
+                    if module_cache is not None:
+                        policy_module = module_cache.load(wasm_linker.engine, policy.policy_hash, serialized_module,
+                                                          policy.artifact_path)
+                    else:
+                        policy_module = load_module(wasm_linker.engine, serialized_module, policy.artifact_path)
+                context.policy_module = policy_module
 
             request_JSON, request_size = build_request_JSON(request)
             history_list_str = ''
@@ -184,10 +226,28 @@ def create_bearer_token_validator_stateful(wasm_linker, session, token_model, cl
                 # macaroon don't need to get history
                 pass
             else:
-                # Get history list from request header
-                history_list_str = request.headers.get('Authorization-History')
+                # Get history list from request header, inflated and decoded to JSON (see historylib.wire)
+                from historylib.server_utils import get_request_history_str
+                try:
+                    history_list_str = get_request_history_str(flask_request)
+                except WireFormatError:
+                    raise InvalidHistoryError()
                 # history_list = BatchHistoryList() if not history_list_str else BatchHistoryList(json_str=history_list_str)
 
+            # Reuse the verdict of a deterministic policy for the same inputs
+            decision_key = None
+            cached_verdict = None
+            if decision_cache is not None and not is_macaroon:
+                decision_key = decision_cache.key(token.policy, request_JSON, history_list_str)
+                if decision_key is not None:
+                    cached_verdict = decision_cache.get(decision_key)
+
+            # Fuel/deadline of this client's policy, also applied to its update program
+            budget = None
+            if budgets is not None and budgets.enabled and not is_macaroon:
+                budget = budgets.for_client(client)
+                g.execution_budget = budget
+
             # print(f"{request_JSON=}")
             try:
                 # run the policy, accept/deny based on output
@@ -197,11 +257,38 @@ def create_bearer_token_validator_stateful(wasm_linker, session, token_model, cl
                 if is_macaroon:
                     # run macaroon policy
                     result = verify_policy(request, token.access_token)
+                elif cached_verdict is not None:
+                    result = cached_verdict
                 else:
-                    result = run_policy(wasm_linker, policy_module, policy.policy_hash, request_JSON, history_list_str)
+                    result, fused_history = run_policy(wasm_linker, policy_module, token.policy, request_JSON, history_list_str,
+                                                       instance_pool, stdio=current_app.config.get('WASM_STDIO', 'memory'),
+                                                       budget=budget)
+                    if fused_history is not None:
+                        # A fused module already computed the updated history, update_history reuses it
+                        g.fused_history = fused_history
+                    elif decision_key is not None:
+                        decision_cache.put(decision_key, result)
             except Exception as e:
                 print("policy execution error:", e)
+                if is_budget_exhausted(e):
+                    # LOGGING
+                    if 'ENABLE_LOGGING' in current_app.config and current_app.config['ENABLE_LOGGING'] \
+                        and hasattr(g, 'current_log'):
+                        g.current_log.policy_hash = token.policy
+                        g.current_log.policy_budget_exceeded = True
+                    raise PolicyBudgetExceededError()
                 raise PolicyCrashedError()
+
+            # A policy may judge every object of a batch separately
+            denied_objects = 0
+            if isinstance(result, dict):
+                denied_objects = sum(1 for verdict in result.values() if not verdict)
+                # Views opt in with historylib.server_utils.partial_accept
+                view = current_app.view_functions.get(flask_request.endpoint)
+                partial_accept = getattr(view, 'partial_accept', False)
+                result, accepted_ids = resolve_verdicts(result, partial_accept)
+                if accepted_ids is not None:
+                    g.policy_accepted_ids = accepted_ids
             
             
             # LOGGING
@@ -214,13 +301,27 @@ def create_bearer_token_validator_stateful(wasm_linker, session, token_model, cl
                 and hasattr(g, 'current_log'):
                 # Save to the current log in LogManager
                 current_log = g.current_log
+                current_log.policy_hash = token.policy
                 if history_list_str:
                     history_size = len(history_list_str)
-                    batch_history_list = BatchHistoryList(json_str=history_list_str)
+                    if is_proxy:
+                        batch_history_list = BatchHistoryList(json_str=history_list_str)
+                    else:
+                        # counted on the parse shared with the history validation
+                        from historylib.server_utils import get_batch_history
+                        batch_history_list = BatchHistoryList(batch=get_batch_history(flask_request))
                     history_length = batch_history_list.get_num_history_entries()
                     current_log.history_size = history_size
                     current_log.history_length = history_length
                 current_log.policy_succeeds = result
+                current_log.policy_denied_objects = denied_objects
+                if not is_macaroon:
+                    current_log.policy_cache_hit = policy_cache_hit
+                if decision_cache is not None:
+                    current_log.decision_cache_hit = cached_verdict is not None
+                    current_log.decision_cache_hit_rate = decision_cache.stats()['hit_rate']
+                if auth_context_cache is not None:
+                    current_log.auth_context_cache_hit_rate = auth_context_cache.stats()['hit_rate']
                 current_log.history_validation_time = history_validation_time
                 current_log.policy_execution_time = policy_execution_time
                 current_log.request_size = request_size
@@ -15,7 +15,7 @@ from ..base import OAuth2Error
 
 __all__ = [
     'InvalidTokenError', 'InsufficientScopeError', 'UnregisteredPolicyError', 'PolicyFailedError', 'BadPolicyEndpointError',
-    'PolicyHashMismatchError', 'PolicyCrashedError', 'InvalidHistoryError'
+    'PolicyHashMismatchError', 'PolicyCrashedError', 'PolicyBudgetExceededError', 'InvalidHistoryError'
 ]
 
 
@@ -115,6 +115,13 @@ class PolicyCrashedError(OAuth2Error):
     description = 'policy execution unsuccessful'
     status_code = 403
 
+class PolicyBudgetExceededError(OAuth2Error):
+    """policy ran out of fuel or past its deadline
+    """
+    error = 'policy_budget_exceeded'
+    description = 'policy execution exceeded its fuel or time budget'
+    status_code = 403
+
 class InvalidHistoryError(OAuth2Error):
     """The history is invalid.
     """
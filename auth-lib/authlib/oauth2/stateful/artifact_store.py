@@ -0,0 +1,116 @@
+"""
+    authlib.oauth2.stateful.artifact_store
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Content-addressed directory of precompiled policies and update programs.
+"""
+import os
+import hashlib
+import tempfile
+
+from wasmtime import Module, WasmtimeError
+
+
+class ArtifactStore(object):
+    """Keeps precompiled (``Module.serialize``) programs on disk, one file
+    per content hash, so that they are loaded with ``Module.deserialize_file``
+    (which mmaps the file) instead of copying a BLOB out of the database on
+    every request. Forked workers share the mapped pages::
+
+        path = artifact_store.save(module.serialize(), policy_hash)
+        module = load_module(engine, artifact_path=path)
+
+    Artifacts are only valid for engines configured like the one that
+    compiled them. Saved with their ``source`` (the wasm binary), they are
+    recompiled by :func:`load_module` when the engine rejects them, e.g. after
+    a change of the ``WASM_*`` settings or of the wasmtime version.
+
+    :param root: Directory of the store. ``None`` disables it.
+    """
+    def __init__(self, root=None):
+        self.root = root
+
+    @property
+    def enabled(self):
+        return bool(self.root)
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], digest + '.cwasm')
+
+    def save(self, serialized_module, digest=None, source=None):
+        """Write ``serialized_module`` under ``digest`` (its sha256 if not
+        given) and return its path. Existing artifacts are replaced atomically.
+        ``source``, the wasm binary it was compiled from, is kept beside it.
+        """
+        if digest is None:
+            digest = hashlib.sha256(serialized_module).hexdigest()
+        path = self.path_for(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if source is not None:
+            _write(source_path(path), source)
+        _write(path, serialized_module)
+        return path
+
+    def store(self, module, digest=None, source_path=None):
+        """Return the ``(serialized_module, artifact_path)`` to record for a
+        compiled module. When the store is enabled the module goes to disk and
+        the database only keeps its path, with the wasm file at ``source_path``
+        kept beside it; otherwise the serialized bytes are returned.
+        """
+        serialized_module = module.serialize()
+        if not self.enabled:
+            return serialized_module, None
+        source = None
+        if source_path is not None:
+            with open(source_path, 'rb') as f:
+                source = f.read()
+        return None, self.save(serialized_module, digest, source)
+
+
+def source_path(artifact_path):
+    """Path of the wasm binary kept beside an artifact."""
+    return os.path.splitext(artifact_path)[0] + '.wasm'
+
+
+def _write(path, data):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_module(engine, serialized_module=None, artifact_path=None):
+    """Load a precompiled module from its artifact file if it exists, else
+    from the serialized bytes kept in the database.
+
+    An artifact the engine rejects (compiled with other settings) is compiled
+    again from its source and replaced; without a source the database bytes
+    are tried. ``serialized_module`` may be a callable, so that a deferred
+    database column is only fetched when the artifact cannot be used.
+    """
+    rejected = None
+    if artifact_path and os.path.exists(artifact_path):
+        try:
+            return Module.deserialize_file(engine, artifact_path)
+        except WasmtimeError as e:
+            if os.path.exists(source_path(artifact_path)):
+                return _recompile(engine, artifact_path)
+            rejected = e
+    if callable(serialized_module):
+        serialized_module = serialized_module()
+    if serialized_module is None:
+        if rejected is not None:
+            raise rejected
+        raise FileNotFoundError(artifact_path)
+    return Module.deserialize(engine, serialized_module)
+
+
+def _recompile(engine, artifact_path):
+    module = Module.from_file(engine, source_path(artifact_path))
+    # The next load (and other workers with the same settings) can mmap it again
+    _write(artifact_path, module.serialize())
+    return module
@@ -0,0 +1,114 @@
+"""
+    authlib.oauth2.stateful.budget
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Fuel and wall-clock budgets for policy and update program runs.
+"""
+import math
+import time
+import threading
+
+from wasmtime import Trap, TrapCode
+
+UNLIMITED = 2 ** 64 - 1
+# The epoch deadline is relative to the current epoch and wraps past 2**64, so
+# "no deadline" is a bounded number of ticks (over 10**8 years at 1 ms a tick)
+NO_DEADLINE_TICKS = 2 ** 62
+
+
+class ExecutionBudgets(object):
+    """Hands out the :class:`Budget` of each run on one engine.
+
+    Fuel (roughly one unit per wasm instruction) needs ``consume_fuel`` and
+    wall-clock deadlines need ``epoch_interruption`` on the engine's config;
+    the epoch is then advanced every ``epoch_tick_ms`` by a background
+    thread. A client may register its own limits, otherwise the defaults
+    apply; ``None`` means unlimited::
+
+        budget = execution_budgets.for_client(client)
+        budget.arm(store)
+        start(store)  # raises a Trap once the budget is used up
+
+    :param engine: The ``wasmtime.Engine`` running the programs.
+    """
+    def __init__(self, engine, consume_fuel=False, epoch_interruption=False, epoch_tick_ms=1,
+                 default_fuel=None, default_deadline_ms=None):
+        self.engine = engine
+        self.consume_fuel = consume_fuel
+        self.epoch_interruption = epoch_interruption
+        self.epoch_tick_ms = epoch_tick_ms
+        self.default_fuel = default_fuel
+        self.default_deadline_ms = default_deadline_ms
+        self._ticker = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_profile(cls, engine, profile):
+        """Create the budgets of an engine built from an ``EngineProfile``."""
+        return cls(
+            engine,
+            consume_fuel=profile['WASM_CONSUME_FUEL'],
+            epoch_interruption=profile['WASM_EPOCH_INTERRUPTION'],
+            epoch_tick_ms=profile['WASM_EPOCH_TICK_MS'],
+            default_fuel=profile['WASM_DEFAULT_FUEL'],
+            default_deadline_ms=profile['WASM_DEFAULT_DEADLINE_MS'],
+        )
+
+    @property
+    def enabled(self):
+        return self.consume_fuel or self.epoch_interruption
+
+    def budget(self, fuel=None, deadline_ms=None):
+        return Budget(self, fuel or self.default_fuel, deadline_ms or self.default_deadline_ms)
+
+    def for_client(self, client):
+        """The budget a client registered (``policy_fuel`` and
+        ``policy_deadline_ms`` in its metadata), or the default one."""
+        metadata = client.client_metadata if client is not None else {}
+        return self.budget(metadata.get('policy_fuel'), metadata.get('policy_deadline_ms'))
+
+    def epoch_ticks(self, deadline_ms):
+        if not deadline_ms:
+            return NO_DEADLINE_TICKS
+        self._start_ticker()
+        return max(1, math.ceil(deadline_ms / self.epoch_tick_ms))
+
+    def _start_ticker(self):
+        if self._ticker is not None:
+            return
+        with self._lock:
+            if self._ticker is None:
+                self._ticker = threading.Thread(target=self._tick, name='wasm-epoch-ticker', daemon=True)
+                self._ticker.start()
+
+    def _tick(self):
+        interval = self.epoch_tick_ms / 1000.0
+        while True:
+            time.sleep(interval)
+            self.engine.increment_epoch()
+
+
+class Budget(object):
+    """The fuel and deadline of one run. ``arm`` must be called on the store
+    right before entering the guest, including for reused instances.
+    """
+    def __init__(self, budgets, fuel=None, deadline_ms=None):
+        self.budgets = budgets
+        self.fuel = fuel
+        self.deadline_ms = deadline_ms
+
+    def arm(self, store):
+        if self.budgets.consume_fuel:
+            store.set_fuel(self.fuel or UNLIMITED)
+        if self.budgets.epoch_interruption:
+            store.set_epoch_deadline(self.budgets.epoch_ticks(self.deadline_ms))
+
+
+def arm(store, budget):
+    if budget is not None:
+        budget.arm(store)
+
+
+def is_budget_exhausted(error):
+    """Whether ``error`` is a guest trap caused by running out of fuel or time."""
+    return isinstance(error, Trap) and error.trap_code in (TrapCode.OUT_OF_FUEL, TrapCode.INTERRUPT)
@@ -0,0 +1,129 @@
+"""
+    authlib.oauth2.stateful.decision_cache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Per-process cache of policy decisions for policies declared deterministic.
+"""
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Everything but the time of the request, used when a policy declares no projection
+DEFAULT_PROJECTION = ('method', 'uri', 'path', 'body', 'headers')
+
+
+class DecisionCache(object):
+    """A bounded LRU cache of policy verdicts with an optional TTL.
+
+    A policy opts in by being registered as deterministic, together with the
+    request fields it reads (``method``, ``uri``, ``path``, ``body``,
+    ``headers`` or a single header such as ``headers.Content-Type``). The
+    cache key is the policy hash, the canonical JSON of those fields and a
+    digest of the (already validated) history::
+
+        decision_cache.register(policy_hash, ['method', 'path'], ttl=60)
+        key = decision_cache.key(policy_hash, request_str, history_str)
+        verdict = decision_cache.get(key)
+        if verdict is None:
+            verdict = run_policy(...)
+            decision_cache.put(key, verdict)
+
+    A TTL bounds how long a decision of a time dependent policy is reused.
+
+    :param maxsize: Maximum number of decisions kept. ``0`` disables caching.
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._policies = {}
+        self._decisions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, policy_hash, input_projection=None, ttl=None):
+        """Declare ``policy_hash`` deterministic over ``input_projection``."""
+        projection = tuple(input_projection) if input_projection else DEFAULT_PROJECTION
+        self._policies[policy_hash] = (projection, ttl)
+
+    def key(self, policy_hash, request_str, history_str):
+        """Return the cache key of a request, or None if the policy is not cacheable."""
+        policy = self._policies.get(policy_hash)
+        if policy is None or self.maxsize <= 0:
+            return None
+        projection, _ = policy
+        request_data = json.loads(request_str)
+        fields = [_project(request_data, field) for field in projection]
+        history_digest = hashlib.sha256((history_str or '').encode()).hexdigest()
+        return policy_hash, json.dumps(fields, sort_keys=True), history_digest
+
+    def get(self, key):
+        """Return the cached verdict for ``key``, or None on a miss."""
+        with self._lock:
+            entry = self._decisions.get(key)
+            if entry is not None and entry[1] is not None and entry[1] < time.time():
+                del self._decisions[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._decisions.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, verdict):
+        """Cache ``verdict``, evicting the least recently used ones if full."""
+        policy = self._policies.get(key[0])
+        if policy is None or self.maxsize <= 0:
+            return
+        ttl = policy[1]
+        expires_at = time.time() + ttl if ttl else None
+        with self._lock:
+            self._decisions[key] = (verdict, expires_at)
+            self._decisions.move_to_end(key)
+            while len(self._decisions) > self.maxsize:
+                self._decisions.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, policy_hash=None):
+        """Forget one policy (its registration and decisions), or all of them."""
+        with self._lock:
+            if policy_hash is None:
+                self._policies.clear()
+                self._decisions.clear()
+                return
+            self._policies.pop(policy_hash, None)
+            for key in [k for k in self._decisions if k[0] == policy_hash]:
+                del self._decisions[key]
+
+    def stats(self):
+        """Return the hit/miss counters of this cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._decisions),
+                'maxsize': self.maxsize,
+                'policies': len(self._policies),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._decisions)
+
+
+def _project(request_data, field):
+    if field.startswith('headers.'):
+        return request_data.get('headers', {}).get(field[len('headers.'):])
+    return request_data.get(field)
+
+
+def parse_projection(value):
+    """Parse a comma separated list of request fields, as stored on a policy."""
+    if not value:
+        return None
+    return [field.strip() for field in value.split(',') if field.strip()]
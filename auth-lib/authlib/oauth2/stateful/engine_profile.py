@@ -0,0 +1,170 @@
+"""
+    authlib.oauth2.stateful.engine_profile
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Settings-driven configuration of the ``wasmtime.Engine`` that compiles
+    and runs policies and update programs.
+"""
+import os
+import time
+import logging
+
+from wasmtime import Config, Engine, Linker, Module, Store, WasiConfig, WasmtimeError
+from wasmtime import _bindings
+
+log = logging.getLogger(__name__)
+
+#: Known settings and their defaults (the ``wasmtime`` defaults, pooling off)
+ENGINE_SETTINGS = {
+    # Cranelift optimization level: none, speed or speed_and_size
+    'WASM_OPT_LEVEL': 'speed',
+    'WASM_PARALLEL_COMPILATION': True,
+    # Pre-allocate instance, memory and table slots instead of mmap'ing them per instantiation
+    'WASM_POOLING_ALLOCATOR': False,
+    'WASM_POOLING_TOTAL_INSTANCES': 1000,
+    'WASM_POOLING_TOTAL_MEMORIES': 1000,
+    'WASM_POOLING_TOTAL_TABLES': 1000,
+    'WASM_POOLING_MAX_MEMORY_SIZE': 64 * 1024 * 1024,
+    'WASM_POOLING_MAX_UNUSED_WARM_SLOTS': 100,
+    # Bytes of address space reserved for each linear memory and its guard region
+    'WASM_MEMORY_RESERVATION': None,
+    'WASM_MEMORY_GUARD_SIZE': None,
+    # Directory of the on-disk compilation cache, None disables it
+    'WASM_CACHE_DIR': None,
+    # Execution budgets: count fuel and/or interrupt runs past a wall-clock deadline
+    'WASM_CONSUME_FUEL': False,
+    'WASM_EPOCH_INTERRUPTION': False,
+    'WASM_EPOCH_TICK_MS': 1,
+    # Limits of clients that did not register their own, None means unlimited
+    'WASM_DEFAULT_FUEL': None,
+    'WASM_DEFAULT_DEADLINE_MS': None,
+}
+
+
+class EngineProfile(object):
+    """The engine settings of a process, read from a settings mapping (an
+    app config or ``website.settings``) or from the environment::
+
+        profile = EngineProfile.from_mapping(os.environ)
+        wasm_engine = profile.create_engine()
+        profile.self_check(wasm_engine)
+
+    Unset keys keep the defaults of :data:`ENGINE_SETTINGS`. Values given as
+    strings (e.g. environment variables) are converted to the default's type.
+    """
+    def __init__(self, **settings):
+        unknown = set(settings) - set(ENGINE_SETTINGS)
+        if unknown:
+            raise ValueError('unknown engine settings: {}'.format(', '.join(sorted(unknown))))
+        self.settings = dict(ENGINE_SETTINGS)
+        self.settings.update(settings)
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        settings = {}
+        for key, default in ENGINE_SETTINGS.items():
+            value = mapping.get(key)
+            if value is None or value == '':
+                continue
+            settings[key] = _convert(value, default)
+        return cls(**settings)
+
+    @classmethod
+    def from_env(cls):
+        return cls.from_mapping(os.environ)
+
+    def __getitem__(self, key):
+        return self.settings[key]
+
+    def to_config(self):
+        """Build the ``wasmtime.Config`` of this profile.
+
+        Raises ``ValueError`` for settings the engine would abort the process
+        on, i.e. pooling slots larger than the reserved memory.
+        """
+        reservation = self['WASM_MEMORY_RESERVATION']
+        if self['WASM_POOLING_ALLOCATOR'] and reservation is not None \
+                and reservation < self['WASM_POOLING_MAX_MEMORY_SIZE']:
+            raise ValueError('WASM_MEMORY_RESERVATION ({}) is smaller than WASM_POOLING_MAX_MEMORY_SIZE ({})'
+                             .format(reservation, self['WASM_POOLING_MAX_MEMORY_SIZE']))
+        config = Config()
+        config.cranelift_opt_level = self['WASM_OPT_LEVEL']
+        config.parallel_compilation = self['WASM_PARALLEL_COMPILATION']
+        config.consume_fuel = self['WASM_CONSUME_FUEL']
+        config.epoch_interruption = self['WASM_EPOCH_INTERRUPTION']
+        if self['WASM_MEMORY_RESERVATION'] is not None:
+            config.memory_reservation = self['WASM_MEMORY_RESERVATION']
+        if self['WASM_MEMORY_GUARD_SIZE'] is not None:
+            config.memory_guard_size = self['WASM_MEMORY_GUARD_SIZE']
+        if self['WASM_CACHE_DIR']:
+            _enable_cache(config, self['WASM_CACHE_DIR'])
+        if self['WASM_POOLING_ALLOCATOR']:
+            self._enable_pooling(config)
+        return config
+
+    def create_engine(self):
+        return Engine(self.to_config())
+
+    def _enable_pooling(self, config):
+        # Not wrapped by the wasmtime package yet, so go through its C API bindings
+        if not hasattr(_bindings, 'wasmtime_pooling_allocation_strategy_set'):
+            log.warning('this wasmtime version has no pooling allocator, using on-demand allocation')
+            return
+        pooling = _bindings.wasmtime_pooling_allocation_config_new()
+        try:
+            _bindings.wasmtime_pooling_allocation_config_total_core_instances_set(
+                pooling, self['WASM_POOLING_TOTAL_INSTANCES'])
+            _bindings.wasmtime_pooling_allocation_config_total_memories_set(
+                pooling, self['WASM_POOLING_TOTAL_MEMORIES'])
+            _bindings.wasmtime_pooling_allocation_config_total_tables_set(
+                pooling, self['WASM_POOLING_TOTAL_TABLES'])
+            _bindings.wasmtime_pooling_allocation_config_max_memory_size_set(
+                pooling, self['WASM_POOLING_MAX_MEMORY_SIZE'])
+            _bindings.wasmtime_pooling_allocation_config_max_unused_warm_slots_set(
+                pooling, self['WASM_POOLING_MAX_UNUSED_WARM_SLOTS'])
+            _bindings.wasmtime_pooling_allocation_strategy_set(config.ptr(), pooling)
+        finally:
+            _bindings.wasmtime_pooling_allocation_config_delete(pooling)
+
+    def self_check(self, engine, logger=None):
+        """Log the active profile and check that ``engine`` can instantiate a
+        WASI module, returning the instantiation time in seconds.
+        """
+        logger = logger or log
+        logger.info('wasm engine profile: %s', ', '.join(
+            '{}={}'.format(key, value) for key, value in sorted(self.settings.items())))
+        linker = Linker(engine)
+        linker.define_wasi()
+        module = Module(engine, '(module (memory 1) (func (export "_start")))')
+        start = time.time()
+        store = Store(engine)
+        store.set_wasi(WasiConfig())
+        linker.instantiate(store, module)
+        elapsed = time.time() - start
+        logger.info('wasm engine self-check: instantiated a module in %.1f us', elapsed * 1e6)
+        return elapsed
+
+
+def _convert(value, default):
+    if not isinstance(value, str):
+        return value
+    if isinstance(default, bool):
+        return value.lower() == 'true'
+    if isinstance(default, int) or (default is None and value.isdigit()):
+        return int(value)
+    return value
+
+
+def _enable_cache(config, cache_dir):
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_config = os.path.join(cache_dir, 'wasmtime-cache.toml')
+    # Older wasmtime releases also require `enabled = true` in the [cache] table
+    for extra in ('', 'enabled = true\n'):
+        with open(cache_config, 'w') as f:
+            f.write('[cache]\n{}directory = "{}"\n'.format(extra, os.path.abspath(cache_dir)))
+        try:
+            config.cache = cache_config
+            return
+        except WasmtimeError:
+            continue
+    log.warning('could not enable the wasm compilation cache in %s', cache_dir)
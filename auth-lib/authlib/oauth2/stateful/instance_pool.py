@@ -0,0 +1,235 @@
+"""
+    authlib.oauth2.stateful.instance_pool
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Pools of ready-to-run WASM instances for policies and update programs.
+"""
+import time
+import queue
+import logging
+import threading
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+
+from wasmtime import Store, WasiConfig
+
+from .policy_abi import REACTOR_ABI, instantiate
+
+log = logging.getLogger(__name__)
+
+
+class PooledInstance(object):
+    """A linked and instantiated module together with its store and the
+    exported entry function (``_start`` or ``evaluate``, see ``abi``), ready
+    to be called.
+    """
+    def __init__(self, store, instance, entry, reusable=False, abi='command'):
+        self.store = store
+        self.instance = instance
+        self.entry = entry
+        self.abi = abi
+        self.reusable = reusable
+        self.uses = 0
+
+
+class PoolStats(object):
+    """Latency and usage counters of the instances of one pool key."""
+    def __init__(self):
+        self.runs = 0
+        self.errors = 0
+        self.pool_hits = 0
+        self.pool_misses = 0
+        self.instantiations = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def to_dict(self):
+        return {
+            'runs': self.runs,
+            'errors': self.errors,
+            'pool_hits': self.pool_hits,
+            'pool_misses': self.pool_misses,
+            'instantiations': self.instantiations,
+            'avg_time': self.total_time / self.runs if self.runs else 0.0,
+            'max_time': self.max_time,
+        }
+
+
+class InstancePool(object):
+    """Keeps up to ``size`` pre-instantiated stores per key (a policy hash or
+    an update program), so that linking, instantiation and the export lookup
+    are paid ahead of the request instead of on it::
+
+        with instance_pool.instance(policy_hash, lambda: policy_module) as pooled:
+            pooled.store.set_wasi(config)
+            pooled.entry(pooled.store)
+
+    Instances that are used up are replaced by a background thread. A WASI
+    command module traps when ``_start`` is entered a second time, so its
+    instances are used once; reactor modules (see ``policy_abi``) go back to
+    the pool and are recycled after ``max_uses`` calls.
+
+    :param linker: The ``wasmtime.Linker`` used to instantiate modules.
+    :param size: Number of ready instances kept per key. ``0`` disables pooling.
+    :param max_uses: Calls served by a reusable instance before it is replaced.
+    :param budgets: Optional ``ExecutionBudgets`` of the engine; instantiation
+        runs under the default budget, callers arm their own before each call.
+    :param max_keys: Keys whose instances, module and counters are kept; the
+        least recently used ones are dropped beyond it.
+    """
+    def __init__(self, linker, size=4, max_uses=1000, budgets=None, max_keys=128):
+        self.linker = linker
+        self.size = size
+        self.max_uses = max_uses
+        self.budgets = budgets
+        self.max_keys = max_keys
+        self.evictions = 0
+        self._pools = OrderedDict()
+        self._loaders = OrderedDict()
+        self._stats = OrderedDict()
+        self._lock = threading.Lock()
+        self._refills = None
+
+    @contextmanager
+    def instance(self, key, load_module):
+        """Borrow a ready instance for ``key``. ``load_module`` is a callable
+        returning the module; it is only called when the pool has to create
+        instances it has not got a module for yet.
+        """
+        start = time.time()
+        pooled = self.acquire(key, load_module)
+        try:
+            yield pooled
+        except Exception:
+            self._stats_for(key).errors += 1
+            # The guest state is unknown after a trap, never hand it out again
+            pooled.reusable = False
+            raise
+        finally:
+            self.release(key, pooled)
+            elapsed = time.time() - start
+            stats = self._stats_for(key)
+            stats.runs += 1
+            stats.total_time += elapsed
+            stats.max_time = max(stats.max_time, elapsed)
+
+    def acquire(self, key, load_module):
+        with self._lock:
+            if key not in self._loaders:
+                self._loaders[key] = _memoize(load_module)
+            self._loaders.move_to_end(key)
+            pool = self._pools.setdefault(key, deque())
+            self._pools.move_to_end(key)
+            if key in self._stats:
+                self._stats.move_to_end(key)
+            pooled = pool.popleft() if pool else None
+            self._evict()
+        stats = self._stats_for(key)
+        if pooled is None:
+            stats.pool_misses += 1
+            pooled = self._instantiate(key)
+        else:
+            stats.pool_hits += 1
+        return pooled
+
+    def release(self, key, pooled):
+        pooled.uses += 1
+        if pooled.reusable and pooled.uses < self.max_uses:
+            with self._lock:
+                pool = self._pools.get(key)
+                if pool is None:
+                    # Evicted (or invalidated) while the instance was out
+                    return
+                if len(pool) < self.size:
+                    pool.append(pooled)
+                    return
+        self._schedule_refill(key)
+
+    def invalidate(self, key=None):
+        """Drop the ready instances (and module) of one key, or of all keys."""
+        with self._lock:
+            if key is None:
+                self._pools.clear()
+                self._loaders.clear()
+            else:
+                self._pools.pop(key, None)
+                self._loaders.pop(key, None)
+
+    def stats(self, key=None):
+        """Return the latency counters of one key, or of every key."""
+        if key is not None:
+            return self._stats_for(key).to_dict()
+        with self._lock:
+            keys = list(self._stats)
+        return {k: self._stats_for(k).to_dict() for k in keys}
+
+    def _stats_for(self, key):
+        stats = self._stats.get(key)
+        if stats is None:
+            with self._lock:
+                stats = self._stats.setdefault(key, PoolStats())
+                self._evict()
+        return stats
+
+    def _evict(self):
+        # Called with the lock held; a key leaves every dict at once
+        max_keys = max(self.max_keys, 1)
+        while len(self._loaders) > max_keys:
+            key, _ = self._loaders.popitem(last=False)
+            self._pools.pop(key, None)
+            self._stats.pop(key, None)
+            self.evictions += 1
+        while len(self._pools) > max_keys:
+            self._pools.popitem(last=False)
+        while len(self._stats) > max_keys:
+            self._stats.popitem(last=False)
+
+    def _instantiate(self, key):
+        with self._lock:
+            load_module = self._loaders.get(key)
+        if load_module is None:
+            raise KeyError(key)
+        store = Store(self.linker.engine)
+        # WASI context is replaced with the per-call config before running
+        store.set_wasi(WasiConfig())
+        if self.budgets is not None:
+            self.budgets.budget().arm(store)
+        instance, abi, entry = instantiate(self.linker, store, load_module())
+        self._stats_for(key).instantiations += 1
+        return PooledInstance(store, instance, entry, reusable=abi == REACTOR_ABI, abi=abi)
+
+    def _schedule_refill(self, key):
+        if self.size <= 0:
+            return
+        with self._lock:
+            if self._refills is None:
+                self._refills = queue.Queue()
+                worker = threading.Thread(target=self._refill_worker, name='wasm-instance-pool', daemon=True)
+                worker.start()
+        self._refills.put(key)
+
+    def _refill_worker(self):
+        while True:
+            key = self._refills.get()
+            try:
+                with self._lock:
+                    pool = self._pools.get(key)
+                    missing = self.size - len(pool) if pool is not None else 0
+                for _ in range(missing):
+                    pooled = self._instantiate(key)
+                    with self._lock:
+                        pool = self._pools.get(key)
+                        if pool is None or len(pool) >= self.size:
+                            break
+                        pool.append(pooled)
+            except Exception:
+                log.exception('instance pool refill failed for %s', key)
+
+
+def _memoize(load_module):
+    cached = []
+    def load():
+        if not cached:
+            cached.append(load_module())
+        return cached[0]
+    return load
@@ -0,0 +1,88 @@
+"""
+    authlib.oauth2.stateful.module_cache
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Per-process LRU cache of deserialized policy modules, keyed by policy hash.
+"""
+import threading
+from collections import OrderedDict
+
+from .artifact_store import load_module
+
+
+class ModuleCache(object):
+    """A bounded LRU cache of deserialized ``wasmtime.Module`` objects.
+
+    Deserializing a policy on every protected request costs a database fetch
+    of the serialized blob plus ``Module.deserialize``. Modules are immutable
+    and safe to share between stores of the same engine, so we keep the most
+    recently used ones around::
+
+        policy_module_cache = ModuleCache(maxsize=128)
+        module = policy_module_cache.get(policy_hash)
+        if module is None:
+            module = policy_module_cache.load(engine, policy_hash, serialized)
+
+    :param maxsize: Maximum number of modules kept in memory. ``0`` disables caching.
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._modules = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, policy_hash):
+        """Return the cached module for ``policy_hash``, or None on a miss."""
+        with self._lock:
+            module = self._modules.get(policy_hash)
+            if module is None:
+                self.misses += 1
+                return None
+            self._modules.move_to_end(policy_hash)
+            self.hits += 1
+            return module
+
+    def put(self, policy_hash, module):
+        """Insert a module, evicting the least recently used ones if full."""
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._modules[policy_hash] = module
+            self._modules.move_to_end(policy_hash)
+            while len(self._modules) > self.maxsize:
+                self._modules.popitem(last=False)
+                self.evictions += 1
+
+    def load(self, engine, policy_hash, serialized_module, artifact_path=None):
+        """Deserialize the policy (from ``artifact_path`` if it exists, see
+        :func:`~.artifact_store.load_module`) and cache it under ``policy_hash``.
+        """
+        module = load_module(engine, serialized_module, artifact_path)
+        self.put(policy_hash, module)
+        return module
+
+    def invalidate(self, policy_hash=None):
+        """Drop one policy from the cache, or all of them if no hash is given."""
+        with self._lock:
+            if policy_hash is None:
+                self._modules.clear()
+            else:
+                self._modules.pop(policy_hash, None)
+
+    def stats(self):
+        """Return the hit/miss counters of this cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._modules),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._modules)
@@ -0,0 +1,68 @@
+"""
+    authlib.oauth2.stateful.policy_abi
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    The two calling conventions a policy module can implement.
+
+    ``command``: a WASI command exporting ``_start``. The policy hash, request
+    JSON and history JSON are passed as ``argv`` and the verdict ("Accept" or
+    "Deny") is printed to stdout. An instance can only be run once.
+
+    ``reactor``: a module exporting ``memory``, ``alloc(len) -> ptr`` and
+    ``evaluate(ptr, len) -> i32`` (and optionally the WASI ``_initialize``).
+    The host allocates a buffer in the guest, writes the UTF-8 JSON document
+    ``{"request": <request>, "history": <history>}`` into it and calls
+    ``evaluate``, which owns the buffer from then on. ``1`` accepts, ``0``
+    denies and a negative value reports an error. An instance serves many
+    calls, and the input size is only bounded by the guest's memory.
+"""
+
+COMMAND_ABI = 'command'
+REACTOR_ABI = 'reactor'
+
+REACTOR_EXPORTS = ('memory', 'alloc', 'evaluate')
+
+
+class PolicyEvaluationError(Exception):
+    """Raised when a reactor policy's ``evaluate`` returns an error code."""
+
+
+def detect_abi(module):
+    """Return which ABI ``module`` implements, reactor taking precedence."""
+    names = {export.name for export in module.exports}
+    if all(name in names for name in REACTOR_EXPORTS):
+        return REACTOR_ABI
+    if '_start' in names:
+        return COMMAND_ABI
+    raise ValueError('module exports neither _start nor {}'.format(', '.join(REACTOR_EXPORTS)))
+
+
+def instantiate(linker, store, module):
+    """Instantiate ``module`` in ``store`` and return ``(instance, abi, entry)``,
+    where ``entry`` is ``_start`` for commands and ``evaluate`` for reactors.
+    The store must already have a WASI context.
+    """
+    abi = detect_abi(module)
+    instance = linker.instantiate(store, module)
+    exports = instance.exports(store)
+    if abi == REACTOR_ABI:
+        initialize = exports.get('_initialize')
+        if initialize is not None:
+            initialize(store)
+        return instance, abi, exports['evaluate']
+    return instance, abi, exports['_start']
+
+
+def reactor_input(request_str, history_str):
+    return '{{"request":{},"history":{}}}'.format(request_str, history_str or '{}').encode()
+
+
+def evaluate(store, instance, payload):
+    """Copy ``payload`` into the guest and return the result of ``evaluate``."""
+    exports = instance.exports(store)
+    ptr = exports['alloc'](store, len(payload))
+    exports['memory'].write(store, payload, ptr)
+    result = exports['evaluate'](store, ptr, len(payload))
+    if result < 0:
+        raise PolicyEvaluationError('policy evaluate() returned {}'.format(result))
+    return result
@@ -2,11 +2,18 @@ import time
 import json
 from urllib.parse import urlparse
 
+from contextlib import contextmanager
 from wasmtime import Linker, Module, Store, WasiConfig
 import os
 import tempfile
 import psutil
 
+from .policy_abi import REACTOR_ABI, evaluate, instantiate, reactor_input
+from .budget import arm
+
+# stdout_custom is a write-only property, so it only shows on the class
+CUSTOM_STDIO = hasattr(WasiConfig, 'stdout_custom')
+
 # Build the request JSON string to pass into policy program given a request object
 def build_request_JSON(request):
     # Build JSON data for request
@@ -51,35 +58,133 @@ def measure_memory():
     return memory_info.rss  # Resident Set Size (memory actually used)
 
 
-def run_policy(linker, policy_module, policy_hash, request_str, history_str):
-    # Design: https://docs.rs/wasmtime/latest/wasmtime/#example-architecture
+@contextmanager
+def wasi_output(config, stdio='memory'):
+    """Point the guest's stdout/stderr somewhere readable and yield a function
+    returning what the guest wrote to stdout.
 
-    config = WasiConfig()
-    if not history_str:
-        history_str = '{}'
-    config.argv = (policy_hash, request_str, history_str)
-    config.preopen_dir(".", "/")
-    # print("running policy with hash: " + policy_hash)
-    with tempfile.TemporaryDirectory() as chroot:
+    ``stdio='memory'`` collects the output through a WASI stdout callback, so no
+    file is touched on the hot path. ``stdio='file'`` (also used when the
+    installed wasmtime has no custom stdio support) writes to a temporary
+    directory as before.
+    """
+    if stdio == 'memory' and CUSTOM_STDIO:
+        chunks = []
+        config.stdout_custom = chunks.append
+        config.stderr_custom = lambda data: None
+        yield lambda: b''.join(chunks).decode()
+        return
 
+    with tempfile.TemporaryDirectory() as chroot:
         out_log = os.path.join(chroot, "out.log")
         err_log = os.path.join(chroot, "err.log")
         config.stdout_file = out_log
         config.stderr_file = err_log
 
-        # Store is a unit of isolation in wasmtime
-        # containes wasm objects
-        # We must have one Store per request, because Store dont' have GC and isolation.
-        store = Store(linker.engine)
-        store.set_wasi(config)
+        def read():
+            with open(out_log) as f:
+                return f.read()
+        yield read
 
-        # instantiated module
-        # both new store and instantiate are very cheap
-        instance = linker.instantiate(store, policy_module)
 
-        # _start is the default wasi main function
-        start = instance.exports(store)["_start"]
-        # memory = instance.exports(store)["memory"]
+def parse_policy_output(output):
+    """Parse what a command policy printed into ``(verdict, history)``.
+
+    The verdict is ``"Accept"``/``"Deny"``, or a per-object map such as
+    ``{"<obj_id>": "Accept", ...}`` for a policy that judges every object of a
+    batch separately, returned as a bool or ``{obj_id: bool}``. A fused module
+    (policy and update program in one) prints
+    ``{"verdict": <verdict>, "history": <updated batch history>}``; ``history``
+    is None for plain policies.
+    """
+    output = output.strip()
+    if output.startswith('{'):
+        try:
+            parsed = json.loads(output)
+        except ValueError:
+            parsed = None
+        if isinstance(parsed, dict):
+            if 'verdict' in parsed and 'history' in parsed:
+                return _to_verdict(parsed['verdict']), parsed['history']
+            return _to_verdict(parsed), None
+    if "Deny" in output:
+        return False, None
+    elif "Accept" in output:
+        return True, None
+    else:
+        return False, None
+
+
+def _to_verdict(verdict):
+    if isinstance(verdict, dict):
+        return {obj_id: v == "Accept" for obj_id, v in verdict.items()}
+    return verdict == "Accept"
+
+
+def resolve_verdicts(verdicts, partial_accept=False):
+    """Reduce a per-object verdict map to ``(accepted, accepted_ids)``.
+
+    The request is accepted if every object is. With ``partial_accept`` it is
+    also accepted when at least one object is, and ``accepted_ids`` names the
+    objects the endpoint may act on; it is None when no filtering is needed.
+    An empty map judges no object and is a denial.
+    """
+    if not verdicts:
+        return False, None
+    accepted_ids = {obj_id for obj_id, verdict in verdicts.items() if verdict}
+    if len(accepted_ids) == len(verdicts):
+        return True, None
+    if partial_accept and accepted_ids:
+        return True, accepted_ids
+    return False, None
+
+
+def run_policy(linker, policy_module, policy_hash, request_str, history_str, instance_pool=None, stdio='memory',
+               budget=None):
+    # Returns (verdict, history), see parse_policy_output
+    # budget (see budget.ExecutionBudgets) bounds the fuel and time of the run
+    # Design: https://docs.rs/wasmtime/latest/wasmtime/#example-architecture
+    if instance_pool is not None:
+        with instance_pool.instance(policy_hash, lambda: policy_module) as pooled:
+            arm(pooled.store, budget)
+            if pooled.abi == REACTOR_ABI:
+                return _run_policy_reactor(pooled.store, pooled.instance, request_str, history_str)
+            return _run_policy_instance(pooled.store, pooled.entry, policy_hash, request_str, history_str, stdio)
+
+    # Store is a unit of isolation in wasmtime
+    # containes wasm objects
+    # We must have one Store per request, because Store dont' have GC and isolation.
+    store = Store(linker.engine)
+    # reactors may touch WASI while initializing, commands get their
+    # per-call config in _run_policy_instance
+    store.set_wasi(WasiConfig())
+    # start functions and _initialize run under the same budget as the policy
+    arm(store, budget)
+
+    # instantiated module
+    # both new store and instantiate are very cheap
+    # entry is _start (the default wasi main function) or evaluate for reactors
+    instance, abi, entry = instantiate(linker, store, policy_module)
+    if abi == REACTOR_ABI:
+        return _run_policy_reactor(store, instance, request_str, history_str)
+    return _run_policy_instance(store, entry, policy_hash, request_str, history_str, stdio)
+
+
+def _run_policy_reactor(store, instance, request_str, history_str):
+    # Input goes straight into the guest's linear memory, no argv/stdout round trip
+    return evaluate(store, instance, reactor_input(request_str, history_str)) == 1, None
+
+
+def _run_policy_instance(store, start, policy_hash, request_str, history_str, stdio):
+
+    config = WasiConfig()
+    if not history_str:
+        history_str = '{}'
+    config.argv = (policy_hash, request_str, history_str)
+    config.preopen_dir(".", "/")
+    # print("running policy with hash: " + policy_hash)
+    with wasi_output(config, stdio) as read_output:
+        store.set_wasi(config)
 
         # Measure memory before running the WebAssembly program
         # start_memory = measure_memory()
@@ -95,12 +200,6 @@ def run_policy(linker, policy_module, policy_hash, request_str, history_str):
         # Calculate memory usage
         # memory_usage = end_memory - start_memory
         # print(f"Memory usage: {memory_usage} bytes")
-        with open(out_log) as f:
-            result = f.read()
-            # print("Policy returned: " + result)
-            if "Deny" in result:
-                return False
-            elif "Accept" in result:
-                return True
-            else:
-                return False
+        result = read_output()
+        # print("Policy returned: " + result)
+        return parse_policy_output(result)
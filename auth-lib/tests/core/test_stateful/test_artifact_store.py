@@ -0,0 +1,71 @@
+import os
+import tempfile
+import unittest
+
+from wasmtime import Config, Engine, Module, WasmtimeError, wat2wasm
+
+from authlib.oauth2.stateful.artifact_store import ArtifactStore, load_module, source_path
+
+WASM = bytes(wat2wasm('(module (func (export "f")))'))
+
+
+def _engine(consume_fuel=False):
+    config = Config()
+    config.consume_fuel = consume_fuel
+    return Engine(config)
+
+
+class ArtifactStoreTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.store = ArtifactStore(tmpdir.name)
+
+    def save(self, engine, source=True):
+        module = Module(engine, WASM)
+        return self.store.save(module.serialize(), 'ab' * 32, WASM if source else None)
+
+    def test_load(self):
+        engine = _engine()
+        path = self.save(engine)
+        self.assertTrue(os.path.exists(source_path(path)))
+        self.assertIn('f', [e.name for e in load_module(engine, artifact_path=path).exports])
+
+    def test_recompiled_for_other_engine_settings(self):
+        path = self.save(_engine())
+        engine = _engine(consume_fuel=True)
+        with self.assertRaises(WasmtimeError):
+            Module.deserialize_file(engine, path)
+        module = load_module(engine, artifact_path=path)
+        self.assertIn('f', [e.name for e in module.exports])
+        # the artifact was replaced by one the new engine accepts
+        Module.deserialize_file(engine, path)
+
+    def test_falls_back_to_database_bytes(self):
+        path = self.save(_engine(), source=False)
+        engine = _engine(consume_fuel=True)
+        serialized = Module(engine, WASM).serialize()
+        module = load_module(engine, lambda: serialized, path)
+        self.assertIn('f', [e.name for e in module.exports])
+        with self.assertRaises(WasmtimeError):
+            load_module(engine, lambda: None, path)
+
+    def test_missing(self):
+        with self.assertRaises(FileNotFoundError):
+            load_module(_engine(), None, os.path.join(self.store.root, 'missing.cwasm'))
+
+    def test_store(self):
+        engine = _engine()
+        wasm_path = os.path.join(self.store.root, 'policy.wasm')
+        with open(wasm_path, 'wb') as f:
+            f.write(WASM)
+        serialized, path = self.store.store(Module(engine, WASM), 'cd' * 32, wasm_path)
+        self.assertIsNone(serialized)
+        self.assertEqual(path, self.store.path_for('cd' * 32))
+        with open(source_path(path), 'rb') as f:
+            self.assertEqual(f.read(), WASM)
+
+        # a disabled store keeps the module in the database
+        serialized, path = ArtifactStore().store(Module(engine, WASM))
+        self.assertIsNone(path)
+        self.assertIn('f', [e.name for e in Module.deserialize(engine, serialized).exports])
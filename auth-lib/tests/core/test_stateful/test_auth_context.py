@@ -0,0 +1,72 @@
+import time
+import unittest
+from unittest import mock
+
+from sqlalchemy import Column, Integer, LargeBinary, String, create_engine, inspect
+from sqlalchemy.orm import Session, declarative_base, deferred
+
+from authlib.integrations.sqla_oauth2.auth_context import AuthContext, AuthContextCache
+
+Base = declarative_base()
+
+
+class Policy(Base):
+    __tablename__ = 'policy'
+    id = Column(Integer, primary_key=True)
+    policy_hash = Column(String(64))
+    serialized_module = deferred(Column(LargeBinary))
+
+
+class AuthContextCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        Base.metadata.create_all(self.engine)
+        with Session(self.engine) as session:
+            session.add(Policy(id=1, policy_hash='abc', serialized_module=b'module'))
+            session.commit()
+        self.cache = AuthContextCache(maxsize=2, ttl=5)
+
+    def load(self, session):
+        return session.query(Policy).filter_by(id=1).first()
+
+    def test_detached_copy(self):
+        with Session(self.engine) as session:
+            row = self.load(session)
+            self.cache.put('tok', 'policy', row)
+            cached = self.cache.get('tok', 'policy')
+            self.assertIsNot(cached, row)
+            self.assertTrue(inspect(cached).detached)
+            self.assertEqual(cached.policy_hash, 'abc')
+            # the deferred BLOB was not loaded, so it is not copied
+            self.assertIn('serialized_module', inspect(cached).unloaded)
+            # changes to the request's row do not reach the cache
+            row.policy_hash = 'changed'
+            self.assertEqual(self.cache.get('tok', 'policy').policy_hash, 'abc')
+
+    def test_merged_without_query(self):
+        with Session(self.engine) as session:
+            self.cache.put('tok', 'policy', self.load(session))
+        with Session(self.engine) as session:
+            context = AuthContext(session, 'tok', self.cache)
+            row = context.get('policy', lambda: self.fail('loaded from the database'))
+            self.assertIn(row, session)
+            self.assertIs(context.get('policy', None), row)
+            # deferred columns are fetched on first use
+            self.assertEqual(row.serialized_module, b'module')
+
+    def test_ttl(self):
+        with Session(self.engine) as session:
+            self.cache.put('tok', 'policy', self.load(session))
+        with mock.patch('authlib.integrations.sqla_oauth2.auth_context.time.time', return_value=time.time() + 6):
+            self.assertIsNone(self.cache.get('tok', 'policy'))
+
+    def test_invalidate(self):
+        with Session(self.engine) as session:
+            row = self.load(session)
+            for token in ('tok', 'other'):
+                self.cache.put(token, 'policy', row)
+        self.cache.invalidate('tok')
+        self.assertIsNone(self.cache.get('tok', 'policy'))
+        self.assertIsNotNone(self.cache.get('other', 'policy'))
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache), 0)
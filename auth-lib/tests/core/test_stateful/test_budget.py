@@ -0,0 +1,60 @@
+import time
+import unittest
+
+from wasmtime import Config, Engine, Linker, Module, Store, Trap
+
+from authlib.oauth2.stateful.budget import ExecutionBudgets, is_budget_exhausted
+from authlib.oauth2.stateful.instance_pool import InstancePool
+
+# A command whose start function and _start both count to 100000
+LOOP_WAT = '''
+(module
+  (func $loop (local i32)
+    (loop
+      (local.set 0 (i32.add (local.get 0) (i32.const 1)))
+      (br_if 0 (i32.lt_u (local.get 0) (i32.const 100000)))))
+  (start $loop)
+  (export "_start" (func $loop)))
+'''
+
+SPIN_WAT = '(module (func (export "_start") (loop (br 0))))'
+
+
+class EpochDeadlineTest(unittest.TestCase):
+    def setUp(self):
+        config = Config()
+        config.epoch_interruption = True
+        self.engine = Engine(config)
+        self.budgets = ExecutionBudgets(self.engine, epoch_interruption=True, epoch_tick_ms=1)
+        self.loop = Module(self.engine, LOOP_WAT)
+
+    def run_loop(self, budget):
+        store = Store(self.engine)
+        budget.arm(store)
+        instance = Linker(self.engine).instantiate(store, self.loop)
+        instance.exports(store)['_start'](store)
+
+    def start_ticker(self):
+        self.run_loop(self.budgets.budget(deadline_ms=1000))
+        time.sleep(0.02)
+
+    def test_deadline_interrupts(self):
+        store = Store(self.engine)
+        self.budgets.budget(deadline_ms=5).arm(store)
+        instance = Linker(self.engine).instantiate(store, Module(self.engine, SPIN_WAT))
+        with self.assertRaises(Trap) as cm:
+            instance.exports(store)['_start'](store)
+        self.assertTrue(is_budget_exhausted(cm.exception))
+
+    def test_no_deadline_after_a_deadline_client(self):
+        self.start_ticker()
+        self.run_loop(self.budgets.budget())
+        self.run_loop(self.budgets.budget(deadline_ms=None))
+
+    def test_pool_refill_after_a_deadline_client(self):
+        self.start_ticker()
+        pool = InstancePool(Linker(self.engine), size=1, budgets=self.budgets)
+        with pool.instance('loop', lambda: self.loop) as pooled:
+            self.budgets.budget().arm(pooled.store)
+            pooled.entry(pooled.store)
+        self.assertEqual(pool.stats('loop')['errors'], 0)
@@ -0,0 +1,75 @@
+import json
+import time
+import unittest
+from unittest import mock
+
+from authlib.oauth2.stateful.decision_cache import DecisionCache, parse_projection
+
+
+def _request(path='/api/events', method='GET', content_type='application/json', time_=1.0):
+    return json.dumps({'method': method, 'path': path, 'uri': 'http://localhost' + path, 'body': 'null',
+                       'headers': {'Content-Type': content_type}, 'time': time_})
+
+
+class DecisionCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = DecisionCache(maxsize=4)
+
+    def test_key_projection(self):
+        self.cache.register('p', parse_projection('method, headers.Content-Type'))
+        key = self.cache.key('p', _request(), '{}')
+        # fields outside the projection do not change the key
+        self.assertEqual(self.cache.key('p', _request(path='/api/other', time_=2.0), '{}'), key)
+        self.assertNotEqual(self.cache.key('p', _request(method='POST'), '{}'), key)
+        self.assertNotEqual(self.cache.key('p', _request(content_type='text/plain'), '{}'), key)
+        self.assertNotEqual(self.cache.key('p', _request(), '{"obj": []}'), key)
+
+        # without a projection everything but the time counts
+        self.cache.register('q')
+        key = self.cache.key('q', _request(), '{}')
+        self.assertEqual(self.cache.key('q', _request(time_=2.0), '{}'), key)
+        self.assertNotEqual(self.cache.key('q', _request(path='/api/other'), '{}'), key)
+
+    def test_hit(self):
+        self.cache.register('p')
+        key = self.cache.key('p', _request(), '{}')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.put(key, True)
+        self.assertIs(self.cache.get(key), True)
+        self.assertEqual(self.cache.stats()['hits'], 1)
+
+    def test_ttl(self):
+        self.cache.register('p', ttl=60)
+        key = self.cache.key('p', _request(), '{}')
+        self.cache.put(key, True)
+        with mock.patch('authlib.oauth2.stateful.decision_cache.time.time', return_value=time.time() + 30):
+            self.assertIs(self.cache.get(key), True)
+        with mock.patch('authlib.oauth2.stateful.decision_cache.time.time', return_value=time.time() + 61):
+            self.assertIsNone(self.cache.get(key))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_rejects_unregistered_policy(self):
+        # a policy not declared deterministic never gets a key or a cached verdict
+        self.assertIsNone(self.cache.key('p', _request(), '{}'))
+        self.cache.put(('p', '[]', ''), True)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_invalidate(self):
+        for policy_hash in ('p', 'q'):
+            self.cache.register(policy_hash)
+            self.cache.put(self.cache.key(policy_hash, _request(), '{}'), True)
+        q_key = self.cache.key('q', _request(), '{}')
+        self.cache.invalidate('p')
+        self.assertIsNone(self.cache.key('p', _request(), '{}'))
+        self.assertIs(self.cache.get(q_key), True)
+        self.cache.invalidate()
+        self.assertEqual(self.cache.stats()['policies'], 0)
+        self.assertEqual(len(self.cache), 0)
+
+    def test_evicts_least_recently_used(self):
+        self.cache.register('p')
+        keys = [self.cache.key('p', _request(path='/%d' % i), '{}') for i in range(5)]
+        for key in keys:
+            self.cache.put(key, True)
+        self.assertIsNone(self.cache.get(keys[0]))
+        self.assertEqual(self.cache.stats()['evictions'], 1)
@@ -0,0 +1,27 @@
+import unittest
+
+from authlib.oauth2.stateful.engine_profile import EngineProfile
+
+
+class EngineProfileTest(unittest.TestCase):
+    def test_from_mapping(self):
+        profile = EngineProfile.from_mapping({'WASM_CONSUME_FUEL': 'true', 'WASM_DEFAULT_FUEL': '1000',
+                                              'WASM_CACHE_DIR': ''})
+        self.assertIs(profile['WASM_CONSUME_FUEL'], True)
+        self.assertEqual(profile['WASM_DEFAULT_FUEL'], 1000)
+        self.assertIsNone(profile['WASM_CACHE_DIR'])
+        with self.assertRaises(ValueError):
+            EngineProfile(WASM_UNKNOWN=1)
+
+    def test_reservation_smaller_than_pooling_slots(self):
+        profile = EngineProfile.from_mapping({'WASM_POOLING_ALLOCATOR': 'true', 'WASM_MEMORY_RESERVATION': '1048576'})
+        with self.assertRaises(ValueError):
+            profile.to_config()
+        # without pooling the reservation alone is fine
+        EngineProfile(WASM_MEMORY_RESERVATION=1048576).to_config()
+
+    def test_pooling(self):
+        profile = EngineProfile(WASM_POOLING_ALLOCATOR=True, WASM_POOLING_TOTAL_INSTANCES=8,
+                                WASM_POOLING_TOTAL_MEMORIES=8, WASM_POOLING_TOTAL_TABLES=8,
+                                WASM_POOLING_MAX_MEMORY_SIZE=1 << 20, WASM_MEMORY_RESERVATION=1 << 20)
+        self.assertGreaterEqual(profile.self_check(profile.create_engine()), 0)
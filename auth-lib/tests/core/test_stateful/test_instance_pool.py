@@ -0,0 +1,43 @@
+import unittest
+
+from wasmtime import Engine, Linker, Module
+
+from authlib.oauth2.stateful.instance_pool import InstancePool
+
+# A reactor, so that instances go back to the pool
+REACTOR_WAT = '''
+(module
+  (memory (export "memory") 1)
+  (func (export "alloc") (param i32) (result i32) (i32.const 0))
+  (func (export "evaluate") (param i32 i32) (result i32) (i32.const 1)))
+'''
+
+
+class InstancePoolTest(unittest.TestCase):
+    def setUp(self):
+        engine = Engine()
+        linker = Linker(engine)
+        linker.define_wasi()
+        self.module = Module(engine, REACTOR_WAT)
+        self.pool = InstancePool(linker, size=1, max_keys=2)
+
+    def run_key(self, key):
+        with self.pool.instance(key, lambda: self.module) as pooled:
+            self.assertEqual(pooled.entry(pooled.store, 0, 0), 1)
+
+    def test_reuses_instances(self):
+        self.run_key('a')
+        self.run_key('a')
+        self.assertEqual(self.pool.stats('a')['pool_hits'], 1)
+
+    def test_least_recently_used_keys_are_evicted(self):
+        for key in ('a', 'b', 'a', 'c'):
+            self.run_key(key)
+        self.assertEqual(sorted(self.pool.stats()), ['a', 'c'])
+        self.assertEqual(list(self.pool._loaders), ['a', 'c'])
+        self.assertEqual(list(self.pool._pools), ['a', 'c'])
+        self.assertEqual(self.pool.evictions, 1)
+        # an evicted key starts over
+        self.run_key('b')
+        self.assertEqual(self.pool.stats('b')['pool_misses'], 1)
+        self.assertEqual(len(self.pool._loaders), 2)
@@ -0,0 +1,50 @@
+import unittest
+
+from wasmtime import Engine, Module
+
+from authlib.oauth2.stateful.module_cache import ModuleCache
+
+WAT = '(module (func (export "f")))'
+
+
+class ModuleCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = Engine()
+        self.serialized = Module(self.engine, WAT).serialize()
+        self.cache = ModuleCache(maxsize=2)
+
+    def test_miss_then_hit(self):
+        self.assertIsNone(self.cache.get('a'))
+        module = self.cache.load(self.engine, 'a', self.serialized)
+        self.assertIs(self.cache.get('a'), module)
+        stats = self.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']), (1, 1, 1))
+
+    def test_deferred_bytes(self):
+        fetched = []
+        self.cache.load(self.engine, 'a', lambda: fetched.append(1) or self.serialized)
+        self.cache.get('a')
+        self.assertEqual(fetched, [1])
+
+    def test_evicts_least_recently_used(self):
+        for policy_hash in ('a', 'b'):
+            self.cache.load(self.engine, policy_hash, self.serialized)
+        self.cache.get('a')
+        self.cache.load(self.engine, 'c', self.serialized)
+        self.assertIsNone(self.cache.get('b'))
+        self.assertIsNotNone(self.cache.get('a'))
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_invalidate(self):
+        for policy_hash in ('a', 'b'):
+            self.cache.load(self.engine, policy_hash, self.serialized)
+        self.cache.invalidate('a')
+        self.assertIsNone(self.cache.get('a'))
+        self.assertIsNotNone(self.cache.get('b'))
+        self.cache.invalidate()
+        self.assertEqual(len(self.cache), 0)
+
+    def test_disabled(self):
+        cache = ModuleCache(maxsize=0)
+        self.assertIsNotNone(cache.load(self.engine, 'a', self.serialized))
+        self.assertIsNone(cache.get('a'))
@@ -0,0 +1,24 @@
+import unittest
+
+from authlib.oauth2.stateful.validator_helper import parse_policy_output, resolve_verdicts
+
+
+class ResolveVerdictsTest(unittest.TestCase):
+    def test_all_accepted(self):
+        self.assertEqual(resolve_verdicts({'a': True, 'b': True}), (True, None))
+        self.assertEqual(resolve_verdicts({'a': True, 'b': True}, partial_accept=True), (True, None))
+
+    def test_some_denied(self):
+        self.assertEqual(resolve_verdicts({'a': True, 'b': False}), (False, None))
+        self.assertEqual(resolve_verdicts({'a': True, 'b': False}, partial_accept=True), (True, {'a'}))
+
+    def test_all_denied(self):
+        self.assertEqual(resolve_verdicts({'a': False}, partial_accept=True), (False, None))
+
+    def test_empty_map_is_denied(self):
+        self.assertEqual(resolve_verdicts({}), (False, None))
+        self.assertEqual(resolve_verdicts({}, partial_accept=True), (False, None))
+
+    def test_parsed_empty_map_is_denied(self):
+        verdicts, history = parse_policy_output('{}')
+        self.assertEqual(resolve_verdicts(verdicts), (False, None))
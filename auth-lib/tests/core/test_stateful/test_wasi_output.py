@@ -0,0 +1,45 @@
+import unittest
+from unittest import mock
+
+from wasmtime import Engine, Linker, Module, Store, WasiConfig
+
+from authlib.oauth2.stateful import validator_helper
+from authlib.oauth2.stateful.validator_helper import wasi_output
+
+# A WASI command printing "Accept"
+ACCEPT_WAT = '''
+(module
+  (import "wasi_snapshot_preview1" "fd_write" (func $fd_write (param i32 i32 i32 i32) (result i32)))
+  (memory (export "memory") 1)
+  (data (i32.const 16) "Accept")
+  (func (export "_start")
+    (i32.store (i32.const 0) (i32.const 16))
+    (i32.store (i32.const 4) (i32.const 6))
+    (drop (call $fd_write (i32.const 1) (i32.const 0) (i32.const 1) (i32.const 8)))))
+'''
+
+
+class WasiOutputTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = Engine()
+        self.linker = Linker(self.engine)
+        self.linker.define_wasi()
+        self.module = Module(self.engine, ACCEPT_WAT)
+
+    def run_command(self, stdio):
+        store = Store(self.engine)
+        config = WasiConfig()
+        with wasi_output(config, stdio) as read_output:
+            store.set_wasi(config)
+            instance = self.linker.instantiate(store, self.module)
+            instance.exports(store)['_start'](store)
+            return read_output()
+
+    def test_memory_creates_no_file(self):
+        self.assertTrue(validator_helper.CUSTOM_STDIO)
+        with mock.patch.object(validator_helper.tempfile, 'TemporaryDirectory') as tmpdir:
+            self.assertEqual(self.run_command('memory'), 'Accept')
+        tmpdir.assert_not_called()
+
+    def test_file(self):
+        self.assertEqual(self.run_command('file'), 'Accept')
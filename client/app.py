@@ -17,6 +17,8 @@ sys.path.append(parent_dir)
 
 from authlib.integrations.flask_client import OAuth
 from historylib.client_utils import get_history, history_to_file, delete_history_file, get_batchhistory, batch_history_to_file
+from historylib.client_utils import batchhistory_to_header, batchhistory_from_header
+from historylib.wire import FORMAT_HEADER, BINARY, ENCODING_HEADER
 from historylib.batch_history_list import BatchHistoryList
 
 app = Flask(__name__)
@@ -38,6 +40,8 @@ oauth.register(
 policy_dict = build_policy_decription_dict()
 policy_dict.update({'null': 'No Policy, for vanilla OAuth 2.0'})
 history_path = app.config['HISTORY_DIRECTORY']
+binary_history = app.config['HISTORY_FORMAT'] == BINARY
+history_encoding = app.config['HISTORY_ENCODING']
 is_macaroon = app.config['MACAROON']
 if not os.path.exists(history_path):
    os.makedirs(history_path)
@@ -109,13 +113,17 @@ def make_request():
                 'Authorization': f'Bearer {token["access_token"]}',
                 'Authorization-History': '',
             }
+            if binary_history:
+                headers[FORMAT_HEADER] = BINARY
+            if history_encoding:
+                headers[ENCODING_HEADER] = history_encoding
 
         objs_to_be_accessed=[]
         # get history attached with this obj
         if input_api_append:
             objs_to_be_accessed = [input_api_append]
             obj_history = get_batchhistory(objs_to_be_accessed, history_path, token["access_token"])
-            headers['Authorization-History'] = obj_history.to_json()
+            headers['Authorization-History'] = batchhistory_to_header(obj_history, binary_history, history_encoding)
         
         send_time = 0
         recv_time = 0
@@ -133,7 +141,7 @@ def make_request():
                 obj_ids = body_json.get('ids')
                 if obj_ids:
                     obj_history = get_batchhistory(obj_ids, history_path, token["access_token"])
-                    headers['Authorization-History'] = obj_history.to_json()
+                    headers['Authorization-History'] = batchhistory_to_header(obj_history, binary_history, history_encoding)
                 send_time = time.time()
                 response = requests.post(target_api, headers=headers, data=request_body) 
                 recv_time = time.time()
@@ -158,7 +166,8 @@ def make_request():
                 new_auth_history = response.headers.get('Set-Authorization-History')
                 if new_auth_history:
                     print(response.headers.get('Set-Authorization-History'))
-                    resp_hist_list = BatchHistoryList(json_str=response.headers.get('Set-Authorization-History'))
+                    resp_hist_list = batchhistory_from_header(new_auth_history, response.headers.get(FORMAT_HEADER) == BINARY,
+                                                              response.headers.get(ENCODING_HEADER))
                     batch_history_to_file(resp_hist_list, history_path, token["access_token"])
 
             # Record e2e latecy
@@ -13,4 +13,8 @@ CLIENT_KWARGS = {
     'policy_hashes': read_policy_hashes()
 }
 HISTORY_DIRECTORY = os.path.join(os.getcwd(), "history")
-MACAROON = os.getenv('MACAROON', False) 
\ No newline at end of file
+MACAROON = os.getenv('MACAROON', False)
+# 'json' or 'binary' (compact encoding of Authorization-History, see historylib.wire)
+HISTORY_FORMAT = os.getenv('HISTORY_FORMAT', 'json')
+# Compression of the history headers: 'deflate' or unset
+HISTORY_ENCODING = os.getenv('HISTORY_ENCODING') 
\ No newline at end of file
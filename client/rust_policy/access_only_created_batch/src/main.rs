@@ -0,0 +1,59 @@
+// Same policy as access_only_created, but with one verdict per object, e.g.
+// {"<obj_id>": "Accept", "<obj_id>": "Deny"}, so that endpoints
+// decorated with historylib.server_utils.partial_accept can serve the accepted
+// objects of a batch.
+use serde::Deserialize;
+use std::collections::HashMap;
+use std::env;
+
+#[derive(Deserialize)]
+struct Request {
+    path: String,
+}
+
+#[derive(Deserialize)]
+struct History {
+    api: String,
+    method: String,
+}
+
+type HistoryMap = HashMap<String, Vec<History>>;
+
+fn main() {
+    let args: Vec<String> = env::args().collect();
+    if args.len() < 3 {
+        println!("Deny");
+        return;
+    }
+    let parsed_req: Request = match serde_json::from_str(&args[1]) {
+        Ok(v) => v,
+        Err(_) => {
+            println!("Deny");
+            return;
+        }
+    };
+    let parsed_hist: HistoryMap = match serde_json::from_str(&args[2]) {
+        Ok(v) => v,
+        Err(_) => {
+            println!("Deny");
+            return;
+        }
+    };
+
+    // Accept if creating a new event, or if not an event API at all.
+    if !parsed_req.path.starts_with("/api/events") || parsed_req.path == "/api/events" {
+        println!("Accept");
+        return;
+    }
+
+    // Only accept the events created w/ this token.
+    let mut verdicts: HashMap<&str, &str> = HashMap::new();
+    for (obj_id, history) in parsed_hist.iter() {
+        let found = history.iter().any(|entry| entry.method == "POST" && entry.api == "/api/events");
+        verdicts.insert(obj_id, if found { "Accept" } else { "Deny" });
+    }
+    match serde_json::to_string(&verdicts) {
+        Ok(out) => println!("{}", out),
+        Err(_) => println!("Deny"),
+    }
+}
@@ -0,0 +1,61 @@
+// Same policy as access_only_created, built as a reactor: the server writes
+// {"request": ..., "history": ...} into our memory and calls evaluate().
+use serde::Deserialize;
+use std::collections::HashMap;
+
+#[derive(Deserialize)]
+struct Request {
+    path: String,
+}
+
+#[derive(Deserialize)]
+struct History {
+    api: String,
+    method: String,
+}
+
+type HistoryMap = HashMap<String, Vec<History>>;
+
+#[derive(Deserialize)]
+struct Input {
+    request: Request,
+    history: HistoryMap,
+}
+
+const ACCEPT: i32 = 1;
+const DENY: i32 = 0;
+const INVALID_INPUT: i32 = -1;
+
+// Called by the host to reserve `len` bytes for the input.
+#[no_mangle]
+pub extern "C" fn alloc(len: usize) -> *mut u8 {
+    let mut buf: Vec<u8> = Vec::with_capacity(len);
+    let ptr = buf.as_mut_ptr();
+    std::mem::forget(buf);
+    ptr
+}
+
+// Takes ownership of the buffer returned by alloc(), so it is freed here.
+#[no_mangle]
+pub extern "C" fn evaluate(ptr: *mut u8, len: usize) -> i32 {
+    let input = unsafe { Vec::from_raw_parts(ptr, len, len) };
+    match serde_json::from_slice::<Input>(&input) {
+        Ok(parsed) => decide(&parsed),
+        Err(_) => INVALID_INPUT,
+    }
+}
+
+fn decide(input: &Input) -> i32 {
+    // Accept if creating a new event, or if not an event API at all.
+    if !input.request.path.starts_with("/api/events") || input.request.path == "/api/events" {
+        return ACCEPT;
+    }
+    // Only accept if all the events are created w/ this token.
+    for history in input.history.values() {
+        let found = history.iter().any(|entry| entry.method == "POST" && entry.api == "/api/events");
+        if !found {
+            return DENY;
+        }
+    }
+    ACCEPT
+}
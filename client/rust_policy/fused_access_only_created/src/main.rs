@@ -0,0 +1,88 @@
+// access_only_created and the update program in one module. Prints
+// {"verdict": "Accept"|"Deny", "history": <updated batch history>}, so the
+// server runs a single program per request instead of the policy and then
+// the update program. Register it as "Fused Policy + State Updater WASM".
+use serde::{Deserialize, Serialize};
+use std::collections::HashMap;
+use std::env;
+
+#[derive(Deserialize)]
+struct Request {
+    method: String,
+    path: String,
+    time: f64,
+}
+
+#[derive(Deserialize, Serialize)]
+struct History {
+    api: String,
+    method: String,
+    counter: i32,
+    timestamp: f64,
+}
+
+type HistoryMap = HashMap<String, Vec<History>>;
+
+#[derive(Serialize)]
+struct Output<'a> {
+    verdict: &'a str,
+    history: &'a HistoryMap,
+}
+
+fn main() {
+    let args: Vec<String> = env::args().collect();
+    if args.len() < 3 {
+        println!("Deny");
+        return;
+    }
+    let parsed_req: Request = match serde_json::from_str(&args[1]) {
+        Ok(v) => v,
+        Err(_) => {
+            println!("Deny");
+            return;
+        }
+    };
+    let mut parsed_hist: HistoryMap = match serde_json::from_str(&args[2]) {
+        Ok(v) => v,
+        Err(_) => {
+            println!("Deny");
+            return;
+        }
+    };
+
+    let verdict = if check(&parsed_req, &parsed_hist) { "Accept" } else { "Deny" };
+    if verdict == "Accept" {
+        update(&parsed_req, &mut parsed_hist);
+    }
+    match serde_json::to_string(&Output { verdict, history: &parsed_hist }) {
+        Ok(out) => print!("{}", out),
+        Err(_) => println!("Deny"),
+    }
+}
+
+// The policy: only access the events created w/ this token.
+fn check(req: &Request, hist: &HistoryMap) -> bool {
+    if !req.path.starts_with("/api/events") || req.path == "/api/events" {
+        return true;
+    }
+    hist.values()
+        .all(|history| history.iter().any(|entry| entry.method == "POST" && entry.api == "/api/events"))
+}
+
+// The update program: count this request in every object's history.
+fn update(req: &Request, hist: &mut HistoryMap) {
+    for history in hist.values_mut() {
+        match history.iter_mut().find(|entry| entry.method == req.method && entry.api == req.path) {
+            Some(entry) => {
+                entry.counter += 1;
+                entry.timestamp = req.time;
+            }
+            None => history.push(History {
+                api: req.path.clone(),
+                method: req.method.clone(),
+                counter: 0,
+                timestamp: req.time,
+            }),
+        }
+    }
+}
@@ -2,10 +2,59 @@
 
 import time
 import ujson as json
+from collections.abc import MutableMapping
 from .history import History
 from .history_list import HistoryList
+from . import wire
 import hashlib
 
+class _LazyHistoryLists(MutableMapping):
+    """obj_id -> HistoryList over a decoded batch; an object's HistoryList is only
+    built the first time it is looked up."""
+
+    def __init__(self, batch):
+        # obj_id -> HistoryList, or its decoded history (entry dicts) until it is looked up
+        self._data = dict(batch)
+
+    def __getitem__(self, obj_id):
+        history_list = self._data[obj_id]
+        if not isinstance(history_list, HistoryList):
+            # HistoryList takes the decoded entries as they are, no need to re-encode them
+            history_list = HistoryList(obj_id, history_list)
+            self._data[obj_id] = history_list
+        return history_list
+
+    def __setitem__(self, obj_id, history_list):
+        self._data[obj_id] = history_list
+
+    def __delitem__(self, obj_id):
+        del self._data[obj_id]
+
+    def __contains__(self, obj_id):
+        return obj_id in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def count_entries(self):
+        """Number of history entries, without building the objects not looked up yet."""
+        count = 0
+        for obj_id, history in self._data.items():
+            if isinstance(history, HistoryList):
+                count += len(history.entries)
+                continue
+            if isinstance(history, dict):
+                # {obj_id: [...]}, as printed by BatchHistoryList.to_json
+                history = history.get(obj_id)
+            elif isinstance(history, str):
+                history = json.loads(history) if history else None
+            count += len(history) if history else 0
+        return count
+
+
 # {
 #   obj_id1 : [history_entry1, history_entry2, ...]
 #   obj_id2 : [history_entry1, history_entry2, ...]
@@ -13,7 +62,10 @@ import hashlib
 # }
 class BatchHistoryList:
 
-    def __init__(self, historylists=None, json_str=None):
+    # wire_str: the binary encoding of historylib.wire
+    # batch: an already decoded batch ({obj_id: [entry, ...]}), e.g. the request's shared parse
+    # Per-object HistoryLists of a decoded batch are built on first access to entries[obj_id].
+    def __init__(self, historylists=None, json_str=None, wire_str=None, batch=None):
         # A dict of (obj_id, historylist)
         self.entries = {}
         if historylists and len(historylists) > 0:
@@ -22,11 +74,10 @@ class BatchHistoryList:
                     self.entries[historylist.obj_id] = historylist
             else:
                 raise ValueError("historylists should be a list of HistoryList objects")
-        elif json_str is not None:
-            bhl_dict = json.loads(json_str)
-            for obj_id, historylist_dict in bhl_dict.items():
-                currHistoryList = HistoryList(obj_id, json.dumps(historylist_dict))
-                self.entries[obj_id] = currHistoryList
+        elif json_str is not None or wire_str is not None or batch is not None:
+            if batch is None:
+                batch = json.loads(json_str) if json_str is not None else wire.loads(wire_str)
+            self.entries = _LazyHistoryLists(batch)
 
 
     def __str__(self):
@@ -45,6 +96,10 @@ class BatchHistoryList:
         for k, v in self.entries.items():
             entries_dict.update({k: v.to_dict()})
         return json.dumps(entries_dict)
+
+    def to_wire(self):
+        """Binary encoding of the batch, see historylib.wire."""
+        return wire.dumps({k: [hist.to_dict() for hist in v.entries] for k, v in self.entries.items()})
     
     def get_num_objects(self):
         """Number of objects in the batch history list."""
@@ -52,6 +107,8 @@ class BatchHistoryList:
     
     def get_num_history_entries(self):
         """Length of history entries in the batch history list."""
+        if isinstance(self.entries, _LazyHistoryLists):
+            return self.entries.count_entries()
         return sum([len(v.entries) for _, v in self.entries.items()])
 
 
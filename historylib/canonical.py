@@ -0,0 +1,52 @@
+"""Canonical byte encoding of a per-object history list, the input of its digest.
+
+The encoding of the history list of ``obj_id`` is the compact ujson encoding of
+``{obj_id: [entry, ...]}`` with every entry's keys in ``HISTORY_FIELDS`` order,
+i.e. exactly what ``HistoryList(obj_id, ...).to_json()`` produces, so digests
+computed here and through ``HistoryList`` are interchangeable.
+
+Entries decoded from a header or updater output that are already in that shape
+are encoded as they are, without building ``History`` objects or new dicts.
+"""
+import hmac
+import hashlib
+import ujson as json
+
+HISTORY_FIELDS = ('api', 'method', 'counter', 'timestamp')
+
+
+def loads_batch(json_str):
+    """Decode a batch history (``{obj_id: [entry, ...]}``) with the decoder ``HistoryList`` uses."""
+    if not json_str:
+        return {}
+    return json.loads(json_str) if isinstance(json_str, (str, bytes)) else json_str
+
+
+def dumps_batch(batch):
+    """Encode a batch history back to JSON, as ``loads_batch`` decodes it."""
+    return json.dumps(batch)
+
+
+def history_list_bytes(obj_id, entries):
+    """Canonical bytes of the history list of ``obj_id``.
+
+    ``entries`` is a list of entry dicts, or ``{obj_id: [...]}`` as printed by some
+    update programs.
+    """
+    obj_id = str(obj_id)
+    if isinstance(entries, (str, bytes)):
+        entries = json.loads(entries)
+    if isinstance(entries, dict):
+        entries = entries[obj_id]
+    entries = entries or []
+    if not all(tuple(entry) == HISTORY_FIELDS for entry in entries):
+        entries = [{field: entry[field] for field in HISTORY_FIELDS} for entry in entries]
+    return json.dumps({obj_id: entries}).encode()
+
+
+def history_list_digest(obj_id, entries, hmac_key=None):
+    """HMAC-SHA256 of the canonical bytes under ``hmac_key``, or their SHA-256 without one."""
+    data = history_list_bytes(obj_id, entries)
+    if hmac_key is not None:
+        return hmac.new(hmac_key.encode(), data, hashlib.sha256).hexdigest()
+    return hashlib.sha256(data).hexdigest()
@@ -1,6 +1,8 @@
 from .history import History
 from .history_list import HistoryList
 from .batch_history_list import BatchHistoryList
+from .merkle import MerkleTree
+from . import wire
 import os
 import json
 
@@ -65,6 +67,37 @@ def get_batchhistory(filename_list: list, directory, token):
     return BatchHistoryList(historylists=history_lists)
 
 
+# Authorization-History value of a batch, in the binary format of historylib.wire
+# when the client sends Authorization-History-Format: binary, compressed when it
+# sends an Authorization-History-Encoding
+def batchhistory_to_header(history_lists: BatchHistoryList, binary=False, encoding=None):
+    value = history_lists.to_wire() if binary else history_lists.to_json()
+    if wire.is_compressed(encoding):
+        value = wire.compress(value, encoding)
+    return value
+
+
+# BatchHistoryList from a Set-Authorization-History value, binary when the response
+# carries Authorization-History-Format: binary, compressed with its Authorization-History-Encoding
+def batchhistory_from_header(value, binary=False, encoding=None):
+    if wire.is_compressed(encoding):
+        value = wire.decompress(value, encoding)
+    if binary:
+        return BatchHistoryList(wire_str=value)
+    return BatchHistoryList(json_str=value)
+
+
+# Merkle tree over every history this token has in the directory, to prove
+# the touched objects when the server runs with INTEGRITY_CHECK = 'merkle'
+def get_history_tree(directory, token):
+    histories = {}
+    for filename in os.listdir(directory):
+        hist_dict = load_history_file_to_dict(filename, directory)
+        if token in hist_dict:
+            histories[filename] = hist_dict[token]
+    return MerkleTree.from_histories(histories)
+
+
 def delete_history_file(filename, directory):
     file_path = os.path.join(directory, filename)
     if os.path.exists(file_path):
@@ -0,0 +1,102 @@
+"""Write-through cache of the history list digests stored in the server database."""
+import time
+import threading
+from collections import OrderedDict
+
+
+class DigestCache:
+    """A bounded LRU map of (access_token, object_id) -> history_list_hash.
+
+    Validation reads digests from here and only queries the database for the
+    misses; every write of a digest (update, DELETE, token revocation) goes to the
+    database first and is then applied here, so a restarted process starts cold
+    but never wrong.
+
+    The cache lives in one process. With several workers a digest written by one
+    of them is only seen by the others once their entry expires, so set ``ttl``
+    (or ``maxsize=0`` to disable caching) when running more than one worker.
+    """
+    def __init__(self, maxsize=10000, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._digests = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.maxsize > 0
+
+    def get_many(self, token, object_ids):
+        """Return the cached digests of ``object_ids`` as ``{object_id: digest}``, misses left out."""
+        found = {}
+        now = time.time()
+        with self._lock:
+            for object_id in object_ids:
+                key = (token, str(object_id))
+                entry = self._digests.get(key)
+                if entry is not None and entry[1] is not None and entry[1] < now:
+                    del self._digests[key]
+                    entry = None
+                if entry is None:
+                    self.misses += 1
+                    continue
+                self._digests.move_to_end(key)
+                self.hits += 1
+                found[str(object_id)] = entry[0]
+        return found
+
+    def put_many(self, token, digests):
+        """Cache ``{object_id: digest}`` for ``token``, evicting the least recently used if full."""
+        if not self.enabled:
+            return
+        expires_at = time.time() + self.ttl if self.ttl else None
+        with self._lock:
+            for object_id, digest in digests.items():
+                key = (token, str(object_id))
+                self._digests[key] = (digest, expires_at)
+                self._digests.move_to_end(key)
+            while len(self._digests) > self.maxsize:
+                self._digests.popitem(last=False)
+                self.evictions += 1
+
+    def evict(self, token, object_ids):
+        """Forget the digests of ``object_ids`` (e.g. after they were deleted)."""
+        with self._lock:
+            for object_id in object_ids:
+                self._digests.pop((token, str(object_id)), None)
+
+    def evict_objects(self, object_ids):
+        """Forget the digests of ``object_ids`` for every token."""
+        object_ids = {str(object_id) for object_id in object_ids}
+        with self._lock:
+            for key in [k for k in self._digests if k[1] in object_ids]:
+                del self._digests[key]
+
+    def evict_token(self, token):
+        """Forget every digest of a revoked token."""
+        with self._lock:
+            for key in [k for k in self._digests if k[0] == token]:
+                del self._digests[key]
+
+    def clear(self):
+        with self._lock:
+            self._digests.clear()
+
+    def stats(self):
+        """Return the hit/miss/eviction counters of this cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._digests),
+                'maxsize': self.maxsize,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+    def __len__(self):
+        return len(self._digests)
@@ -4,13 +4,15 @@ import time
 import ujson as json
 
 class History:
+    # no per-entry __dict__, one of these is built for every entry of every request
+    __slots__ = ('api', 'method', 'counter', 'timestamp')
 
     # TODO: Make definition of state generic
     def __init__(self, api, method, counter=0, timestamp=None):
         self.api = api
         self.method = method
         self.counter = counter
-        if timestamp == None:
+        if timestamp is None:
             self.timestamp = time.time()
         else:
             self.timestamp = timestamp
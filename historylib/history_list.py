@@ -3,10 +3,14 @@
 
 import time
 import ujson as json
+from operator import itemgetter
 from .history import History
 import hashlib
 import hmac
 
+# (api, method, counter, timestamp) of an entry dict
+_entry_fields = itemgetter('api', 'method', 'counter', 'timestamp')
+
 # {
 #   obj_id1 : [history_entry1, history_entry2, ...]
 # }
@@ -19,19 +23,37 @@ class HistoryList:
     # takes an obj_id and a json representation of a list of history objects
     def __init__(self, obj_id="", json_str=None):
         self.obj_id: str = str(obj_id)
-        # list of History objects
+        # list of History objects, only to be added to through append()
         self.entries: list[History] = []
+        # (api, method) -> its History in entries
+        self._index: dict = {}
         if json_str:
             history_list = json.loads(json_str) if isinstance(json_str, str) else json_str
             if isinstance(history_list, list):
-                for hist in history_list:
-                    self.entries.append(History.from_dict(hist))
+                self._extend(history_list)
             elif isinstance(history_list, dict):
                 assert len(history_list) == 1, "HistoryList json should only have one key"
                 if self.obj_id == "":
                     self.obj_id = list(history_list.keys())[0]
-                for hist in history_list[self.obj_id]:
-                    self.entries.append(History.from_dict(hist))
+                self._extend(history_list[self.obj_id])
+
+
+    @classmethod
+    def from_entries(cls, obj_id, entries):
+        """Build a HistoryList from already decoded entry dicts (a parsed header or updater output)."""
+        history_list = cls(obj_id)
+        history_list._extend(entries)
+        return history_list
+
+
+    def _extend(self, entries):
+        # Bulk path: History is built straight from the entry fields, no from_dict per row
+        new_entries = [History(*_entry_fields(entry)) for entry in entries]
+        index = self._index
+        for hist in new_entries:
+            # the first entry of a duplicated (api, method) is the one append() updates
+            index.setdefault((hist.api, hist.method), hist)
+        self.entries.extend(new_entries)
 
 
     def __str__(self):
@@ -40,15 +62,21 @@ class HistoryList:
 
     def append(self, history: History):
         # check for duplicate operation
-        for index in range(len(self.entries)):
-            if self.entries[index].api == history.api and self.entries[index].method == history.method:
-                self.entries[index].counter += 1
-                self.entries[index].timestamp = history.timestamp
-                return
+        existing = self._index.get((history.api, history.method))
+        if existing is not None:
+            existing.counter += 1
+            existing.timestamp = history.timestamp
+            return
 
+        self._index[(history.api, history.method)] = history
         self.entries.append(history)
 
 
+    def get(self, api, method):
+        """The entry of (api, method), or None."""
+        return self._index.get((api, method))
+
+
     # this could be tricky because json to string don't have 1to1 mapping.
     # e.g.: shuffling of keys, indentation, etc.
     # need standards to "canonicalize" HistoryList json for hashing reasons
@@ -0,0 +1,81 @@
+"""Long-lived worker pool computing the history digests of large batches."""
+import os
+import atexit
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from .canonical import history_list_digest
+
+
+def digest_chunk(items, hmac_key):
+    """Digests of a list of ``(object_id, entries)``, run inline or in a worker."""
+    return [history_list_digest(object_id, entries, hmac_key) for object_id, entries in items]
+
+
+class MacPool:
+    """Splits the per-object digest work of a batch across ``workers``.
+
+    Batches smaller than ``threshold`` objects are digested inline, since handing
+    them to a worker costs more than it saves. The executor is created on first
+    use and kept for the life of the process; one chunk is submitted per worker::
+
+        digests = mac_pool.digests([(object_id, entries), ...], hmac_key)
+
+    Computing a digest is mostly ujson encoding, which holds the GIL, so only
+    ``kind='process'`` runs digests in parallel, and only pays off with more than
+    one CPU. Its workers are started with ``forkserver``, never forked from the
+    server process, which already runs threads (instance pool refill, epoch
+    ticker, write-behind committer).
+
+    :param workers: Number of workers, ``None`` for the CPU count. With one
+        worker (or one CPU) everything stays inline.
+    :param threshold: Smallest batch handed to the pool.
+    :param kind: ``thread`` (the default) or ``process``.
+    """
+    def __init__(self, workers=None, threshold=256, kind='thread'):
+        self.workers = workers
+        self.threshold = threshold
+        self.kind = kind
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def size(self):
+        return self.workers if self.workers is not None else (os.cpu_count() or 1)
+
+    def digests(self, items, hmac_key=None):
+        """Return the digests of ``items`` (``(object_id, entries)`` pairs), in order."""
+        items = list(items)
+        size = self.size
+        if size <= 1 or len(items) < self.threshold:
+            return digest_chunk(items, hmac_key)
+        chunk_size = -(-len(items) // size)
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        executor = self._get_executor()
+        results = []
+        for chunk_digests in executor.map(digest_chunk, chunks, [hmac_key] * len(chunks)):
+            results.extend(chunk_digests)
+        return results
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    if self.kind == 'thread':
+                        self._executor = ThreadPoolExecutor(self.size, thread_name_prefix='history-mac')
+                    else:
+                        self._executor = ProcessPoolExecutor(self.size, mp_context=_process_context())
+                    atexit.register(self.shutdown)
+        return self._executor
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+def _process_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
@@ -0,0 +1,284 @@
+"""Sparse Merkle tree over the object histories of one token (INTEGRITY_CHECK = 'merkle').
+
+The server keeps only the root of the tree per token. Clients keep the tree (they
+hold every history of their token anyway) and send a proof covering the objects a
+request touches; the server checks it against the stored root and, after the
+update program ran, derives the new root from the same proof.
+
+Objects are placed by ``key = sha256(obj_id)``, read MSB first. A subtree is
+hashed as:
+
+- no object: 32 zero bytes (``EMPTY``)
+- one object: its leaf hash ``sha256(0x00 || key || sha256(canonical history))``,
+  whatever the depth
+- more objects: ``sha256(0x01 || left || right)``, split on the next key bit
+
+A proof is the pre-order walk of the tree pruned to the touched keys, one tagged
+record per visited subtree:
+
+- ``N``: split, followed by the left and the right subtree
+- ``E``: empty subtree
+- ``S`` + hash: untouched subtree of several objects
+- ``T`` + hash: untouched subtree of one object
+- ``K`` + key: one object, which is touched
+- ``L`` + key + value digest: one object, which is not touched (the touched keys
+  routed here are absent)
+
+base64url encoded in the ``Authorization-History-Proof`` header.
+
+Only the canonical walk is accepted. A split (``N``) is only sent for a subtree of
+several objects, so its children cannot be an ``E`` next to another ``E`` or next
+to a single object (``T``, ``K``, ``L``): the tree collapses those. Otherwise a
+claimed single leaf could stand for any subtree hash (even the whole root) and
+move a touched key into an empty sibling, where it would pass as absent.
+"""
+import base64
+import hashlib
+
+from .canonical import history_list_bytes
+
+EMPTY = bytes(32)
+DEPTH = 256
+
+_EMPTY, _LEAF, _MULTI = 0, 1, 2
+# records of a subtree holding several objects
+_SPLIT = ('N', 'S')
+
+
+class InvalidProofError(ValueError):
+    """The proof is malformed, does not cover the touched objects or does not match the root."""
+
+
+def object_key(obj_id):
+    return hashlib.sha256(str(obj_id).encode()).digest()
+
+
+def value_digest(obj_id, entries):
+    return hashlib.sha256(history_list_bytes(obj_id, entries)).digest()
+
+
+def leaf_hash(key, digest):
+    return hashlib.sha256(b'\x00' + key + digest).digest()
+
+
+def _bit(key, depth):
+    return (key[depth >> 3] >> (7 - (depth & 7))) & 1
+
+
+def _split(items, depth):
+    left, right = {}, {}
+    for key, value in items.items():
+        (right if _bit(key, depth) else left)[key] = value
+    return left, right
+
+
+def _combine(left, right):
+    (left_hash, left_kind), (right_hash, right_kind) = left, right
+    if left_kind == _EMPTY and right_kind != _MULTI:
+        return right
+    if right_kind == _EMPTY and left_kind != _MULTI:
+        return left
+    return hashlib.sha256(b'\x01' + left_hash + right_hash).digest(), _MULTI
+
+
+def _subtree(leaves, depth):
+    """(hash, kind) of a subtree holding ``leaves`` ({key: leaf hash})."""
+    if not leaves:
+        return EMPTY, _EMPTY
+    if len(leaves) == 1:
+        return next(iter(leaves.values())), _LEAF
+    left, right = _split(leaves, depth)
+    return _combine(_subtree(left, depth + 1), _subtree(right, depth + 1))
+
+
+class MerkleTree:
+    """The whole tree of a token, as kept by a client::
+
+        tree = MerkleTree.from_histories({obj_id: entries, ...})
+        headers['Authorization-History-Proof'] = tree.prove(touched_ids)
+        ...
+        tree.update(new_histories)    # from Set-Authorization-History
+        assert tree.root_hex() == resp.headers['Set-Authorization-History-Root']
+    """
+    def __init__(self):
+        # key -> (value digest, leaf hash)
+        self.leaves = {}
+
+    @classmethod
+    def from_histories(cls, histories):
+        tree = cls()
+        tree.update(histories)
+        return tree
+
+    def update(self, histories):
+        """Set the history of objects, or remove the objects mapped to None."""
+        for obj_id, entries in histories.items():
+            key = object_key(obj_id)
+            if entries is None:
+                self.leaves.pop(key, None)
+            else:
+                digest = value_digest(obj_id, entries)
+                self.leaves[key] = (digest, leaf_hash(key, digest))
+
+    def root(self):
+        return _subtree({key: leaf for key, (_, leaf) in self.leaves.items()}, 0)[0]
+
+    def root_hex(self):
+        return self.root().hex()
+
+    def prove(self, obj_ids):
+        """Encoded proof covering ``obj_ids``."""
+        out = []
+        _prove(self.leaves, {object_key(obj_id) for obj_id in obj_ids}, 0, out)
+        return base64.urlsafe_b64encode(b''.join(out)).decode()
+
+
+def _prove(leaves, keys, depth, out):
+    if not leaves:
+        out.append(b'E')
+    elif not keys:
+        if len(leaves) == 1:
+            out.append(b'T' + next(iter(leaves.values()))[1])
+        else:
+            out.append(b'S' + _subtree({key: leaf for key, (_, leaf) in leaves.items()}, depth)[0])
+    elif len(leaves) == 1:
+        (key, (digest, _)), = leaves.items()
+        out.append(b'K' + key if key in keys else b'L' + key + digest)
+    else:
+        out.append(b'N')
+        left, right = _split(leaves, depth)
+        _prove(left, {k for k in keys if not _bit(k, depth)}, depth + 1, out)
+        _prove(right, {k for k in keys if _bit(k, depth)}, depth + 1, out)
+
+
+class Proof:
+    """A decoded proof of the touched objects of a request::
+
+        proof = Proof.decode(header, object_ids)
+        absent = proof.verify(stored_root, histories)    # raises InvalidProofError
+        ...
+        new_root = proof.updated_root(new_histories)
+    """
+    def __init__(self, node, ids):
+        self.node = node
+        # touched key -> obj_id
+        self.ids = ids
+        # touched key -> leaf hash as verified, None for absent objects
+        self.verified = None
+
+    @classmethod
+    def decode(cls, encoded, obj_ids):
+        try:
+            data = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+        except (ValueError, TypeError) as e:
+            raise InvalidProofError('undecodable proof: {}'.format(e))
+        ids = {object_key(obj_id): str(obj_id) for obj_id in obj_ids}
+        node, pos = _decode(data, 0, 0, set(ids))
+        if pos != len(data):
+            raise InvalidProofError('trailing bytes')
+        return cls(node, ids)
+
+    def verify(self, root, histories):
+        """Check the proof against ``root`` (None if the token has no objects yet),
+        given the touched objects' histories from the request header. Returns the
+        ids of the touched objects that are not in the tree.
+        """
+        leaves = {key: leaf_hash(key, value_digest(obj_id, histories.get(obj_id) or []))
+                  for key, obj_id in self.ids.items()}
+        present = set()
+        computed, _ = _evaluate(self.node, leaves, present)
+        if computed != (root or EMPTY):
+            raise InvalidProofError('root mismatch')
+        self.verified = {key: leaves[key] if key in present else None for key in self.ids}
+        return [obj_id for key, obj_id in self.ids.items() if key not in present]
+
+    def updated_root(self, histories=None, removed=()):
+        """Root once the objects in ``histories`` got their new history and the
+        ids in ``removed`` were deleted; other touched objects keep the history
+        they were verified with.
+        """
+        if self.verified is None:
+            raise InvalidProofError('proof was not verified')
+        leaves = dict(self.verified)
+        for obj_id, entries in (histories or {}).items():
+            key = self._covered(obj_id)
+            leaves[key] = leaf_hash(key, value_digest(obj_id, entries))
+        for obj_id in removed:
+            leaves[self._covered(obj_id)] = None
+        return _rebuild(self.node, 0, leaves)[0]
+
+    def _covered(self, obj_id):
+        key = object_key(obj_id)
+        if key not in self.ids:
+            raise InvalidProofError('object {} is not covered by the proof'.format(obj_id))
+        return key
+
+
+def _decode(data, pos, depth, keys):
+    if pos >= len(data):
+        raise InvalidProofError('truncated proof')
+    tag = data[pos:pos + 1]
+    pos += 1
+    if tag == b'N':
+        if depth >= DEPTH:
+            raise InvalidProofError('proof too deep')
+        left, pos = _decode(data, pos, depth + 1, {k for k in keys if not _bit(k, depth)})
+        right, pos = _decode(data, pos, depth + 1, {k for k in keys if _bit(k, depth)})
+        if (left[0] == 'E' and right[0] not in _SPLIT) or (right[0] == 'E' and left[0] not in _SPLIT):
+            raise InvalidProofError('non-canonical split')
+        return ('N', left, right), pos
+    if tag == b'E':
+        return ('E', keys), pos
+    if tag in (b'S', b'T'):
+        if keys:
+            raise InvalidProofError('touched object inside an opaque subtree')
+        if pos + 32 > len(data):
+            raise InvalidProofError('truncated proof')
+        return (tag.decode(), data[pos:pos + 32]), pos + 32
+    if tag == b'K':
+        key = data[pos:pos + 32]
+        if key not in keys:
+            raise InvalidProofError('leaf is not a touched object')
+        return ('K', keys, key), pos + 32
+    if tag == b'L':
+        key, digest = data[pos:pos + 32], data[pos + 32:pos + 64]
+        # Only sent next to touched keys, and must sit on their path
+        if len(digest) != 32 or not keys or key in keys:
+            raise InvalidProofError('invalid leaf')
+        path = next(iter(keys))
+        if any(_bit(key, d) != _bit(path, d) for d in range(depth)):
+            raise InvalidProofError('leaf outside of its subtree')
+        return ('L', keys, key, leaf_hash(key, digest)), pos + 64
+    raise InvalidProofError('unknown record {!r}'.format(tag))
+
+
+def _evaluate(node, leaves, present):
+    """(hash, kind) of ``node`` before the update, collecting the touched keys found in the tree."""
+    tag = node[0]
+    if tag == 'N':
+        return _combine(_evaluate(node[1], leaves, present), _evaluate(node[2], leaves, present))
+    if tag == 'S':
+        return node[1], _MULTI
+    if tag == 'T':
+        return node[1], _LEAF
+    if tag == 'E':
+        return EMPTY, _EMPTY
+    if tag == 'K':
+        present.add(node[2])
+        return leaves[node[2]], _LEAF
+    return node[3], _LEAF
+
+
+def _rebuild(node, depth, leaves):
+    """(hash, kind) of ``node`` with the touched keys set to ``leaves`` (None removes them)."""
+    tag = node[0]
+    if tag == 'N':
+        return _combine(_rebuild(node[1], depth + 1, leaves), _rebuild(node[2], depth + 1, leaves))
+    if tag == 'S':
+        return node[1], _MULTI
+    if tag == 'T':
+        return node[1], _LEAF
+    subtree = {key: leaves[key] for key in node[1] if leaves[key] is not None}
+    if tag == 'L':
+        subtree[node[2]] = node[3]
+    return _subtree(subtree, depth)
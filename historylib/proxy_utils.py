@@ -70,6 +70,40 @@ def update_history_list_proxy(request, object_id, session):
     return history_list
 
 
+def delete_history_lists_proxy(session, token, object_ids):
+    """Delete the history lists of ``object_ids`` stored for ``token`` with one
+    ``DELETE ... WHERE object_id IN (...)`` per chunk, in a single transaction.
+    This function is only used for the proxy server."""
+    deleted = 0
+    for chunk in _chunks(object_ids):
+        deleted += session.query(HistoryListRow) \
+            .filter(HistoryListRow.access_token == token, HistoryListRow.object_id.in_(chunk)) \
+            .delete(synchronize_session=False)
+    session.commit()
+    return deleted
+
+
+def purge_history_lists_proxy(session, object_ids):
+    """Delete the history lists of ``object_ids`` stored for every token, once the
+    objects themselves are deleted.
+    This function is only used for the proxy server."""
+    deleted = 0
+    for chunk in _chunks(object_ids):
+        deleted += session.query(HistoryListRow) \
+            .filter(HistoryListRow.object_id.in_(chunk)) \
+            .delete(synchronize_session=False)
+    session.commit()
+    return deleted
+
+
+def _chunks(object_ids):
+    # SQLite allows 999 bound parameters per statement by default
+    chunk_size = current_app.config.get('HISTORY_WRITE_CHUNK_SIZE', 500)
+    object_ids = [str(object_id) for object_id in object_ids]
+    for start in range(0, len(object_ids), chunk_size):
+        yield object_ids[start:start + chunk_size]
+
+
 def update_history_proxy(session):
     """Updating the history list in the server-side database.
     This function is only used for the proxy server."""
@@ -88,11 +122,10 @@ def update_history_proxy(session):
             token = get_token_from_request(request)
             # If create, update, or get an object, we should update the history list hash.
             if request.method == 'DELETE' or 'delete' in request.path.lower():
-                for object_id in ids:
-                    history_list_row = session.query(HistoryListRow).filter_by(object_id=object_id, access_token=token).first()
-                    if history_list_row:
-                        session.delete(history_list_row)
-                        session.commit()
+                if current_app.config.get('HISTORY_PURGE_ON_DELETE'):
+                    purge_history_lists_proxy(session, ids)
+                else:
+                    delete_history_lists_proxy(session, token, ids)
                 return resp
             else:
                 # Update the database row for each object accessed one by one.
@@ -16,8 +16,13 @@ from uuid import UUID
 from flask import Request, Response, g, current_app
 from urllib.parse import urlparse
 from wasmtime import Module, Store, WasiConfig
+from authlib.oauth2.stateful.validator_helper import wasi_output
+from authlib.oauth2.stateful.artifact_store import load_module as load_artifact
+from authlib.oauth2.stateful.budget import arm
+from authlib.integrations.sqla_oauth2.auth_context import get_auth_context
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker, scoped_session, defer
 from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from itertools import repeat
 
@@ -25,7 +30,21 @@ from itertools import repeat
 from .history import History
 from .history_list import HistoryList
 from .batch_history_list import BatchHistoryList
-from server.website.models import HistoryListHash, OAuth2Client, UpdateProgram, OAuth2Token, db
+from .digest_cache import DigestCache
+from .mac_pool import MacPool
+from .write_behind import WriteBehindQueue
+from .merkle import Proof, InvalidProofError
+from .canonical import dumps_batch
+from . import wire
+from server.website.models import HistoryListHash, HistoryRoot, OAuth2Client, UpdateProgram, OAuth2Token, db
+
+# Latest history list digest per (access_token, object_id), written through on every update.
+# Sized by config_oauth from HISTORY_DIGEST_CACHE_SIZE / HISTORY_DIGEST_CACHE_TTL.
+history_digest_cache = DigestCache()
+# Workers computing the digests of large batches, sized from MAC_POOL_WORKERS / MAC_POOL_THRESHOLD
+history_mac_pool = MacPool()
+# Batches the digest writes of concurrent requests when HISTORY_DURABILITY is 'group' or 'async'
+history_write_queue = WriteBehindQueue()
 
 
 # In our server database, each object have a history field.
@@ -46,11 +65,16 @@ def find_key_value(json_string, target_key):
     else:
         return None
 
+@functools.lru_cache(maxsize=None)
+def _worker_sessionmaker(db_url, pid):
+    # One engine (and connection pool) per database and worker process; keyed by pid
+    # so that a forked worker never reuses the connections of its parent.
+    return sessionmaker(bind=create_engine(db_url, pool_pre_ping=True))
+
+
 def validate_historylist_multiprocessing(history_list, object_id, token, db_url):
     """Returns whether a history list in the request header is valid."""
-    db_engine = create_engine(db_url)
-    Session = sessionmaker(bind=db_engine)
-    session = Session()
+    session = _worker_sessionmaker(db_url, os.getpid())()
     history_list_hash_row = session.query(HistoryListHash).filter_by(object_id=UUID(object_id), access_token=token).first()
     oauth2_token = session.query(OAuth2Token).filter_by(access_token=token).first()
     oauth2_client = session.query(OAuth2Client).filter_by(client_id=oauth2_token.client_id).first()
@@ -96,6 +120,323 @@ def validate_historylist_simple(history_list, row, hmac_key):
     return row.history_list_hash == value
 
 
+def validate_historylists(batch_history, object_ids, token, session, hmac_key):
+    """Returns whether the history lists of ``object_ids`` in ``batch_history`` (the decoded
+    request header, see ``canonical.loads_batch``) are valid.
+
+    The stored digests of all ids are taken from ``history_digest_cache`` or fetched
+    with one ``IN`` query (chunked by ``HISTORY_VALIDATION_CHUNK_SIZE``) and compared
+    in memory, on ``history_mac_pool`` for large batches. Ids without a stored
+    digest are handled according to ``UNKNOWN_OBJECT_HISTORY``:
+
+    - ``require_empty`` (the default): only accept them with an empty history list.
+    - ``trust``: accept whatever history the client sends.
+    - ``reject``: fail the whole batch.
+    """
+    object_ids = [str(object_id) for object_id in object_ids]
+    # Writes of this process not committed yet win over the cache and the database
+    pending = history_write_queue.pending(token, object_ids) if history_write_queue.enabled else {}
+    stored = {object_id: digest for object_id, digest in pending.items() if digest is not None}
+    lookup = [object_id for object_id in object_ids if object_id not in pending]
+    if history_write_queue.enabled and history_write_queue.poisoned(token, lookup):
+        # The database holds the digest a dropped async write replaced, see WriteBehindQueue
+        return False
+    # Digests cached by this process, the rest comes from the database
+    cached = history_digest_cache.get_many(token, lookup) if history_digest_cache.enabled else {}
+    stored.update(cached)
+    stored.update(fetch_digests(session, token, [object_id for object_id in lookup if object_id not in cached]))
+
+    # LOGGING
+    if 'ENABLE_LOGGING' in current_app.config and current_app.config['ENABLE_LOGGING'] \
+        and hasattr(g, 'current_log') and history_digest_cache.enabled:
+        g.current_log.digest_cache_hit_rate = history_digest_cache.stats()['hit_rate']
+
+    unknown_policy = current_app.config.get('UNKNOWN_OBJECT_HISTORY', 'require_empty')
+    use_hmac = current_app.config['INTEGRITY_CHECK'] == 'hmac'
+    known = []
+    for object_id in object_ids:
+        entries = batch_history.get(object_id) or []
+        if object_id in stored:
+            known.append((object_id, entries))
+        elif unknown_policy == 'reject' or (unknown_policy == 'require_empty' and entries):
+            return False
+
+    # MAC of the canonical bytes, no HistoryList round trip
+    values = history_mac_pool.digests(known, hmac_key if use_hmac else None)
+    for (object_id, entries), value in zip(known, values):
+        digest = stored[object_id]
+        if digest != value and object_id in cached:
+            # The entry may be stale (written by another worker), the database decides
+            digest = fetch_digests(session, token, [object_id]).get(object_id)
+            if digest is None:
+                history_digest_cache.evict(token, [object_id])
+                if unknown_policy == 'reject' or (unknown_policy == 'require_empty' and entries):
+                    return False
+                continue
+        if digest != value:
+            return False
+    return True
+
+
+def fetch_digests(session, token, object_ids):
+    """Returns the stored ``{object_id: history_list_hash}`` of ``object_ids``, one ``IN`` query per
+    ``HISTORY_VALIDATION_CHUNK_SIZE`` ids, and refreshes the digest cache with them."""
+    stored = {}
+    chunk_size = current_app.config.get('HISTORY_VALIDATION_CHUNK_SIZE', 500)
+    for start in range(0, len(object_ids), chunk_size):
+        chunk = [UUID(str(object_id)) for object_id in object_ids[start:start + chunk_size]]
+        rows = session.query(HistoryListHash.object_id, HistoryListHash.history_list_hash) \
+            .filter(HistoryListHash.access_token == token, HistoryListHash.object_id.in_(chunk)).all()
+        stored.update((str(object_id), digest) for object_id, digest in rows)
+    history_digest_cache.put_many(token, stored)
+    return stored
+
+
+def upsert_digests(session, token, digests, commit=True):
+    """Write ``digests`` (``{object_id: history_list_hash}``) of ``token`` and commit; the only
+    insert or update path of history digests.
+
+    On SQLite and PostgreSQL this is one ``INSERT ... ON CONFLICT (object_id, access_token)
+    DO UPDATE`` per ``HISTORY_WRITE_CHUNK_SIZE`` objects, whether the objects are new or not.
+    Other databases get a merge per object.
+    """
+    values = [
+        {'object_id': UUID(str(object_id)), 'access_token': token, 'history_list_hash': digest}
+        for object_id, digest in digests.items()
+    ]
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        for row in values:
+            session.merge(HistoryListHash(**row))
+        if commit:
+            session.commit()
+        return
+    table = HistoryListHash.__table__
+    chunk_size = current_app.config.get('HISTORY_WRITE_CHUNK_SIZE', 300)
+    for start in range(0, len(values), chunk_size):
+        stmt = insert(table).values(values[start:start + chunk_size])
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.object_id, table.c.access_token],
+            set_={'history_list_hash': stmt.excluded.history_list_hash},
+        )
+        session.execute(stmt)
+    if commit:
+        session.commit()
+
+
+def delete_digests(session, token, object_ids, commit=True):
+    """Delete the digests of ``object_ids`` stored for ``token``: one ``DELETE ... WHERE
+    access_token = :token AND object_id IN (...)`` per ``HISTORY_WRITE_CHUNK_SIZE`` ids, in a
+    single transaction. Returns the number of rows deleted."""
+    deleted = 0
+    chunk_size = current_app.config.get('HISTORY_WRITE_CHUNK_SIZE', 300)
+    for start in range(0, len(object_ids), chunk_size):
+        chunk = [UUID(str(object_id)) for object_id in object_ids[start:start + chunk_size]]
+        deleted += session.query(HistoryListHash) \
+            .filter(HistoryListHash.access_token == token, HistoryListHash.object_id.in_(chunk)) \
+            .delete(synchronize_session=False)
+    if commit:
+        session.commit()
+    return deleted
+
+
+def purge_histories(session, object_ids):
+    """Delete the digests of ``object_ids`` stored for every token, once the objects themselves
+    are deleted. Same statements as :func:`delete_digests`, without the token filter. Merkle
+    roots (INTEGRITY_CHECK = 'merkle') of other tokens cannot be updated without their proofs
+    and are left as they are. Returns the number of rows deleted."""
+    # Queued writes of these objects must not land after the purge
+    if history_write_queue.enabled:
+        history_write_queue.drain()
+    deleted = 0
+    chunk_size = current_app.config.get('HISTORY_WRITE_CHUNK_SIZE', 300)
+    for start in range(0, len(object_ids), chunk_size):
+        chunk = [UUID(str(object_id)) for object_id in object_ids[start:start + chunk_size]]
+        deleted += session.query(HistoryListHash) \
+            .filter(HistoryListHash.object_id.in_(chunk)) \
+            .delete(synchronize_session=False)
+    session.commit()
+    history_digest_cache.evict_objects(object_ids)
+    return deleted
+
+
+def write_digests(session, writes):
+    """Apply ``writes`` (``{(token, object_id): digest}``, None deletes the digest) in one
+    transaction, with the statements of :func:`upsert_digests` and :func:`delete_digests`."""
+    upserts, deletes = {}, {}
+    for (token, object_id), digest in writes.items():
+        if digest is None:
+            deletes.setdefault(token, []).append(object_id)
+        else:
+            upserts.setdefault(token, {})[object_id] = digest
+    try:
+        for token, digests in upserts.items():
+            upsert_digests(session, token, digests, commit=False)
+        for token, object_ids in deletes.items():
+            delete_digests(session, token, object_ids, commit=False)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+
+def store_digests(session, token, digests):
+    """Store the new ``digests`` of ``token`` (``{object_id: digest}``, None deletes the
+    digest) as ``HISTORY_DURABILITY`` says, then update the digest cache:
+
+    - ``sync``: written and committed by this request.
+    - ``group``: queued on ``history_write_queue``; returns once the batch is committed.
+    - ``async``: queued on ``history_write_queue``; committed after the response.
+    """
+    writes = {(token, str(object_id)): digest for object_id, digest in digests.items()}
+    if not history_write_queue.enabled:
+        write_digests(session, writes)
+    else:
+        # ``session`` is the app's scoped session: the committer thread gets a session of its own
+        history_write_queue.start(current_app._get_current_object(), functools.partial(_flush_digest_writes, session),
+                                  _on_digest_write_error)
+        wait_start = time.time()
+        history_write_queue.submit(writes)
+        # LOGGING
+        if 'ENABLE_LOGGING' in current_app.config and current_app.config['ENABLE_LOGGING'] \
+            and hasattr(g, 'current_log'):
+            g.current_log.history_write_wait_time = time.time() - wait_start
+            g.current_log.history_write_queue_depth = history_write_queue.stats()['depth']
+    history_digest_cache.put_many(token, {object_id: digest for object_id, digest in digests.items() if digest is not None})
+    history_digest_cache.evict(token, [object_id for object_id, digest in digests.items() if digest is None])
+
+
+def _flush_digest_writes(session, writes):
+    # Runs on the committer thread, in an app context of its own
+    try:
+        write_digests(session, writes)
+    finally:
+        session.remove()
+
+
+def _on_digest_write_error(writes, error):
+    # The cache must not keep digests the database does not have (history_write_queue
+    # also reports the objects of a dropped async batch as poisoned)
+    current_app.logger.error('dropped %d history digest writes: %r', len(writes), error)
+    for token, object_id in writes:
+        history_digest_cache.evict(token, [object_id])
+
+
+class HistoryConflictError(Exception):
+    """The token's Merkle root changed between validation and update (concurrent request)."""
+
+
+def validate_history_merkle(batch_history, object_ids, token, session):
+    """Returns whether the ``Authorization-History-Proof`` of ``object_ids`` (see historylib.merkle)
+    leads from the histories in ``batch_history`` to the token's stored root.
+
+    The whole batch is one root comparison. The verified proof is kept in ``g.history_proof``
+    so that update_history can derive the new root from it. Objects not in the tree follow
+    ``UNKNOWN_OBJECT_HISTORY`` as in validate_historylists.
+    """
+    encoded = flask.request.headers.get('Authorization-History-Proof')
+    if encoded is None:
+        return False
+    root_row = session.query(HistoryRoot).filter_by(access_token=token).first()
+    old_root = root_row.root_hash if root_row else None
+    try:
+        proof = Proof.decode(encoded, object_ids)
+        absent = proof.verify(bytes.fromhex(old_root) if old_root else None, batch_history)
+    except InvalidProofError as e:
+        current_app.logger.info('invalid history proof: %s', e)
+        return False
+    unknown_policy = current_app.config.get('UNKNOWN_OBJECT_HISTORY', 'require_empty')
+    for object_id in absent:
+        if unknown_policy == 'reject' or (unknown_policy == 'require_empty' and batch_history.get(object_id)):
+            return False
+    g.history_proof = (proof, old_root)
+    return True
+
+
+def update_history_root(session, token, histories=None, removed=()):
+    """Write the token's new Merkle root after the objects in ``histories`` got their new
+    history and the ids in ``removed`` were deleted, and return it (hex).
+
+    The root is only replaced if it is still the one the request was validated against,
+    otherwise HistoryConflictError is raised.
+    """
+    proof, old_root = g.history_proof
+    new_root = proof.updated_root({str(object_id): entries for object_id, entries in (histories or {}).items()},
+                                  [str(object_id) for object_id in removed]).hex()
+    if old_root is None:
+        session.add(HistoryRoot(access_token=token, root_hash=new_root))
+        try:
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            raise HistoryConflictError(token)
+    else:
+        updated = session.query(HistoryRoot).filter_by(access_token=token, root_hash=old_root) \
+            .update({HistoryRoot.root_hash: new_root}, synchronize_session=False)
+        session.commit()
+        if not updated:
+            raise HistoryConflictError(token)
+    g.history_root = new_root
+    return new_root
+
+
+def get_hmac_key(session, token):
+    """Returns the HMAC key of the client the token was issued to, None without HMAC integrity."""
+    if current_app.config['INTEGRITY_CHECK'] != 'hmac':
+        return None
+    # Token and client come from the request's auth context, loaded by the validator
+    context = get_auth_context(session, token)
+    oauth2_token = context.get('token', lambda: session.query(OAuth2Token).filter_by(access_token=token).first())
+    context.get('client', lambda: session.query(OAuth2Client).filter_by(client_id=oauth2_token.client_id).first())
+    return context.hmac_key
+
+
+def get_request_history_value(request):
+    """The request's Authorization-History, inflated when it came with an
+    Authorization-History-Encoding (see historylib.wire). Inflated once per request."""
+    if 'history_header' in g:
+        return g.history_header
+    value = request.headers.get('Authorization-History')
+    encoding = request.headers.get(wire.ENCODING_HEADER)
+    if value and wire.is_compressed(encoding):
+        decompress_start = time.time()
+        inflated = wire.decompress(value, encoding, current_app.config.get('HISTORY_MAX_DECOMPRESSED_SIZE'))
+        # LOGGING
+        if 'ENABLE_LOGGING' in current_app.config and current_app.config['ENABLE_LOGGING'] \
+            and hasattr(g, 'current_log'):
+            current_log = g.current_log
+            current_log.history_compressed_size = len(value)
+            current_log.history_compression_ratio = len(inflated) / len(value)
+            current_log.history_decompress_time = time.time() - decompress_start
+        value = inflated
+    g.history_header = value
+    return value
+
+
+def get_request_history_str(request):
+    """The request's history as the JSON string policies and update programs take:
+    the header itself, or the decoded entries of a binary header re-encoded from the
+    shared parse of ``get_batch_history``."""
+    if 'history_str' not in g:
+        history_str = get_request_history_value(request)
+        if history_str and wire.is_binary(request.headers):
+            history_str = dumps_batch(get_batch_history(request))
+        g.history_str = history_str
+    return g.history_str
+
+
+def get_batch_history(request):
+    """Decode the request's Authorization-History (JSON or binary, see historylib.wire) into
+    ``{obj_id: entries}``. Decoded once per request; callers must not modify the result."""
+    if 'history_batch' not in g:
+        g.history_batch = wire.loads_header(get_request_history_value(request), wire.is_binary(request.headers))
+    return g.history_batch
+
+
 def validate_history(session):
     """Returns whether a batch of history list in the request header is valid."""
     request = flask.request
@@ -103,26 +444,39 @@ def validate_history(session):
     data = request.get_json(silent=True)
     token = get_token_from_request(request)
     db_url = current_app.config['SQLALCHEMY_DATABASE_URI']
+    try:
+        return _validate_history(session, request, data, token)
+    except wire.WireFormatError as e:
+        current_app.logger.info('undecodable history: %s', e)
+        return False
+
 
+def _validate_history(session, request, data, token):
     # NOTE: We assume here that the object id is the first argument in the url.
     if list(request.view_args.values()):
-        batch_history_list = BatchHistoryList(json_str=request.headers.get('Authorization-History'))
+        batch_history = get_batch_history(request)
         object_id = list(request.view_args.values())[0]
-        return validate_historylist(batch_history_list.entries.get(str(object_id), HistoryList(object_id)), object_id, token, session)
+        if current_app.config['INTEGRITY_CHECK'] == 'merkle':
+            return validate_history_merkle(batch_history, [object_id], token, session)
+        return validate_historylists(batch_history, [object_id], token, session, get_hmac_key(session, token))
     # NOTE: We assume here batch object id is the ids field of body.
     elif data != None and 'ids' in data:
-        hmac_key = None
-        if current_app.config['INTEGRITY_CHECK'] == 'hmac':
-            oauth2_token = session.query(OAuth2Token).filter_by(access_token=token).first()
-            oauth2_client = session.query(OAuth2Client).filter_by(client_id=oauth2_token.client_id).first()        
-            hmac_key = oauth2_client.hmac_key
-
-        # Opt 1: Sequential
-        batch_history_list = BatchHistoryList(json_str=request.headers.get('Authorization-History'))
-        for object_id in data['ids']:
-            if not validate_historylist(batch_history_list.entries.get(str(object_id), HistoryList(object_id)), object_id, token, session, current_app, hmac_key):
-                return False
-        return True
+        if current_app.config['INTEGRITY_CHECK'] == 'merkle':
+            # One root comparison for the whole batch
+            batch_history = get_batch_history(request)
+            return validate_history_merkle(batch_history, data['ids'], token, session)
+        hmac_key = get_hmac_key(session, token)
+
+        # Opt 1: Sequential, one query per object
+        # batch_history_list = BatchHistoryList(json_str=request.headers.get('Authorization-History'))
+        # for object_id in data['ids']:
+        #     if not validate_historylist(batch_history_list.entries.get(str(object_id), HistoryList(object_id)), object_id, token, session, current_app, hmac_key):
+        #         return False
+        # return True
+
+        # Opt 6: One IN query for the requested ids
+        batch_history = get_batch_history(request)
+        return validate_historylists(batch_history, data['ids'], token, session, hmac_key)
     
         # Opt 2: Fetch all the state hmacs for this token
         # batch_history_list = BatchHistoryList(json_str=request.headers.get('Authorization-History'))
@@ -169,222 +523,105 @@ def validate_history(session):
         # return request.headers.get('Authorization-History') == ''
 
 
-# deprecated and not used
-def insert_historylist(request, object_id, session):
-    """Update one single historylist in db."""
-    token = get_token_from_request(request)
-    new_history = History(request.path, request.method)
-    # t = time.time()
-    history_list_hash_row = session.query(HistoryListHash).filter_by(object_id=object_id, access_token=token).first()
-    # t = time.time() - t
-    # print("query_historylist", object_id, t)
-
-    history_list = HistoryList(obj_id=object_id)
-    if history_list_hash_row:
-        # t = time.time()
-        # Existing object, update history list hash
-        old_batch_history_list = BatchHistoryList(json_str=request.headers.get('Authorization-History'))
-        history_list = old_batch_history_list.entries[str(object_id)]
-        # HACK: for measurement, it won't update the history list. So the history is always valid.
-        # history_list.append(new_history)    # TODO: Recover this.
-        history_list_hash_row.history_list_hash = history_list.to_hash()
-        # t = time.time() - t
-        # print("update_historylist", object_id, t)
-    else:
-        # New object, create history list hash
-        # HACK: for latency measurement, we assume the initial history list comes from the client.
-        # print("insert_historylist", object_id)
-        # t = time.time()
-
-        # Approach 1: use re
-        # history_list = find_key_value(request.headers.get('Authorization-History'), str(object_id))
-
-        # Approach 2: use orjson
-        batch_history_list = json.loads(request.headers.get('Authorization-History'))
-        history_list = {str(object_id): batch_history_list[str(object_id)]}
-        # print(history_list)
-        history_list_hash = hashlib.sha256(json.dumps(history_list).encode()).hexdigest()
-        # print("parse_json", object_id, time.time() - t)
-        # history_list.append(new_history)    # TODO: Recover this.
-        history_list_hash = HistoryListHash(
-            object_id=object_id,
-            access_token=token,
-            history_list_hash=history_list_hash
-        )
-        session.add(history_list_hash)
-        # t = time.time() - t
-        # print("insert_historylist", object_id, t)
-    return {str(object_id): history_list}
-
-
-def to_hmac(object_id, history_list_str, key):
-    history_list = HistoryList(obj_id=object_id, json_str=history_list_str)
-    result = hmac.new(key.encode(), history_list.to_json().encode(), hashlib.sha256).hexdigest()
-    return result
-
-
-def insert_batch_history_wasm(linker, request, ids, session):
+def insert_batch_history_wasm(linker, request, ids, session, instance_pool=None):
     token = get_token_from_request(request)
-    oauth2_token = session.query(OAuth2Token).filter_by(access_token=token).first()
-    update_program = session.query(UpdateProgram).filter_by(client_id=oauth2_token.client_id).first()
+    context = get_auth_context(session, token)
+    oauth2_token = context.get('token', lambda: session.query(OAuth2Token).filter_by(access_token=token).first())
     # NOTE: Fix in main branch of this location.
-    hmac_key = None
-    if current_app.config['INTEGRITY_CHECK'] == 'hmac':
-        oauth2_client = session.query(OAuth2Client).filter_by(client_id=oauth2_token.client_id).first()
-        hmac_key = oauth2_client.hmac_key
+    hmac_key = get_hmac_key(session, token)
 
-    history_list_str = request.headers.get('Authorization-History')
+    # Update programs take JSON histories (binary headers are re-encoded)
+    history_list_str = get_request_history_str(request)
     # print("History in request:", history_list_str)
     # NOTE: We can require the client to always pass {object_id: ""} in the header when there is no history.
     # history_list = json.loads(history_list_str) if history_list_str else {}
     # for id in ids:
     #     if str(id) not in history_list:
     #         history_list.update({str(id): {}})
-    # start = time.time()
-    new_batch_history_list_str = run_update_program(linker, update_program, build_request_JSON(request), history_list_str)
-    # print("Wasm execution time:", time.time() - start)
-    # print("History in response:", new_history_list_str)
-    # start = time.time()
-    new_history_list = json.loads(new_batch_history_list_str)
-    rows = []
-    # with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-    #     futures = {executor.submit(to_hmac, object_id, new_history_list_str, hmac_key): object_id for object_id, new_history_list_str in new_history_list.items()}
-    #     for future in concurrent.futures.as_completed(futures):
-    #         object_id = futures[future]
-    #         try:
-    #             result = future.result()
-    #         except Exception as e:
-    #             print(e)
-    #             raise e
-    #         rows.append(HistoryListHash(
-    #             object_id=UUID(object_id),
-    #             access_token=token,
-    #             history_list_hash=result
-    #         ))
-    rows = [
-        HistoryListHash(
-            object_id=object_id,
-            access_token=token,
-            history_list_hash=(
-                HistoryList(obj_id=object_id, json_str=new_history_list[str(object_id)]).to_hmac(hmac_key) \
-                if current_app.config['INTEGRITY_CHECK'] == 'hmac' \
-                else HistoryList(obj_id=object_id, json_str=new_history_list[str(object_id)]).to_hash()
-            ),
-        ) for object_id in ids
-    ]
-    session.bulk_save_objects(rows)
-    session.commit()
+    fused_history = getattr(g, 'fused_history', None)
+    if fused_history is not None:
+        # The fused policy module already returned the updated history
+        new_history_list = fused_history
+        new_batch_history_list_str = json.dumps(fused_history)
+    else:
+        # the BLOB is only fetched if the program has no precompiled artifact on disk
+        update_program = context.get('update_program', lambda: session.query(UpdateProgram)
+                                     .options(defer(UpdateProgram.serialized_module))
+                                     .filter_by(client_id=oauth2_token.client_id).first())
+        # start = time.time()
+        new_batch_history_list_str = run_update_program(linker, update_program, build_request_JSON(request), history_list_str, instance_pool)
+        # print("Wasm execution time:", time.time() - start)
+        # print("History in response:", new_history_list_str)
+        # start = time.time()
+        new_history_list = json.loads(new_batch_history_list_str)
+        if update_program.fused:
+            # A fused module registered as the update program
+            new_history_list = new_history_list['history']
+            new_batch_history_list_str = json.dumps(new_history_list)
+    if current_app.config['INTEGRITY_CHECK'] == 'merkle':
+        # One root write instead of a row per object
+        update_history_root(session, token, {object_id: new_history_list[str(object_id)] for object_id in ids})
+        if getattr(g, 'policy_accepted_ids', None) is not None:
+            new_batch_history_list_str = json.dumps({str(object_id): new_history_list[str(object_id)] for object_id in ids})
+        return new_batch_history_list_str
+    # Digests are computed over the canonical bytes of the updater output, see historylib.canonical
+    digests = history_mac_pool.digests([(object_id, new_history_list[str(object_id)]) for object_id in ids], hmac_key)
+    # New and known objects alike, see upsert_digests
+    store_digests(session, token, {str(object_id): digest for object_id, digest in zip(ids, digests)})
     # print("DB commit time:", time.time() - start)
+    if getattr(g, 'policy_accepted_ids', None) is not None:
+        # Objects denied by a per-object policy verdict keep their old history on the client.
+        new_batch_history_list_str = json.dumps({str(object_id): new_history_list[str(object_id)] for object_id in ids})
     return new_batch_history_list_str
 
 
-def insert_historylist_wasm_old(linker, request, object_id, session):
-    """Update one single historylist in db."""
-    token = get_token_from_request(request)
-    oauth2_token = session.query(OAuth2Token).filter_by(access_token=token).first()
-    oauth2_client = session.query(OAuth2Client).filter_by(user_id=oauth2_token.user_id).first()
-    update_program = session.query(UpdateProgram).filter_by(client_id=oauth2_client.client_id).first()
-    hmac_key = oauth2_client.hmac_key
-
-    history_list_hash_row = session.query(HistoryListHash).filter_by(object_id=object_id, access_token=token).first()
-
-    history_list = HistoryList(obj_id=object_id)
-    if history_list_hash_row:
-        # Existing object, update history list hash
-        old_batch_history_list = BatchHistoryList(json_str=request.headers.get('Authorization-History'))
-        history_list = old_batch_history_list.entries[str(object_id)]
-        
-        newhist_string = run_update_program(linker, update_program, build_request_JSON(request), history_list.to_json())
-        newhist_list = HistoryList(json_str=newhist_string)
-
-        history_list_hash_row.history_list_hash = newhist_list.to_hmac(hmac_key)
-        session.commit()
-        return newhist_list
-    else:
-        # New object, create history list hash
-
-        #replace with wasm
-        #history_list.append(new_history)
-        # newhist_string = run_update_program(linker, update_program, build_request_JSON(request), history_list.to_json())
-        # newhist_list = HistoryList(json_str=newhist_string)
-        batch_history_list = json.loads(request.headers.get('Authorization-History'))
-        history_list = {str(object_id): batch_history_list[str(object_id)]}
-
-        history_list_hash_row = HistoryListHash(
-            object_id=object_id,
-            access_token=token,
-            history_list_hash=history_list.to_hmac(hmac_key),
-        )
-        session.add(history_list_hash_row)
-        session.commit()
-        return history_list
-
-
-
-def insert_historylist_wasm(linker, request, object_id, session, batch_history_list_json):
-    """Update one single historylist in db."""
-    token = get_token_from_request(request)
-    oauth2_token = session.query(OAuth2Token).filter_by(access_token=token).first()
-    update_program = session.query(UpdateProgram).filter_by(client_id=oauth2_token.client_id).first()
-
-    history_list_hash_row = session.query(HistoryListHash).filter_by(object_id=object_id, access_token=token).first()
-
-    history_list_json = json.dumps({str(object_id): batch_history_list_json[str(object_id)]})
-    # print("History in request:", history_list_json)
-    newhist_string = run_update_program(linker, update_program, build_request_JSON(request), history_list_json)
-    newhist_list = {str(object_id): newhist_string}
-    if history_list_hash_row:
-        # Existing object, update history list hash
-        # old_batch_history_list = BatchHistoryList(json_str=request.headers.get('Authorization-History'))
-        history_list_hash_row.history_list_hash = hashlib.sha256(json.dumps(newhist_list).encode()).hexdigest()
-        session.commit()
-    else:
-        # New object, create history list hash
-        history_list_hash = hashlib.sha256(json.dumps(newhist_list).encode()).hexdigest()
-        history_list_hash_row = HistoryListHash(
-            object_id=object_id,
-            access_token=token,
-            history_list_hash=history_list_hash,
-        )
-        session.add(history_list_hash_row)
-        session.commit()
-    return newhist_list
-
-
-def run_update_program(wasm_linker, update_program, request_str, history_str):
+def run_update_program(wasm_linker, update_program, request_str, history_str, instance_pool=None):
 
     # newhistory = runwasm(old_history)
     # return newhistory
+    # Same fuel/deadline as the client's policy, if the validator set one
+    budget = getattr(g, 'execution_budget', None)
+    if budget is None and instance_pool is not None and instance_pool.budgets is not None:
+        # e.g. macaroon tokens: the default budget, so that a pooled store never
+        # starts with the fuel or deadline left over from its previous run
+        budget = instance_pool.budgets.budget()
+    if instance_pool is not None:
+        load_module = lambda: load_artifact(wasm_linker.engine, lambda: update_program.serialized_module,
+                                            update_program.artifact_path)
+        with instance_pool.instance(f"update_program:{update_program.id}", load_module) as pooled:
+            arm(pooled.store, budget)
+            return _run_update_program_instance(pooled.store, pooled.entry, update_program, request_str, history_str)
+
+    # Store is a unit of isolation in wasmtime
+    # containes wasm objects
+    # We must have one Store per request, because Store dont' have GC and isolation.
+    store = Store(wasm_linker.engine)
+    arm(store, budget)
+
+    # instantiated module
+    # both new store and instantiate are very cheap
+    deserialized_module = load_artifact(wasm_linker.engine, lambda: update_program.serialized_module,
+                                        update_program.artifact_path)
+    instance = wasm_linker.instantiate(store, deserialized_module)
+
+    # _start is the default wasi main function
+    start = instance.exports(store)["_start"]
+    return _run_update_program_instance(store, start, update_program, request_str, history_str)
+
+
+def _run_update_program_instance(store, start, update_program, request_str, history_str):
     # Handling empty history string
     if not history_str:
         history_str = '{}'
     config = WasiConfig()
     config.argv = (update_program.file_name, request_str, history_str)
     config.preopen_dir(".", "/")
-    with tempfile.TemporaryDirectory() as chroot:
-
-        out_log = os.path.join(chroot, "out_1.log")
-        err_log = os.path.join(chroot, "err_1.log")
-        config.stdout_file = out_log
-        config.stderr_file = err_log
+    with wasi_output(config, current_app.config.get('WASM_STDIO', 'memory')) as read_output:
 
         # # LOGGING
         # policy_execution_start = time.time()
-
-        # Store is a unit of isolation in wasmtime
-        # containes wasm objects
-        # We must have one Store per request, because Store dont' have GC and isolation.
-        store = Store(wasm_linker.engine)
         store.set_wasi(config)
 
-        # instantiated module
-        # both new store and instantiate are very cheap
-        deserialized_module = Module.deserialize(wasm_linker.engine, update_program.serialized_module)
-        instance = wasm_linker.instantiate(store, deserialized_module)
-
-        # _start is the default wasi main function
-        start = instance.exports(store)["_start"]
-
         try:
             start(store)
         except Exception as e:
@@ -394,13 +631,12 @@ def run_update_program(wasm_linker, update_program, request_str, history_str):
         # # LOGGING
         # policy_execution_time = time.time() - policy_execution_start
 
-        with open(out_log) as f:
-            result = f.read()
-            # print("result:", result)
-            return result
+        result = read_output()
+        # print("result:", result)
+        return result
 
 
-def update_history(session, wasm_linker):
+def update_history(session, wasm_linker, instance_pool=None):
     def wrapper(f):
         """Decorator for updating history list hash in the database and stored in user-side."""
         @functools.wraps(f)
@@ -423,33 +659,50 @@ def update_history(session, wasm_linker):
 
             # If create, update, or get an object, we should update the history list hash.
             if (request.method == 'POST' or request.method == 'GET'):
-                # Opt 1: Update batch history by iterating them in Python.
-                # batch_history_list_json = json.loads(request.headers.get('Authorization-History'))
-                # newhistories = {}
-                # for object_id in ids:
-                #     newhistory_list = insert_historylist_wasm_old(wasm_linker, request, object_id, session) 
-                #                                              batch_history_list_json=batch_history_list_json)
-                #     newhistories.update(newhistory_list)
-                # print("History in response:", newhistories)
-                # resp.headers['Set-Authorization-History'] = json.dumps(newhistories)
-                
-                # Opt 2: Update batch history by iterating them in Wasm.
-                new_history_list_str = insert_batch_history_wasm(wasm_linker, request, ids, session)
+                # Update batch history by iterating them in Wasm.
+                try:
+                    new_history_list_str = insert_batch_history_wasm(wasm_linker, request, ids, session, instance_pool)
+                except HistoryConflictError:
+                    return flask.jsonify(error='history_conflict',
+                                         error_description='The history was updated by a concurrent request.'), 409
+                if wire.is_binary(request.headers):
+                    # Answer in the format the client asked for
+                    new_history_list_str = wire.dumps(json.loads(new_history_list_str))
+                    resp.headers[wire.FORMAT_HEADER] = wire.BINARY
+                encoding = request.headers.get(wire.ENCODING_HEADER)
+                if wire.is_compressed(encoding):
+                    # Answer with the encoding the client sent, the request was inflated with it
+                    compress_start = time.time()
+                    new_history_list_str = wire.compress(new_history_list_str, encoding)
+                    resp.headers[wire.ENCODING_HEADER] = encoding
+                    # LOGGING
+                    if 'ENABLE_LOGGING' in current_app.config and current_app.config['ENABLE_LOGGING'] \
+                        and hasattr(g, 'current_log'):
+                        g.current_log.history_compress_time = time.time() - compress_start
                 resp.headers['Set-Authorization-History'] = new_history_list_str
 
                 # Opt 3: Update batsh history with multi-processing in Python.
 
+            elif request.method == 'DELETE' and current_app.config['INTEGRITY_CHECK'] == 'merkle':
+                try:
+                    update_history_root(session, token, removed=ids)
+                except HistoryConflictError:
+                    return flask.jsonify(error='history_conflict',
+                                         error_description='The history was updated by a concurrent request.'), 409
+                resp.headers['Set-Authorization-History'] = ''
             elif request.method == 'DELETE':
-                for object_id in ids:
-                    history_list_hash = session.query(HistoryListHash).filter_by(object_id=object_id, access_token=token).first()
-                    if history_list_hash:
-                        session.delete(history_list_hash)
-                        session.commit()
+                if current_app.config.get('HISTORY_PURGE_ON_DELETE'):
+                    purge_histories(session, ids)
+                else:
+                    store_digests(session, token, dict.fromkeys(ids))
 
                 resp.headers['Set-Authorization-History'] = ''
             else:
                 # TODO: Add support for other methods, like `list`
                 resp.headers['Set-Authorization-History'] = ''
+            if getattr(g, 'history_root', None) is not None:
+                # Lets Merkle clients check the root they computed locally
+                resp.headers['Set-Authorization-History-Root'] = g.history_root
             
 
             # LOGGING
@@ -468,6 +721,41 @@ def update_history(session, wasm_linker):
     return wrapper
 
 
+def partial_accept(f):
+    """Decorator for batch endpoints that may be served for part of their objects.
+
+    A policy printing one verdict per object (see ``resolve_verdicts``) denies the
+    whole request unless its endpoint opts in here; then the request goes on for
+    the accepted objects as long as there is one. The view must act on
+    ``accepted_by_policy(ids)`` only, and the object ids it returns are filtered
+    the same way so that only the accepted objects get a new history. Place it
+    below ``update_history``::
+
+        @require_oauth_stateful('profile')
+        @update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+        @partial_accept
+        def import_events(): ...
+    """
+    @functools.wraps(f)
+    def decorated(*args, **kwargs):
+        ret = f(*args, **kwargs)
+        if isinstance(ret, tuple) and len(ret) > 1 and getattr(g, 'policy_accepted_ids', None) is not None:
+            ids = ret[1] if isinstance(ret[1], list) else [ret[1]]
+            ret = (ret[0], accepted_by_policy(ids)) + ret[2:]
+        return ret
+    # Read by the policy check through the registered view function (functools.wraps copies it)
+    decorated.partial_accept = True
+    return decorated
+
+
+def accepted_by_policy(ids):
+    """Drop the objects denied by a per-object policy verdict (see ``partial_accept``)."""
+    accepted_ids = getattr(g, 'policy_accepted_ids', None)
+    if accepted_ids is None:
+        return ids
+    return [id for id in ids if str(id) in accepted_ids]
+
+
 def get_token_from_request(request: Request):
     headers = request.headers
     bearer = headers.get('Authorization')
@@ -0,0 +1,262 @@
+"""Compact binary encoding of ``Authorization-History`` and ``Set-Authorization-History``.
+
+Clients opt in with ``Authorization-History-Format: binary``; the server then reads
+the request history in this format and answers with it (and the same header).
+Policies and update programs keep receiving JSON.
+
+An encoded batch is base64url (no padding) of::
+
+    magic b'HW', version 1
+    string table   varint count, then varint length + utf-8 for each string
+    objects        varint count, then for each object:
+        flags      1 byte: UUID id
+        id         16 bytes for a UUID, else varint length + utf-8
+        entries    varint count, then for each entry:
+            kind       1 byte: integer or float timestamp
+            api        varint index in the string table
+            method     varint index in the string table
+            counter    zigzag varint
+            timestamp  zigzag varint or little-endian float64
+
+Api paths and methods are stored once in the string table, and numbers keep
+their JSON type, so a decoded batch encodes to the same canonical bytes (see
+historylib.canonical) as the JSON it stands for.
+
+Independently of the format, clients may compress the header with
+``Authorization-History-Encoding: deflate`` (zlib, then base64url). The server
+inflates it up to a size cap and compresses ``Set-Authorization-History`` the
+same way.
+"""
+import base64
+import struct
+import uuid
+import zlib
+
+from .canonical import loads_batch
+
+FORMAT_HEADER = 'Authorization-History-Format'
+BINARY = 'binary'
+
+ENCODING_HEADER = 'Authorization-History-Encoding'
+DEFLATE = 'deflate'
+IDENTITY = 'identity'
+
+MAGIC = b'HW\x01'
+
+_UUID = 1
+_INT_TIMESTAMP = 1
+
+_double = struct.Struct('<d')
+
+
+class WireFormatError(ValueError):
+    """The value is not a valid binary history, or the batch cannot be encoded."""
+
+
+class HistoryTooLargeError(WireFormatError):
+    """The compressed history inflates past the size cap."""
+
+
+def is_binary(headers):
+    return headers.get(FORMAT_HEADER) == BINARY
+
+
+def loads_header(value, binary):
+    """Decode a history header into the same batch ``json.loads`` would give for its JSON form."""
+    if binary and value:
+        return loads(value)
+    return loads_batch(value)
+
+
+def is_compressed(encoding):
+    return encoding not in (None, '', IDENTITY)
+
+
+def compress(value, encoding=DEFLATE, level=6):
+    """Compress a header value (JSON or binary history) for transport."""
+    if encoding != DEFLATE:
+        raise WireFormatError('unsupported encoding {!r}'.format(encoding))
+    return base64.urlsafe_b64encode(zlib.compress(value.encode(), level)).rstrip(b'=').decode()
+
+
+def decompress(value, encoding=DEFLATE, max_size=None, chunk_size=16384):
+    """Inflate a compressed header value, at most ``max_size`` bytes of it (None for no cap).
+
+    The input is fed to the decompressor in chunks and the output bounded as it
+    grows, so a small header cannot inflate to an arbitrary amount of memory.
+    """
+    if encoding != DEFLATE:
+        raise WireFormatError('unsupported encoding {!r}'.format(encoding))
+    try:
+        data = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+    except (ValueError, TypeError) as e:
+        raise WireFormatError('undecodable history: {}'.format(e))
+    inflater = zlib.decompressobj()
+    out = bytearray()
+    try:
+        for pos in range(0, len(data), chunk_size):
+            pending = data[pos:pos + chunk_size]
+            while pending:
+                limit = 0 if max_size is None else max_size - len(out) + 1
+                out += inflater.decompress(pending, limit)
+                if max_size is not None and len(out) > max_size:
+                    raise HistoryTooLargeError('history inflates past {} bytes'.format(max_size))
+                pending = inflater.unconsumed_tail
+        out += inflater.flush()
+    except zlib.error as e:
+        raise WireFormatError('malformed compressed history: {}'.format(e))
+    if not inflater.eof or inflater.unused_data:
+        raise WireFormatError('truncated or trailing compressed data')
+    if max_size is not None and len(out) > max_size:
+        raise HistoryTooLargeError('history inflates past {} bytes'.format(max_size))
+    try:
+        return out.decode()
+    except UnicodeDecodeError as e:
+        raise WireFormatError('malformed compressed history: {}'.format(e))
+
+
+def dumps(batch):
+    """Encode a batch (``{obj_id: [entry, ...]}``)."""
+    strings, out = {}, []
+    try:
+        for obj_id, value in batch.items():
+            _dump_object(out, strings, str(obj_id), value)
+    except (KeyError, TypeError, ValueError, struct.error) as e:
+        raise WireFormatError('cannot encode history: {!r}'.format(e))
+    table = [_varint(len(strings))]
+    for string in strings:
+        data = string.encode()
+        table.append(_varint(len(data)))
+        table.append(data)
+    data = MAGIC + b''.join(table) + _varint(len(batch)) + b''.join(out)
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def loads(encoded):
+    """Decode an encoded batch."""
+    try:
+        data = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+    except (ValueError, TypeError) as e:
+        raise WireFormatError('undecodable history: {}'.format(e))
+    if data[:len(MAGIC)] != MAGIC:
+        raise WireFormatError('not a binary history')
+    reader = _Reader(data, len(MAGIC))
+    try:
+        strings = [reader.string() for _ in range(reader.varint())]
+        batch = {}
+        for _ in range(reader.varint()):
+            flags = reader.byte()
+            if flags & ~_UUID:
+                raise WireFormatError('unknown object flags {:#x}'.format(flags))
+            obj_id = str(uuid.UUID(bytes=reader.take(16))) if flags & _UUID else reader.string()
+            batch[obj_id] = reader.entries(strings)
+    except (IndexError, UnicodeDecodeError, struct.error) as e:
+        raise WireFormatError('malformed history: {!r}'.format(e))
+    if reader.pos != len(data):
+        raise WireFormatError('trailing bytes')
+    return batch
+
+
+def _dump_object(out, strings, obj_id, entries):
+    try:
+        uuid_bytes = uuid.UUID(obj_id).bytes if str(uuid.UUID(obj_id)) == obj_id else None
+    except ValueError:
+        uuid_bytes = None
+    out.append(bytes([_UUID if uuid_bytes is not None else 0]))
+    out.append(uuid_bytes if uuid_bytes is not None else _string(obj_id))
+    _dump_entries(out, strings, entries)
+
+
+def _dump_entries(out, strings, entries):
+    entries = entries or []
+    out.append(_varint(len(entries)))
+    for entry in entries:
+        timestamp = entry['timestamp']
+        if type(timestamp) is int:
+            out.append(bytes([_INT_TIMESTAMP]))
+        elif type(timestamp) is float:
+            out.append(b'\x00')
+        else:
+            raise TypeError('timestamp must be a number')
+        if type(entry['counter']) is not int:
+            raise TypeError('counter must be an integer')
+        out.append(_varint(strings.setdefault(entry['api'], len(strings))))
+        out.append(_varint(strings.setdefault(entry['method'], len(strings))))
+        out.append(_varint(_zigzag(entry['counter'])))
+        out.append(_varint(_zigzag(timestamp)) if type(timestamp) is int else _double.pack(timestamp))
+
+
+def _string(value):
+    if not isinstance(value, str):
+        raise TypeError('expected a string')
+    data = value.encode()
+    return _varint(len(data)) + data
+
+
+def _zigzag(n):
+    return n << 1 if n >= 0 else ((-n) << 1) - 1
+
+
+def _varint(n):
+    out = bytearray()
+    while n > 0x7f:
+        out.append((n & 0x7f) | 0x80)
+        n >>= 7
+    out.append(n)
+    return bytes(out)
+
+
+class _Reader:
+    def __init__(self, data, pos):
+        self.data = data
+        self.pos = pos
+
+    def byte(self):
+        value = self.data[self.pos]
+        self.pos += 1
+        return value
+
+    def take(self, n):
+        if self.pos + n > len(self.data):
+            raise IndexError('truncated')
+        value = self.data[self.pos:self.pos + n]
+        self.pos += n
+        return value
+
+    def varint(self):
+        n, shift = 0, 0
+        while True:
+            value = self.byte()
+            n |= (value & 0x7f) << shift
+            if not value & 0x80:
+                return n
+            shift += 7
+
+    def zigzag(self):
+        n = self.varint()
+        return (n >> 1) ^ -(n & 1)
+
+    def string(self):
+        return self.take(self.varint()).decode()
+
+    def entries(self, strings):
+        data, entries = self.data, []
+        for _ in range(self.varint()):
+            kind = data[self.pos]
+            # string indexes below 128 (a single varint byte) are the common case
+            if data[self.pos + 1] < 0x80 and data[self.pos + 2] < 0x80:
+                api, method = strings[data[self.pos + 1]], strings[data[self.pos + 2]]
+                self.pos += 3
+            else:
+                self.pos += 1
+                api, method = strings[self.varint()], strings[self.varint()]
+            counter = self.zigzag()
+            if kind & _INT_TIMESTAMP:
+                timestamp = self.zigzag()
+            else:
+                if self.pos + 8 > len(data):
+                    raise IndexError('truncated')
+                timestamp = _double.unpack_from(data, self.pos)[0]
+                self.pos += 8
+            entries.append({'api': api, 'method': method, 'counter': counter, 'timestamp': timestamp})
+        return entries
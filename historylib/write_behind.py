@@ -0,0 +1,226 @@
+"""Write-behind stage for the history digests written by ``update_history``."""
+import time
+import atexit
+import threading
+from collections import OrderedDict
+
+SYNC = 'sync'
+GROUP = 'group'
+ASYNC = 'async'
+MODES = (SYNC, GROUP, ASYNC)
+
+
+class WriteBehindError(Exception):
+    """The batch holding the writes of a request could not be committed."""
+
+
+class WriteBehindQueue:
+    """Collects the digest writes of concurrent requests and commits them in batches
+    from one background thread, so that they share a transaction instead of each
+    request committing its own::
+
+        queue.submit({(token, object_id): digest, ...})    # None deletes the digest
+
+    ``mode`` is the durability of a request's writes:
+
+    - ``sync``: no queue, the caller commits its writes itself (the default).
+    - ``group``: :meth:`submit` returns once the batch holding the writes is
+      committed, so an answered request is as durable as with ``sync``.
+    - ``async``: :meth:`submit` returns as soon as the writes are queued. Writes
+      still queued when the process dies are lost, and a batch that fails to
+      commit is dropped (and handed to ``on_error``).
+
+    Pending writes are merged per key, the last one wins, and :meth:`pending`
+    returns them so that this process never validates against a digest older
+    than one it wrote. Other processes only see them once committed.
+
+    The clients of a dropped ``async`` batch were already answered, so the
+    database still holds the digests they replaced. Its keys are reported by
+    :meth:`poisoned` until a later batch commits a write of them; callers must
+    reject them rather than validate against the older digest.
+
+    :param mode: ``sync``, ``group`` or ``async``.
+    :param interval: Seconds a batch collects writes before it is committed.
+    :param max_rows: Pending writes that get a batch committed before ``interval``.
+    """
+    def __init__(self, mode=SYNC, interval=0.005, max_rows=1000):
+        self.mode = mode
+        self.interval = interval
+        self.max_rows = max_rows
+        self.batches = 0
+        self.rows = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.last_flush_time = 0.0
+        self.total_flush_time = 0.0
+        self._pending = OrderedDict()
+        self._flushing = {}
+        self._first_at = None
+        # batch collecting writes, and the last batch committed (or failed)
+        self._batch = 0
+        self._committed = -1
+        self._failures = {}
+        self._poisoned = set()
+        self._app = None
+        self._flush = None
+        self._on_error = None
+        self._thread = None
+        self._closed = False
+        self._lock = threading.Lock()
+        self._work = threading.Condition(self._lock)
+        self._done = threading.Condition(self._lock)
+
+    @property
+    def enabled(self):
+        return self.mode != SYNC
+
+    def start(self, app, flush, on_error=None):
+        """Commit batches with ``flush(writes)`` inside an app context of ``app``.
+        ``on_error(writes, error)`` is called for batches that failed."""
+        with self._lock:
+            self._app = app
+            self._flush = flush
+            self._on_error = on_error
+            if self._thread is None or not self._thread.is_alive():
+                self._closed = False
+                self._thread = threading.Thread(target=self._run, name='history-write-behind', daemon=True)
+                self._thread.start()
+                atexit.register(self.close)
+
+    def submit(self, writes):
+        """Queue ``writes`` (``{(token, object_id): digest or None}``); with ``group`` wait
+        until they are committed, raising :class:`WriteBehindError` if that failed."""
+        with self._lock:
+            if self._thread is None or self._closed:
+                raise WriteBehindError('the write-behind queue is not running')
+            if not self._pending:
+                self._first_at = time.monotonic()
+            self._pending.update(writes)
+            batch = self._batch
+            self.max_depth = max(self.max_depth, self._depth())
+            self._work.notify()
+        if self.mode == GROUP:
+            self.wait(batch)
+
+    def wait(self, batch):
+        """Block until ``batch`` is committed."""
+        with self._lock:
+            while self._committed < batch:
+                self._done.wait()
+            error = self._failures.get(batch)
+        if error is not None:
+            raise WriteBehindError('history write batch failed: {!r}'.format(error)) from error
+
+    def drain(self):
+        """Block until every write queued so far is committed."""
+        with self._lock:
+            if self._pending:
+                batch = self._batch
+            elif self._flushing:
+                batch = self._batch - 1
+            else:
+                return
+        self.wait(batch)
+
+    def pending(self, token, object_ids):
+        """Return the queued or in-flight writes of ``object_ids`` as ``{object_id: digest or None}``."""
+        if not self._pending and not self._flushing:
+            return {}
+        found = {}
+        with self._lock:
+            for object_id in object_ids:
+                key = (token, str(object_id))
+                if key in self._pending:
+                    found[str(object_id)] = self._pending[key]
+                elif key in self._flushing:
+                    found[str(object_id)] = self._flushing[key]
+        return found
+
+    def poisoned(self, token, object_ids):
+        """Return the ids among ``object_ids`` whose last write was dropped by a failed ``async`` batch."""
+        if not self._poisoned:
+            return set()
+        with self._lock:
+            return {str(object_id) for object_id in object_ids if (token, str(object_id)) in self._poisoned}
+
+    def close(self):
+        """Commit what is queued and stop the background thread."""
+        with self._lock:
+            self._closed = True
+            self._work.notify()
+            thread = self._thread
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+        with self._lock:
+            self._thread = None
+
+    def stats(self):
+        """Return the queue depth and flush counters of this queue."""
+        with self._lock:
+            return {
+                'mode': self.mode,
+                'depth': self._depth(),
+                'max_depth': self.max_depth,
+                'batches': self.batches,
+                'rows': self.rows,
+                'errors': self.errors,
+                'poisoned': len(self._poisoned),
+                'last_flush_time': self.last_flush_time,
+                'avg_flush_time': self.total_flush_time / self.batches if self.batches else 0.0,
+            }
+
+    def _depth(self):
+        return len(self._pending) + len(self._flushing)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._pending and not self._closed:
+                    self._work.wait()
+                if not self._pending:
+                    return
+                # Let the batch fill up, unless the process is stopping
+                deadline = self._first_at + self.interval
+                while len(self._pending) < self.max_rows and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._work.wait(remaining)
+                writes, self._pending = self._pending, OrderedDict()
+                self._flushing = writes
+                batch = self._batch
+                self._batch += 1
+                app, flush, on_error = self._app, self._flush, self._on_error
+            start = time.perf_counter()
+            error = None
+            try:
+                with app.app_context():
+                    flush(writes)
+            except Exception as e:
+                error = e
+            elapsed = time.perf_counter() - start
+            if error is not None and on_error is not None:
+                try:
+                    with app.app_context():
+                        on_error(writes, error)
+                except Exception:
+                    # the committer must outlive a failing handler
+                    pass
+            with self._lock:
+                self._flushing = {}
+                self._committed = batch
+                self.batches += 1
+                self.rows += len(writes)
+                self.last_flush_time = elapsed
+                self.total_flush_time += elapsed
+                if error is not None:
+                    self.errors += 1
+                    self._failures[batch] = error
+                    if self.mode == ASYNC:
+                        self._poisoned.update(writes)
+                elif self._poisoned:
+                    self._poisoned.difference_update(writes)
+                # Waiters of older batches have woken up by now
+                for old in [b for b in self._failures if b < batch - 1024]:
+                    del self._failures[old]
+                self._done.notify_all()
@@ -11,6 +11,7 @@ import sys
 
 from flask import Flask
 
+from utils.db import init_db, add_missing_columns
 from proxy.models import db
 from proxy.oauth2 import config_oauth
 from proxy.auth_routes import auth_bp
@@ -21,7 +22,7 @@ def get_app():
         'SECRET_KEY': 'secret',
         'OAUTH2_REFRESH_TOKEN_GENERATOR': True,
         'SQLALCHEMY_TRACK_MODIFICATIONS': False,
-        'SQLALCHEMY_DATABASE_URI': f'sqlite:////{cwd}/db.sqlite',
+        'SQLALCHEMY_DATABASE_URI': os.environ.get('DATABASE_URL', f'sqlite:////{cwd}/db.sqlite'),
         'ENABLE_STATEFUL_AUTH': True,
         'UPLOAD_FOLDER': os.path.join(cwd, 'policies'),
     })
@@ -41,10 +42,11 @@ def create_app(config=None):
 
 
 def setup_app(app):
-    db.init_app(app)
-    # Create tables if they do not exist already
+    init_db(app, db)
+    # Create tables, and columns added to the models since, if they do not exist already
     with app.app_context():
         db.create_all()
+        add_missing_columns(db)
     config_oauth(app)
     # Register Authorizatin blueprints
     app.register_blueprint(auth_bp, url_prefix='')
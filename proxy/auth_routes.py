@@ -9,7 +9,8 @@ from werkzeug.utils import secure_filename
 from authlib.oauth2 import OAuth2Error
 from authlib.oauth2.rfc6750 import UnregisteredPolicyError
 from proxy.models import db, User, OAuth2Client, Policy
-from proxy.oauth2 import authorization
+from proxy.oauth2 import authorization, policy_module_cache, wasm_instance_pool, policy_decision_cache, \
+    wasm_artifact_store
 from proxy.utils import current_user, split_by_crlf
 from wasmtime import Linker, Module, Store, WasiConfig
 
@@ -76,6 +77,9 @@ def create_client():
         "policy_hashes": split_by_crlf(form["policy_hashes"]),
         # the endpoint for getting policies
         "policy_endpoint": form["policy_endpoint"],
+        # Execution budget of the policies and update program, None uses the server default
+        "policy_fuel": int(form["policy_fuel"]) if form.get("policy_fuel") else None,
+        "policy_deadline_ms": int(form["policy_deadline_ms"]) if form.get("policy_deadline_ms") else None,
     }
 
     policy_files = []
@@ -112,18 +116,36 @@ def create_client():
         policy_hash = filename.split('.')[0]
         client_metadata['policy_hashes'].append(policy_hash)
 
+    # A deterministic policy's verdict only depends on the declared request fields
+    # and the history, so it can be cached.
+    deterministic = form.get("policy_deterministic") == "on"
+    input_projection = form.get("policy_input_projection") or None
+    decision_ttl = int(form["policy_decision_ttl"]) if form.get("policy_decision_ttl") else None
+
     for f in policy_files:
         # Compile the wasm files to Modules
         policy_module = Module.from_file(authorization.wasm_engine, f)
         policy_hash = f.split('/')[-1].split('.')[0]
-        # serialize and store in db
+        # serialize and store in db (or in the artifact store)
+        serialized_module, artifact_path = wasm_artifact_store.store(policy_module, policy_hash, f)
         existing_policy = db.session.query(Policy).filter_by(policy_hash=policy_hash).first()
         if existing_policy:
-            existing_policy.serialized_module = policy_module.serialize()
+            existing_policy.serialized_module = serialized_module
+            existing_policy.artifact_path = artifact_path
+            # deterministic / input_projection / decision_ttl stay as the first registrant set
+            # them: the policy row and its cached decisions are shared by every client using it
+            # Drop the stale deserialized module and decisions of this hash
+            policy_module_cache.invalidate(policy_hash)
+            wasm_instance_pool.invalidate(policy_hash)
+            policy_decision_cache.invalidate(policy_hash)
         else:
             policy = Policy(
                 policy_hash = policy_hash,
-                serialized_module = policy_module.serialize()
+                serialized_module = serialized_module,
+                artifact_path = artifact_path,
+                deterministic = deterministic,
+                input_projection = input_projection,
+                decision_ttl = decision_ttl,
             )
             db.session.add(policy)
             db.session.commit()
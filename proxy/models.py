@@ -60,6 +60,14 @@ class OAuth2Token(db.Model, OAuth2TokenMixin):
 class Policy(db.Model):
     policy_hash = db.Column(db.String(255), primary_key=True)
     serialized_module = db.Column(db.LargeBinary, unique=True)
+    # Precompiled module in the artifact store; serialized_module is then left empty
+    artifact_path = db.Column(db.String(512))
+    # Declared at registration: same inputs always give the same verdict
+    deterministic = db.Column(db.Boolean, default=False)
+    # Comma separated request fields the policy reads, e.g. "method,path"
+    input_projection = db.Column(db.String(255))
+    # Seconds a cached verdict stays valid, for time dependent policies
+    decision_ttl = db.Column(db.Integer)
 
 
 # class HistoryListHash(db.Model):
@@ -15,7 +15,13 @@ from authlib.oauth2.rfc6749 import grants
 from authlib.oauth2.rfc7636 import CodeChallenge
 from proxy.models import db, User
 from proxy.models import OAuth2Client, OAuth2AuthorizationCode, OAuth2Token, Policy
-from wasmtime import Config, Engine, Linker
+from authlib.oauth2.stateful.module_cache import ModuleCache
+from authlib.oauth2.stateful.instance_pool import InstancePool
+from authlib.oauth2.stateful.decision_cache import DecisionCache
+from authlib.oauth2.stateful.engine_profile import EngineProfile
+from authlib.oauth2.stateful.artifact_store import ArtifactStore
+from authlib.oauth2.stateful.budget import ExecutionBudgets
+from wasmtime import Linker
 
 
 class AuthorizationCodeGrant(grants.AuthorizationCodeGrant):
@@ -72,10 +78,20 @@ class RefreshTokenGrant(grants.RefreshTokenGrant):
 
 
 # WASM initialization 
-wasm_engine_cfg = Config()
-wasm_engine = Engine(wasm_engine_cfg)
+wasm_engine_profile = EngineProfile.from_env()
+wasm_engine = wasm_engine_profile.create_engine()
 wasm_linker = Linker(wasm_engine)
 wasm_linker.define_wasi()
+# Fuel and deadline limits of policy and update program runs
+execution_budgets = ExecutionBudgets.from_profile(wasm_engine, wasm_engine_profile)
+# Deserialized policy modules, shared by all requests in this process
+policy_module_cache = ModuleCache()
+# Ready-to-run instances of policies and update programs
+wasm_instance_pool = InstancePool(wasm_linker, budgets=execution_budgets)
+# Verdicts of the policies declared deterministic
+policy_decision_cache = DecisionCache()
+# Precompiled policies (and update programs) on disk
+wasm_artifact_store = ArtifactStore()
 
 query_client = create_query_client_func(db.session, OAuth2Client)
 save_token = create_save_token_func(db.session, OAuth2Token)
@@ -91,6 +107,7 @@ require_oauth_stateful = ResourceProtectorStateful()
 
 def config_oauth(app):
     authorization.init_app(app)
+    wasm_engine_profile.self_check(wasm_engine, app.logger)
 
     # support all grants
     authorization.register_grant(grants.ImplicitGrant)
@@ -109,5 +126,12 @@ def config_oauth(app):
 
     # protect resource stateful
     # our stateful validator
-    bearer_cls_stateful = create_bearer_token_validator_stateful(authorization.wasm_linker, db.session, OAuth2Token, OAuth2Client, Policy, is_proxy=True)
+    policy_module_cache.maxsize = app.config.get('POLICY_MODULE_CACHE_SIZE', 128)
+    wasm_instance_pool.size = app.config.get('WASM_INSTANCE_POOL_SIZE', 4)
+    wasm_instance_pool.max_uses = app.config.get('WASM_INSTANCE_MAX_USES', 1000)
+    # Pools of as many policies and update programs as there are cached modules
+    wasm_instance_pool.max_keys = app.config.get('POLICY_MODULE_CACHE_SIZE', 128)
+    policy_decision_cache.maxsize = app.config.get('POLICY_DECISION_CACHE_SIZE', 1024)
+    wasm_artifact_store.root = app.config.get('WASM_ARTIFACT_DIR')
+    bearer_cls_stateful = create_bearer_token_validator_stateful(authorization.wasm_linker, db.session, OAuth2Token, OAuth2Client, Policy, is_proxy=True, module_cache=policy_module_cache, instance_pool=wasm_instance_pool, decision_cache=policy_decision_cache, budgets=execution_budgets)
     require_oauth_stateful.register_token_validator(bearer_cls_stateful())
@@ -0,0 +1,53 @@
+"""
+Measure the history digest time of a batch, inline vs on the MAC worker pool.
+Every object carries the same number of history entries; the HMAC key is fixed.
+
+    $ python scripts/bench_mac_pool.py --objects 100 500 2000 --entries 10 --workers 4
+"""
+import os
+import sys
+import time
+import argparse
+from uuid import uuid4
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from historylib.mac_pool import MacPool, digest_chunk
+
+
+def fake_batch(n_objects, n_entries):
+    entries = [
+        {"api": "/api/events/<event_id>", "method": "GET", "counter": i, "timestamp": 1705279436.833235 + i}
+        for i in range(n_entries)
+    ]
+    return [(str(uuid4()), list(entries)) for _ in range(n_objects)]
+
+
+def measure(fn, n_iters):
+    fn()    # warm up (starts the pool workers)
+    start = time.perf_counter()
+    for _ in range(n_iters):
+        fn()
+    return (time.perf_counter() - start) / n_iters
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', type=int, nargs='+', default=[64, 256, 1024, 4096])
+    parser.add_argument('--entries', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--kind', type=str, default='thread', choices=['thread', 'process'])
+    parser.add_argument('--n-iters', type=int, default=20)
+    args = parser.parse_args()
+
+    key = 'k' * 64
+    pool = MacPool(workers=args.workers, threshold=0, kind=args.kind)
+    print(f"{args.kind} pool, {pool.size} workers, {args.entries} entries per object")
+    print(f"{'objects':>8} {'inline (ms)':>12} {'pool (ms)':>10} {'speedup':>8}")
+    for n_objects in args.objects:
+        items = fake_batch(n_objects, args.entries)
+        assert pool.digests(items, key) == digest_chunk(items, key)
+        inline = measure(lambda: digest_chunk(items, key), args.n_iters)
+        pooled = measure(lambda: pool.digests(items, key), args.n_iters)
+        print(f"{n_objects:>8} {inline * 1e3:>12.2f} {pooled * 1e3:>10.2f} {inline / pooled:>8.2f}")
+    pool.shutdown()
@@ -18,7 +18,8 @@ app = create_app({
     'SECRET_KEY': 'secret',
     'OAUTH2_REFRESH_TOKEN_GENERATOR': True,
     'SQLALCHEMY_TRACK_MODIFICATIONS': False,
-    'SQLALCHEMY_DATABASE_URI': 'sqlite://',
+    # In-memory by default; set DATABASE_URL for more than one worker (see docs/database.md)
+    'SQLALCHEMY_DATABASE_URI': os.environ.get('DATABASE_URL', 'sqlite://'),
     'UPLOAD_FOLDER': os.path.join(cwd, 'policies'),
     'UPDATE_PROGRAM_FOLDER': os.path.join(cwd, 'update_program'),
     'UPDATE_PROGRAM_NAME': 'update_program.wasm',
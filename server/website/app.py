@@ -1,6 +1,7 @@
 import os
 from flask import Flask, g
 
+from utils.db import init_db, add_missing_columns
 from .models import db
 from .oauth2 import config_oauth
 from .auth_routes import auth_bp
@@ -29,10 +30,11 @@ def create_app(config=None):
 
 def setup_app(app):
 
-    db.init_app(app)
-    # Create tables if they do not exist already
+    init_db(app, db)
+    # Create tables, and columns added to the models since, if they do not exist already
     with app.app_context():
         db.create_all()
+        add_missing_columns(db)
     config_oauth(app)
     if not app.config.get('EVAL'):
         from .resource_routes import resource_bp
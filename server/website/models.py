@@ -43,10 +43,15 @@ class OAuth2AuthorizationCode(db.Model, OAuth2AuthorizationCodeMixin):
     user = db.relationship('User')
 
 
+# Serialized macaroons run past 255 characters, which PostgreSQL (unlike SQLite) enforces
+ACCESS_TOKEN_LENGTH = 1024
+
+
 class OAuth2Token(db.Model, OAuth2TokenMixin):
     __tablename__ = 'oauth2_token'
 
     id = db.Column(db.Integer, primary_key=True)
+    access_token = db.Column(db.String(ACCESS_TOKEN_LENGTH), unique=True, nullable=False)
     user_id = db.Column(
         db.Integer, db.ForeignKey('user.id', ondelete='CASCADE'))
     user = db.relationship('User')
@@ -61,6 +66,14 @@ class OAuth2Token(db.Model, OAuth2TokenMixin):
 class Policy(db.Model):
     policy_hash = db.Column(db.String(255), primary_key=True)
     serialized_module = db.Column(db.LargeBinary, unique=True)
+    # Precompiled module in the artifact store; serialized_module is then left empty
+    artifact_path = db.Column(db.String(512))
+    # Declared at registration: same inputs always give the same verdict
+    deterministic = db.Column(db.Boolean, default=False)
+    # Comma separated request fields the policy reads, e.g. "method,path"
+    input_projection = db.Column(db.String(255))
+    # Seconds a cached verdict stays valid, for time dependent policies
+    decision_ttl = db.Column(db.Integer)
 
 
 class HistoryListHash(db.Model):
@@ -69,12 +82,21 @@ class HistoryListHash(db.Model):
     __tablename__ = "history"
 
     object_id = db.Column(db.Uuid, primary_key=True, default=uuid.uuid4)
-    access_token = db.Column(db.String(255), primary_key=True)
+    access_token = db.Column(db.String(ACCESS_TOKEN_LENGTH), primary_key=True)
     history_list_hash = db.Column(db.String(255), nullable=False)
 
     @property
     def as_dict(self):
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+
+class HistoryRoot(db.Model):
+    """Root of the Merkle tree over all object histories of a token,
+    used instead of HistoryListHash rows when INTEGRITY_CHECK is 'merkle'."""
+    __tablename__ = "history_root"
+
+    access_token = db.Column(db.String(ACCESS_TOKEN_LENGTH), primary_key=True)
+    root_hash = db.Column(db.String(64), nullable=False)
     
 
 class UpdateProgram(db.Model):
@@ -85,6 +107,10 @@ class UpdateProgram(db.Model):
     client_id = db.Column(db.Integer, db.ForeignKey('oauth2_client.id'))
     client = db.relationship('OAuth2Client')
     serialized_module = db.Column(db.LargeBinary)
+    # Precompiled module in the artifact store; serialized_module is then left empty
+    artifact_path = db.Column(db.String(512))
+    # Registered as a fused program: prints {"verdict": ..., "history": ...} instead of the history
+    fused = db.Column(db.Boolean, default=False)
 
 
 class MacaroonModel(db.Model):
@@ -13,9 +13,18 @@ from authlib.integrations.sqla_oauth2 import (
 )
 from authlib.oauth2.rfc6749 import grants
 from authlib.oauth2.rfc7636 import CodeChallenge
+from authlib.integrations.flask_oauth2 import token_revoked
 from .models import db, User
 from .models import OAuth2Client, OAuth2AuthorizationCode, OAuth2Token, Policy, MacaroonModel
-from wasmtime import Config, Engine, Linker
+from . import settings
+from authlib.oauth2.stateful.module_cache import ModuleCache
+from authlib.oauth2.stateful.instance_pool import InstancePool
+from authlib.oauth2.stateful.decision_cache import DecisionCache
+from authlib.oauth2.stateful.engine_profile import EngineProfile
+from authlib.oauth2.stateful.artifact_store import ArtifactStore
+from authlib.oauth2.stateful.budget import ExecutionBudgets
+from authlib.integrations.sqla_oauth2.auth_context import AuthContextCache
+from wasmtime import Linker
 from historylib.macaroon_utils import *
 from authlib.common.security import generate_token
 from flask import current_app
@@ -79,13 +88,26 @@ class RefreshTokenGrant(grants.RefreshTokenGrant):
         credential.revoked = True
         db.session.add(credential)
         db.session.commit()
+        evict_revoked_token(credential)
 
 
 # WASM initialization 
-wasm_engine_cfg = Config()
-wasm_engine = Engine(wasm_engine_cfg)
+wasm_engine_profile = EngineProfile.from_mapping(vars(settings))
+wasm_engine = wasm_engine_profile.create_engine()
 wasm_linker = Linker(wasm_engine)
 wasm_linker.define_wasi()
+# Fuel and deadline limits of policy and update program runs
+execution_budgets = ExecutionBudgets.from_profile(wasm_engine, wasm_engine_profile)
+# Deserialized policy modules, shared by all requests in this process
+policy_module_cache = ModuleCache()
+# Ready-to-run instances of policies and update programs
+wasm_instance_pool = InstancePool(wasm_linker, budgets=execution_budgets)
+# Verdicts of the policies declared deterministic
+policy_decision_cache = DecisionCache()
+# Precompiled policies (and update programs) on disk
+wasm_artifact_store = ArtifactStore()
+# Token, client, policy and update program rows of recently seen access tokens
+auth_context_cache = AuthContextCache()
 
 query_client = create_query_client_func(db.session, OAuth2Client)
 save_token = create_save_token_func(db.session, OAuth2Token)
@@ -101,8 +123,21 @@ require_oauth = ResourceProtector()
 require_oauth_stateful = ResourceProtectorStateful()
 
 
+def evict_revoked_token(token):
+    """Drop the cached rows and history digests of a revoked token."""
+    from historylib.server_utils import history_digest_cache
+    auth_context_cache.invalidate(token.access_token)
+    history_digest_cache.evict_token(token.access_token)
+
+
+def _on_token_revoked(sender, token=None, client=None, **kwargs):
+    if token is not None:
+        evict_revoked_token(token)
+
+
 def config_oauth(app):
     authorization.init_app(app)
+    wasm_engine_profile.self_check(wasm_engine, app.logger)
 
     # support all grants
     authorization.register_grant(grants.ImplicitGrant)
@@ -114,6 +149,7 @@ def config_oauth(app):
     # support revocation
     revocation_cls = create_revocation_endpoint(db.session, OAuth2Token)
     authorization.register_endpoint(revocation_cls)
+    token_revoked.connect(_on_token_revoked, sender=authorization)
 
     # protect resource
     bearer_cls = create_bearer_token_validator(db.session, OAuth2Token)
@@ -124,7 +160,29 @@ def config_oauth(app):
 
     # protect resource stateful
     # our stateful validator
-    bearer_cls_stateful = create_bearer_token_validator_stateful(authorization.wasm_linker, db.session, OAuth2Token, OAuth2Client, Policy, MacaroonModel, is_macaroon=is_macaroon)
+    policy_module_cache.maxsize = app.config.get('POLICY_MODULE_CACHE_SIZE', 128)
+    wasm_instance_pool.size = app.config.get('WASM_INSTANCE_POOL_SIZE', 4)
+    wasm_instance_pool.max_uses = app.config.get('WASM_INSTANCE_MAX_USES', 1000)
+    # Pools of as many policies and update programs as there are cached modules
+    wasm_instance_pool.max_keys = app.config.get('POLICY_MODULE_CACHE_SIZE', 128)
+    policy_decision_cache.maxsize = app.config.get('POLICY_DECISION_CACHE_SIZE', 1024)
+    wasm_artifact_store.root = app.config.get('WASM_ARTIFACT_DIR')
+    auth_context_cache.maxsize = app.config.get('AUTH_CONTEXT_CACHE_SIZE', 1024)
+    auth_context_cache.ttl = app.config.get('AUTH_CONTEXT_CACHE_TTL', 5)
+    from historylib.server_utils import history_digest_cache, history_mac_pool, history_write_queue
+    from historylib.write_behind import MODES
+    history_digest_cache.maxsize = app.config.get('HISTORY_DIGEST_CACHE_SIZE', 0)
+    history_digest_cache.ttl = app.config.get('HISTORY_DIGEST_CACHE_TTL')
+    history_mac_pool.workers = app.config.get('MAC_POOL_WORKERS')
+    history_mac_pool.threshold = app.config.get('MAC_POOL_THRESHOLD', 256)
+    history_mac_pool.kind = app.config.get('MAC_POOL_KIND', 'thread')
+    history_write_queue.mode = app.config.get('HISTORY_DURABILITY', 'sync')
+    if history_write_queue.mode not in MODES:
+        raise ValueError(f"HISTORY_DURABILITY must be one of {MODES}, not {history_write_queue.mode!r}")
+    history_write_queue.interval = app.config.get('HISTORY_WRITE_INTERVAL_MS', 5) / 1000
+    history_write_queue.max_rows = app.config.get('HISTORY_WRITE_BATCH_ROWS', 1000)
+    bearer_cls_stateful = create_bearer_token_validator_stateful(authorization.wasm_linker, db.session, OAuth2Token, OAuth2Client, Policy, MacaroonModel, is_macaroon=is_macaroon, module_cache=policy_module_cache, instance_pool=wasm_instance_pool, decision_cache=policy_decision_cache, budgets=execution_budgets,
+                                                                 auth_context_cache=auth_context_cache)
     require_oauth_stateful.register_token_validator(bearer_cls_stateful())
 
 
@@ -8,7 +8,7 @@ from datetime import datetime
 from flask import Blueprint, Response, jsonify, make_response, current_app, request, g
 
 from .oauth2 import require_oauth
-from .oauth2 import require_oauth_stateful, authorization
+from .oauth2 import require_oauth_stateful, authorization, wasm_instance_pool
 from .models import db, Event, Email
 from authlib.integrations.flask_oauth2 import current_token
 
@@ -97,7 +97,7 @@ def send_money():
 
 @resource_bp.route('/emails/<uuid:emailId>', methods=['GET', 'DELETE'])
 @require_oauth_stateful()
-@update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+@update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
 def get_or_delete_emails(emailId: UUID) -> Response | tuple[Response, UUID | list[UUID]]:
     '''Endpoint for get or delete an email.'''
     user = current_token.user
@@ -120,7 +120,7 @@ def get_or_delete_emails(emailId: UUID) -> Response | tuple[Response, UUID | lis
 
 @resource_bp.route('/emails', methods=['GET', 'POST'])
 @require_oauth_stateful()
-@update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+@update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
 def list_or_insert_email() -> Response | tuple[Response, UUID | list[UUID]]:
     '''Endpoint for list all the email or insert an new email.'''
     user = current_token.user
@@ -147,7 +147,7 @@ def list_or_insert_email() -> Response | tuple[Response, UUID | list[UUID]]:
     
 @resource_bp.route('/emails/batch-get', methods=['GET', 'POST'])
 @require_oauth_stateful()
-@update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+@update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
 def batch_get_email() -> Response | tuple[Response, UUID | list[UUID]]:
     '''Endpoint for list all the email or insert an new email.'''
     user = current_token.user
@@ -170,7 +170,7 @@ def batch_get_email() -> Response | tuple[Response, UUID | list[UUID]]:
 
 @resource_bp.route('/events/<uuid:eventId>', methods=['GET', 'DELETE', 'POST'])
 @require_oauth_stateful('profile')  # TODO: Replace scope w/ other value (eg. "events")
-@update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+@update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
 def get_or_delete_event(eventId: UUID) -> Response | tuple[Response, UUID | list[UUID]]:
     '''Endpoint for get or delete an event.'''
     user = current_token.user
@@ -210,7 +210,7 @@ def get_or_delete_event(eventId: UUID) -> Response | tuple[Response, UUID | list
 
 @resource_bp.route('/events', methods=['GET', 'POST'])
 @require_oauth_stateful('profile')  # TODO: Replace scope w/ other value (eg. "events")
-@update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+@update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
 def list_or_insert_event() -> Response | tuple[Response, UUID | list[UUID]]:
     '''Endpoint for list all the events or insert an new event.'''
     user = current_token.user
@@ -8,13 +8,13 @@ from uuid import UUID
 from datetime import datetime
 from flask import Blueprint, Response, jsonify, make_response, current_app, request, g
 
-from .oauth2 import require_oauth, require_oauth_stateful, authorization
+from .oauth2 import require_oauth, require_oauth_stateful, authorization, wasm_instance_pool
 from .models import db, Event, Email
 from authlib.integrations.flask_oauth2 import current_token
 
 from historylib.history import History
 from historylib.history_list import HistoryList
-from historylib.server_utils import update_history
+from historylib.server_utils import update_history, partial_accept, accepted_by_policy
 from utils.log import RequestLog, LogManager
 
 
@@ -97,7 +97,7 @@ def send_money():
 
 @resource_bp.route('/emails/<uuid:emailId>', methods=['GET', 'DELETE'])
 @require_oauth_stateful()
-@update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+@update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
 def get_or_delete_emails(emailId: UUID) -> Response | tuple[Response, UUID | list[UUID]]:
     '''Endpoint for get or delete an email.'''
     user = current_token.user
@@ -120,7 +120,7 @@ def get_or_delete_emails(emailId: UUID) -> Response | tuple[Response, UUID | lis
 
 @resource_bp.route('/emails', methods=['GET', 'POST'])
 @require_oauth_stateful()
-@update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+@update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
 def list_or_insert_email() -> Response | tuple[Response, UUID | list[UUID]]:
     '''Endpoint for list all the email or insert an new email.'''
     user = current_token.user
@@ -147,14 +147,15 @@ def list_or_insert_email() -> Response | tuple[Response, UUID | list[UUID]]:
     
 @resource_bp.route('/emails/batch-get', methods=['GET', 'POST'])
 @require_oauth_stateful()
-@update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+@update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
+@partial_accept
 def batch_get_email() -> Response | tuple[Response, UUID | list[UUID]]:
     '''Endpoint for list all the email or insert an new email.'''
     user = current_token.user
     if flask.request.method == 'POST':
         user = current_token.user
         req = flask.request.get_json()
-        email_ids = req.get('ids')
+        email_ids = accepted_by_policy(req.get('ids'))
         ret_emails = []
         ret_emials_dicts = []
         for emailId in email_ids:
@@ -170,7 +171,7 @@ def batch_get_email() -> Response | tuple[Response, UUID | list[UUID]]:
 
 # @resource_bp.route('/events/<uuid:eventId>', methods=['GET', 'DELETE', 'POST'])
 # @require_oauth_stateful('profile')  # TODO: Replace scope w/ other value (eg. "events")
-# @update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+# @update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
 # def get_or_delete_event(eventId: UUID) -> Response | tuple[Response, UUID | list[UUID]]:
 #     '''Endpoint for get or delete an event.'''
 #     user = current_token.user
@@ -210,7 +211,7 @@ def batch_get_email() -> Response | tuple[Response, UUID | list[UUID]]:
 
 # @resource_bp.route('/events', methods=['GET', 'POST'])
 # @require_oauth_stateful('profile')  # TODO: Replace scope w/ other value (eg. "events")
-# @update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+# @update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
 # def list_or_insert_event() -> Response | tuple[Response, UUID | list[UUID]]:
 #     '''Endpoint for list all the events or insert an new event.'''
 #     user = current_token.user
@@ -247,7 +248,7 @@ def batch_get_email() -> Response | tuple[Response, UUID | list[UUID]]:
 # Google Calendar Endpoints but doing nothing. 
 @resource_bp.route('/events/<uuid:eventId>', methods=['GET', 'DELETE', 'POST', 'PATCH', 'PUT'])
 @require_oauth_stateful('profile')
-@update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+@update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
 def get_or_delete_event(eventId: UUID) -> Response | tuple[Response, UUID | list[UUID]]:
     user = current_token.user
     event = Event(
@@ -260,14 +261,15 @@ def get_or_delete_event(eventId: UUID) -> Response | tuple[Response, UUID | list
 
 @resource_bp.route('/events/import', methods=['POST'])
 @require_oauth_stateful('profile')
-@update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+@update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
+@partial_accept
 def import_events() -> Response | tuple[Response, UUID | list[UUID]]:
     # LOGGING
     if 'ENABLE_LOGGING' in current_app.config and current_app.config['ENABLE_LOGGING'] \
         and hasattr(g, 'current_log'):
         resource_api_start = time.time()
 
-    ids = [UUID(id) for id in json.loads(flask.request.data).get('ids')]
+    ids = accepted_by_policy([UUID(id) for id in json.loads(flask.request.data).get('ids')])
     user = current_token.user
     for id in ids:
         event = Event(
@@ -285,14 +287,15 @@ def import_events() -> Response | tuple[Response, UUID | list[UUID]]:
 
 @resource_bp.route('/events', methods=['POST', 'GET'])
 @require_oauth_stateful('profile')
-@update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+@update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
+@partial_accept
 def create_events() -> Response | tuple[Response, UUID | list[UUID]]:
     # LOGGING
     if 'ENABLE_LOGGING' in current_app.config and current_app.config['ENABLE_LOGGING'] \
         and hasattr(g, 'current_log'):
         resource_api_start = time.time()
 
-    ids = [UUID(id) for id in json.loads(flask.request.data).get('ids')]
+    ids = accepted_by_policy([UUID(id) for id in json.loads(flask.request.data).get('ids')])
     user = current_token.user
     for id in ids:
         event = Event(
@@ -310,7 +313,7 @@ def create_events() -> Response | tuple[Response, UUID | list[UUID]]:
 
 @resource_bp.route('/events/<uuid:eventId>/instances', methods=['GET'])
 @require_oauth_stateful('profile')
-@update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+@update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
 def list_event_instances(eventId:UUID) -> Response | tuple[Response, UUID | list[UUID]]:
     user = current_token.user
     event = Event(
@@ -323,7 +326,7 @@ def list_event_instances(eventId:UUID) -> Response | tuple[Response, UUID | list
 
 @resource_bp.route('/events/<uuid:eventId>/move', methods=['POST'])
 @require_oauth_stateful('profile')
-@update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+@update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
 def move_event(eventId:UUID) -> Response | tuple[Response, UUID | list[UUID]]:
     user = current_token.user
     event = Event(
@@ -336,14 +339,15 @@ def move_event(eventId:UUID) -> Response | tuple[Response, UUID | list[UUID]]:
 
 @resource_bp.route('/events/quickAdd', methods=['POST'])
 @require_oauth_stateful('profile')
-@update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+@update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
+@partial_accept
 def quick_add_event() -> Response | tuple[Response, UUID | list[UUID]]:
     # LOGGING
     if 'ENABLE_LOGGING' in current_app.config and current_app.config['ENABLE_LOGGING'] \
         and hasattr(g, 'current_log'):
         resource_api_start = time.time()
 
-    ids = [UUID(id) for id in json.loads(flask.request.data).get('ids')]
+    ids = accepted_by_policy([UUID(id) for id in json.loads(flask.request.data).get('ids')])
     user = current_token.user
     for id in ids:
         event = Event(
@@ -361,14 +365,15 @@ def quick_add_event() -> Response | tuple[Response, UUID | list[UUID]]:
 
 @resource_bp.route('/events/watch', methods=['POST'])
 @require_oauth_stateful('profile')
-@update_history(session=db.session, wasm_linker=authorization.wasm_linker)
+@update_history(session=db.session, wasm_linker=authorization.wasm_linker, instance_pool=wasm_instance_pool)
+@partial_accept
 def watch() -> Response | tuple[Response, UUID | list[UUID]]:
     # LOGGING
     if 'ENABLE_LOGGING' in current_app.config and current_app.config['ENABLE_LOGGING'] \
         and hasattr(g, 'current_log'):
         resource_api_start = time.time()
 
-    ids = [UUID(id) for id in json.loads(flask.request.data).get('ids')]
+    ids = accepted_by_policy([UUID(id) for id in json.loads(flask.request.data).get('ids')])
     user = current_token.user
     for id in ids:
         event = Event(
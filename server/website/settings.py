@@ -9,8 +9,90 @@ OAUTH2_TOKEN_EXPIRES_IN = {
 
 OAUTH2_REFRESH_TOKEN_GENERATOR = True
 
+# Database engine (see utils.db and docs/database.md); the URI itself comes from DATABASE_URL in app.py.
+# Connection pool of each worker process, unused with the in-memory SQLite database
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '10'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '20'))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', 'True').lower() == 'true'
+# Pragmas of every connection to a SQLite file: WAL lets readers run next to the writer,
+# synchronous=NORMAL only syncs at checkpoints (safe with WAL), mmap_size in bytes (0 disables it)
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '5000'))
+
+# 'hmac', 'hash' (one digest row per token and object) or 'merkle' (one Merkle root per token,
+# clients send Authorization-History-Proof, see historylib.merkle)
 INTEGRITY_CHECK = os.environ.get('INTEGRITY_CHECK', 'hmac')
+# Objects without a stored history digest: 'require_empty' (only accept an empty history), 'reject',
+# or 'trust' the client's history (which lets a client claim any history for such an object)
+UNKNOWN_OBJECT_HISTORY = os.environ.get('UNKNOWN_OBJECT_HISTORY', 'require_empty')
+# Ids per IN query when validating a batch (SQLite allows 999 bound parameters by default)
+HISTORY_VALIDATION_CHUNK_SIZE = int(os.environ.get('HISTORY_VALIDATION_CHUNK_SIZE', '500'))
+# Objects per INSERT ... ON CONFLICT statement when writing history digests (3 bound parameters each)
+HISTORY_WRITE_CHUNK_SIZE = int(os.environ.get('HISTORY_WRITE_CHUNK_SIZE', '300'))
+# Durability of history digest writes: 'sync' (each request commits), 'group' (requests wait for a
+# shared batched commit) or 'async' (committed after the response; lost if the process dies)
+# With 'async' a lost write leaves the older digest in the database, and the history it replaced
+# is accepted again (a rollback). A worker rejects the objects of the batches it failed to commit,
+# but not after a restart, and other workers never know about them.
+HISTORY_DURABILITY = os.environ.get('HISTORY_DURABILITY', 'sync')
+# With 'group' / 'async': a batch is committed every HISTORY_WRITE_INTERVAL_MS or once it holds HISTORY_WRITE_BATCH_ROWS writes
+HISTORY_WRITE_INTERVAL_MS = int(os.environ.get('HISTORY_WRITE_INTERVAL_MS', '5'))
+HISTORY_WRITE_BATCH_ROWS = int(os.environ.get('HISTORY_WRITE_BATCH_ROWS', '1000'))
+# On DELETE, drop the object's history digests of every token instead of the requesting one only
+HISTORY_PURGE_ON_DELETE = os.environ.get('HISTORY_PURGE_ON_DELETE', 'False').lower() == 'true'
+# In-process cache of history digests, off (0) by default. Only mismatches are rechecked against the
+# database, so with several workers a digest cached before another worker's write would accept the replayed
+# older history: enable it for a single worker only, or bound that window with HISTORY_DIGEST_CACHE_TTL seconds.
+HISTORY_DIGEST_CACHE_SIZE = int(os.environ.get('HISTORY_DIGEST_CACHE_SIZE', '0'))
+HISTORY_DIGEST_CACHE_TTL = int(os.environ.get('HISTORY_DIGEST_CACHE_TTL', '0')) or None
+# Token, client, policy and update program rows reused across requests for AUTH_CONTEXT_CACHE_TTL seconds; 0 disables it.
+# A revocation drops them in the worker that handled it only: other workers keep accepting the revoked token
+# for up to AUTH_CONTEXT_CACHE_TTL seconds, so keep it short (or 0) when running several workers.
+AUTH_CONTEXT_CACHE_SIZE = int(os.environ.get('AUTH_CONTEXT_CACHE_SIZE', '1024'))
+AUTH_CONTEXT_CACHE_TTL = float(os.environ.get('AUTH_CONTEXT_CACHE_TTL', '5'))
+# Cap on the inflated size of a compressed Authorization-History (Authorization-History-Encoding: deflate)
+HISTORY_MAX_DECOMPRESSED_SIZE = int(os.environ.get('HISTORY_MAX_DECOMPRESSED_SIZE', str(4 * 1024 * 1024)))
+# Batches of at least MAC_POOL_THRESHOLD objects are digested on MAC_POOL_WORKERS workers ('thread' or 'process',
+# unset means one per CPU); smaller ones stay inline. 'process' only helps with several CPUs.
+MAC_POOL_WORKERS = int(os.environ['MAC_POOL_WORKERS']) if os.environ.get('MAC_POOL_WORKERS') else None
+MAC_POOL_THRESHOLD = int(os.environ.get('MAC_POOL_THRESHOLD', '256'))
+MAC_POOL_KIND = os.environ.get('MAC_POOL_KIND', 'thread')
 ENABLE_STATEFUL_AUTH = os.environ.get('ENABLE_STATEFUL_AUTH', 'True').lower() == 'true'
 ENABLE_LOGGING = os.environ.get('ENABLE_LOGGING', 'True').lower() == 'true'
 MACAROON = os.environ.get('MACAROON', 'False').lower() == 'true'
-EVAL = os.environ.get('EVAL', 'False').lower() == 'true'
\ No newline at end of file
+EVAL = os.environ.get('EVAL', 'False').lower() == 'true'
+# Also the number of policies and update programs that keep pooled instances
+POLICY_MODULE_CACHE_SIZE = int(os.environ.get('POLICY_MODULE_CACHE_SIZE', '128'))
+WASM_INSTANCE_POOL_SIZE = int(os.environ.get('WASM_INSTANCE_POOL_SIZE', '4'))
+WASM_INSTANCE_MAX_USES = int(os.environ.get('WASM_INSTANCE_MAX_USES', '1000'))
+# Where guest programs write their verdict / new history: 'memory' or 'file'
+WASM_STDIO = os.environ.get('WASM_STDIO', 'memory')
+POLICY_DECISION_CACHE_SIZE = int(os.environ.get('POLICY_DECISION_CACHE_SIZE', '1024'))
+# wasmtime engine profile, read once when website.oauth2 creates the engine
+# (see authlib.oauth2.stateful.engine_profile)
+WASM_OPT_LEVEL = os.environ.get('WASM_OPT_LEVEL', 'speed')
+WASM_PARALLEL_COMPILATION = os.environ.get('WASM_PARALLEL_COMPILATION', 'True').lower() == 'true'
+WASM_POOLING_ALLOCATOR = os.environ.get('WASM_POOLING_ALLOCATOR', 'False').lower() == 'true'
+WASM_POOLING_TOTAL_INSTANCES = int(os.environ.get('WASM_POOLING_TOTAL_INSTANCES', '1000'))
+WASM_POOLING_TOTAL_MEMORIES = int(os.environ.get('WASM_POOLING_TOTAL_MEMORIES', '1000'))
+WASM_POOLING_TOTAL_TABLES = int(os.environ.get('WASM_POOLING_TOTAL_TABLES', '1000'))
+WASM_POOLING_MAX_MEMORY_SIZE = int(os.environ.get('WASM_POOLING_MAX_MEMORY_SIZE', str(64 * 1024 * 1024)))
+WASM_POOLING_MAX_UNUSED_WARM_SLOTS = int(os.environ.get('WASM_POOLING_MAX_UNUSED_WARM_SLOTS', '100'))
+# With pooling, at least WASM_POOLING_MAX_MEMORY_SIZE
+WASM_MEMORY_RESERVATION = os.environ.get('WASM_MEMORY_RESERVATION')
+WASM_MEMORY_GUARD_SIZE = os.environ.get('WASM_MEMORY_GUARD_SIZE')
+WASM_CACHE_DIR = os.environ.get('WASM_CACHE_DIR')
+# Execution budgets: fuel counts executed instructions, epochs advance every WASM_EPOCH_TICK_MS
+WASM_CONSUME_FUEL = os.environ.get('WASM_CONSUME_FUEL', 'False').lower() == 'true'
+WASM_EPOCH_INTERRUPTION = os.environ.get('WASM_EPOCH_INTERRUPTION', 'False').lower() == 'true'
+WASM_EPOCH_TICK_MS = int(os.environ.get('WASM_EPOCH_TICK_MS', '1'))
+# Limits of clients that registered none; unset means unlimited
+WASM_DEFAULT_FUEL = os.environ.get('WASM_DEFAULT_FUEL')
+WASM_DEFAULT_DEADLINE_MS = os.environ.get('WASM_DEFAULT_DEADLINE_MS')
+# Directory of precompiled policies and update programs, loaded with mmap; unset keeps them in the database.
+# Their wasm sources are kept there too, to compile them again after a change of the WASM_* settings.
+WASM_ARTIFACT_DIR = os.environ.get('WASM_ARTIFACT_DIR')
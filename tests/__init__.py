@@ -0,0 +1,6 @@
+import os
+import sys
+# add the auth-lib and server directories as paths, as server/app.py does
+parent_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.append(os.path.join(parent_dir, 'auth-lib'))
+sys.path.append(os.path.join(parent_dir, 'server'))
@@ -0,0 +1,61 @@
+import unittest
+from unittest import mock
+
+import ujson as json
+
+from historylib import wire
+from historylib.batch_history_list import BatchHistoryList
+from historylib.history import History
+from historylib.history_list import HistoryList
+
+
+def _entry(api, method, counter, timestamp):
+    return {'api': api, 'method': method, 'counter': counter, 'timestamp': timestamp}
+
+
+BATCH = {
+    'a': [_entry('/api/events', 'GET', 1, 1.0), _entry('/api/events', 'POST', 2, 2.0)],
+    'b': [_entry('/api/events', 'GET', 3, 3.0)],
+    'c': [],
+}
+
+
+class LazyBatchHistoryListTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(HistoryList, '__init__', autospec=True, side_effect=HistoryList.__init__)
+        self.init = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def decoded(self):
+        # obj_id of every HistoryList built
+        return [call.args[1] for call in self.init.call_args_list]
+
+    def test_decodes_each_object_once(self):
+        batch = BatchHistoryList(json_str=json.dumps(BATCH))
+        self.assertEqual(self.decoded(), [])
+        history_list = batch.entries['a']
+        self.assertIs(batch.entries['a'], history_list)
+        self.assertEqual(self.decoded(), ['a'])
+        self.assertEqual(json.loads(batch.to_json()), {obj_id: {obj_id: entries} for obj_id, entries in BATCH.items()})
+        self.assertEqual(sorted(self.decoded()), ['a', 'b', 'c'])
+
+    def test_counts_without_decoding(self):
+        batch = BatchHistoryList(batch=BATCH)
+        self.assertEqual(batch.get_num_objects(), 3)
+        self.assertEqual(batch.get_num_history_entries(), 3)
+        self.assertEqual(self.decoded(), [])
+        batch.append('b', History('/api/events', 'PUT', 1, 4.0))
+        self.assertEqual(batch.get_num_history_entries(), 4)
+        self.assertEqual(self.decoded(), ['b'])
+
+    def test_wire(self):
+        batch = BatchHistoryList(wire_str=wire.dumps(BATCH))
+        self.assertEqual(wire.loads(batch.to_wire()), BATCH)
+        self.assertEqual(sorted(self.decoded()), ['a', 'b', 'c'])
+
+    def test_shared_parse_is_not_modified(self):
+        batch = {obj_id: list(entries) for obj_id, entries in BATCH.items()}
+        history_lists = BatchHistoryList(batch=batch)
+        history_lists.append('a', History('/api/events', 'GET', 1, 5.0))
+        history_lists.entries['d'] = HistoryList('d')
+        self.assertEqual(batch, BATCH)
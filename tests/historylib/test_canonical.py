@@ -0,0 +1,47 @@
+import unittest
+
+from historylib.canonical import history_list_bytes, history_list_digest
+from historylib.history_list import HistoryList
+
+OBJ = 'b7a2a1b4-0c1f-4c56-9a0e-53f5d4a3c1e2'
+
+
+class HistoryListBytesTest(unittest.TestCase):
+    def assertCanonical(self, entries):
+        expected = HistoryList.from_entries(OBJ, entries).to_json().encode()
+        self.assertEqual(history_list_bytes(OBJ, entries), expected)
+        # the same value printed by an update program
+        self.assertEqual(history_list_bytes(OBJ, {OBJ: entries}), expected)
+        self.assertEqual(history_list_bytes(OBJ, HistoryList.from_entries(OBJ, entries).to_json()), expected)
+
+    def test_ordered_entries(self):
+        self.assertCanonical([
+            {'api': '/api/events', 'method': 'POST', 'counter': 1, 'timestamp': 1705279436.833235},
+            {'api': '/api/events/<event_id>', 'method': 'GET', 'counter': 3, 'timestamp': 1705279437.5},
+        ])
+
+    def test_reordered_keys(self):
+        self.assertCanonical([
+            {'timestamp': 1.5, 'counter': 1, 'method': 'POST', 'api': '/api/events'},
+            {'api': '/api/events', 'method': 'GET', 'counter': 2, 'timestamp': 2.5},
+        ])
+
+    def test_extra_keys(self):
+        self.assertCanonical([{'api': '/api/events', 'method': 'POST', 'counter': 1, 'timestamp': 1.5, 'note': 'x'}])
+
+    def test_int_and_float_numbers(self):
+        # numbers keep their JSON type: 1 and 1.0 are different histories
+        self.assertCanonical([{'api': '/a', 'method': 'GET', 'counter': 1, 'timestamp': 2}])
+        self.assertCanonical([{'api': '/a', 'method': 'GET', 'counter': 1.0, 'timestamp': 2.0}])
+        self.assertNotEqual(history_list_bytes(OBJ, [{'api': '/a', 'method': 'GET', 'counter': 1, 'timestamp': 2}]),
+                            history_list_bytes(OBJ, [{'api': '/a', 'method': 'GET', 'counter': 1.0, 'timestamp': 2}]))
+
+    def test_empty(self):
+        self.assertCanonical([])
+        self.assertEqual(history_list_bytes(OBJ, None), HistoryList(OBJ).to_json().encode())
+
+    def test_digest(self):
+        entries = [{'method': 'POST', 'api': '/api/events', 'counter': 1, 'timestamp': 1.5}]
+        history_list = HistoryList.from_entries(OBJ, entries)
+        self.assertEqual(history_list_digest(OBJ, entries, 'k' * 64), history_list.to_hmac('k' * 64))
+        self.assertEqual(history_list_digest(OBJ, entries), history_list.to_hash())
@@ -0,0 +1,55 @@
+import unittest
+
+from historylib.history import History
+from historylib.history_list import HistoryList
+
+OBJ = 'b7a2a1b4-0c1f-4c56-9a0e-53f5d4a3c1e2'
+
+
+def _entry(api, method, counter, timestamp):
+    return {'api': api, 'method': method, 'counter': counter, 'timestamp': timestamp}
+
+
+class HistoryListIndexTest(unittest.TestCase):
+    def assertIndexed(self, history_list):
+        # every (api, method) maps to its first entry, the one append() updates
+        first = {}
+        for hist in history_list.entries:
+            first.setdefault((hist.api, hist.method), hist)
+        self.assertEqual(history_list._index, first)
+        for (api, method), hist in first.items():
+            self.assertIs(history_list.get(api, method), hist)
+
+    def test_append(self):
+        history_list = HistoryList(OBJ)
+        history_list.append(History('/api/events', 'GET', 1, 1.0))
+        history_list.append(History('/api/events', 'POST', 1, 2.0))
+        history_list.append(History('/api/events', 'GET', 1, 3.0))
+        self.assertIndexed(history_list)
+        self.assertEqual(len(history_list.entries), 2)
+        hist = history_list.get('/api/events', 'GET')
+        self.assertEqual((hist.counter, hist.timestamp), (2, 3.0))
+        self.assertIsNone(history_list.get('/api/events', 'DELETE'))
+
+    def test_from_entries(self):
+        entries = [_entry('/api/events', 'GET', 3, 1.0), _entry('/api/events', 'POST', 1, 2.0)]
+        history_list = HistoryList.from_entries(OBJ, entries)
+        self.assertIndexed(history_list)
+        self.assertEqual(history_list.to_dict(), {OBJ: entries})
+        history_list.append(History('/api/events', 'GET', 1, 5.0))
+        self.assertIndexed(history_list)
+        self.assertEqual(history_list.get('/api/events', 'GET').counter, 4)
+        self.assertEqual(len(history_list.entries), 2)
+
+    def test_duplicated_entries(self):
+        # a client may send the same (api, method) twice: the first one is updated
+        entries = [_entry('/a', 'GET', 1, 1.0), _entry('/a', 'GET', 5, 2.0)]
+        history_list = HistoryList.from_entries(OBJ, entries)
+        self.assertIndexed(history_list)
+        history_list.append(History('/a', 'GET', 1, 3.0))
+        self.assertEqual([hist.counter for hist in history_list.entries], [2, 5])
+
+    def test_json(self):
+        history_list = HistoryList(json_str='{"%s": [{"api": "/a", "method": "GET", "counter": 1, "timestamp": 1.0}]}' % OBJ)
+        self.assertEqual(history_list.obj_id, OBJ)
+        self.assertIndexed(history_list)
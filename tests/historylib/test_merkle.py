@@ -0,0 +1,108 @@
+import base64
+import random
+import unittest
+from uuid import UUID
+
+from historylib.merkle import EMPTY, MerkleTree, Proof, InvalidProofError, object_key, leaf_hash, value_digest
+
+
+def _ids(n, seed):
+    rng = random.Random(seed)
+    return [str(UUID(int=rng.getrandbits(128), version=4)) for _ in range(n)]
+
+
+def _history(counter):
+    return [{'api': '/api/events', 'method': 'GET', 'counter': counter, 'timestamp': 1.0}]
+
+
+def _encode(*records):
+    return base64.urlsafe_b64encode(b''.join(records)).decode()
+
+
+def _bit(obj_id, depth=0):
+    key = object_key(obj_id)
+    return (key[depth >> 3] >> (7 - (depth & 7))) & 1
+
+
+class MerkleProofTest(unittest.TestCase):
+    def setUp(self):
+        self.ids = _ids(3, 0)
+        self.histories = {obj_id: _history(1) for obj_id in self.ids}
+        self.tree = MerkleTree.from_histories(self.histories)
+        self.root = self.tree.root()
+
+    def test_honest_proofs_verify(self):
+        for n in range(0, 24):
+            ids = _ids(n, n)
+            histories = {obj_id: _history(i) for i, obj_id in enumerate(ids)}
+            tree = MerkleTree.from_histories(histories)
+            extra = _ids(2, 100 + n)
+            touched = ids[:3] + extra
+            proof = Proof.decode(tree.prove(touched), touched)
+            absent = proof.verify(tree.root() if ids else None, histories)
+            self.assertEqual(sorted(absent), sorted(extra))
+
+    def test_updated_root_matches_tree(self):
+        touched = self.ids[:2] + _ids(1, 7)
+        proof = Proof.decode(self.tree.prove(touched), touched)
+        proof.verify(self.root, self.histories)
+        new = {touched[0]: _history(2), touched[2]: _history(0)}
+        new_root = proof.updated_root(new, removed=[touched[1]])
+        self.tree.update({**new, touched[1]: None})
+        self.assertEqual(new_root, self.tree.root())
+
+    def test_rewritten_history_fails(self):
+        target = self.ids[0]
+        proof = Proof.decode(self.tree.prove([target]), [target])
+        with self.assertRaises(InvalidProofError):
+            proof.verify(self.root, {target: _history(0)})
+
+    def test_root_as_leaf_beside_empty_is_rejected(self):
+        # The stored root claimed as a single leaf, the touched key in an empty sibling
+        target = self.ids[0]
+        records = [b'T' + self.root, b'E'] if _bit(target) else [b'E', b'T' + self.root]
+        with self.assertRaises(InvalidProofError):
+            Proof.decode(_encode(b'N', *records), [target]).verify(self.root, {target: _history(0)})
+
+    def test_single_object_beside_empty_is_rejected(self):
+        target, other = self.ids[0], self.ids[1]
+        key = object_key(other)
+        digest = value_digest(other, self.histories[other])
+        for record in (b'T' + leaf_hash(key, digest), b'L' + key + digest):
+            records = [record, b'E'] if _bit(target) else [b'E', record]
+            with self.assertRaises(InvalidProofError):
+                Proof.decode(_encode(b'N', *records), [target])
+
+    def test_touched_leaf_beside_empty_is_rejected(self):
+        target = self.ids[0]
+        records = [b'K' + object_key(target), b'E'] if not _bit(target) else [b'E', b'K' + object_key(target)]
+        with self.assertRaises(InvalidProofError):
+            Proof.decode(_encode(b'N', *records), [target])
+
+    def test_two_empty_children_are_rejected(self):
+        with self.assertRaises(InvalidProofError):
+            Proof.decode(_encode(b'N', b'E', b'E'), [self.ids[0]])
+
+    def test_opaque_subtree_holding_touched_key_is_rejected(self):
+        target = self.ids[0]
+        with self.assertRaises(InvalidProofError):
+            Proof.decode(_encode(b'T' + self.root), [target])
+        with self.assertRaises(InvalidProofError):
+            Proof.decode(_encode(b'S' + self.root), [target])
+
+    def test_empty_proof_against_a_root_fails(self):
+        target = _ids(1, 9)[0]
+        proof = Proof.decode(_encode(b'E'), [target])
+        with self.assertRaises(InvalidProofError):
+            proof.verify(self.root, {})
+        self.assertEqual(Proof.decode(_encode(b'E'), [target]).verify(None, {}), [target])
+        self.assertEqual(Proof.decode(_encode(b'E'), [target]).verify(EMPTY, {}), [target])
+
+    def test_malformed_proofs_are_rejected(self):
+        target = self.ids[0]
+        for encoded in (_encode(b'N'), _encode(b'X'), _encode(b'T' + b'\x00' * 5), '!!!'):
+            with self.assertRaises(InvalidProofError):
+                Proof.decode(encoded, [target])
+        honest = self.tree.prove([target])
+        with self.assertRaises(InvalidProofError):
+            Proof.decode(_encode(base64.urlsafe_b64decode(honest), b'E'), [target])
@@ -0,0 +1,266 @@
+import json
+import uuid
+import unittest
+from unittest import mock
+
+from flask import Flask, g, request
+from sqlalchemy import event
+
+from historylib import server_utils
+from historylib.canonical import history_list_digest
+from historylib.digest_cache import DigestCache
+from server.website.models import HistoryListHash, OAuth2Client, OAuth2Token, UpdateProgram, db
+
+KEY = 'k' * 64
+
+
+def _entries(counter=1):
+    return [{'api': '/api/events', 'method': 'POST', 'counter': counter, 'timestamp': 1.5}]
+
+
+class ServerUtilsTestCase(unittest.TestCase):
+    """An app on an in-memory SQLite database, with the digest cache off."""
+    config = {}
+
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.app.config.update({'SQLALCHEMY_DATABASE_URI': 'sqlite://', 'INTEGRITY_CHECK': 'hmac', **self.config})
+        db.init_app(self.app)
+        context = self.app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+        db.create_all()
+        self.addCleanup(db.drop_all)
+        self.addCleanup(db.session.remove)
+        patcher = mock.patch.object(server_utils, 'history_digest_cache', self.digest_cache())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def digest_cache(self):
+        return DigestCache(maxsize=0)
+
+    def store(self, token, histories):
+        db.session.add_all(HistoryListHash(object_id=uuid.UUID(object_id), access_token=token,
+                                           history_list_hash=history_list_digest(object_id, entries, KEY))
+                           for object_id, entries in histories.items())
+        db.session.commit()
+
+    def stored(self, token):
+        rows = HistoryListHash.query.filter_by(access_token=token).all()
+        return {str(row.object_id): row.history_list_hash for row in rows}
+
+    def record_statements(self, kind):
+        statements = []
+        listener = lambda conn, cursor, statement, *args: statements.append(statement) \
+            if statement.startswith(kind) else None
+        event.listen(db.engine, 'before_cursor_execute', listener)
+        self.addCleanup(event.remove, db.engine, 'before_cursor_execute', listener)
+        return statements
+
+
+class ValidateHistoryListsTest(ServerUtilsTestCase):
+    config = {'HISTORY_VALIDATION_CHUNK_SIZE': 2}
+
+    def setUp(self):
+        super().setUp()
+        self.ids = [str(uuid.uuid4()) for _ in range(5)]
+        self.batch = {object_id: _entries() for object_id in self.ids}
+        self.store('tok', self.batch)
+
+    def validate(self, batch, object_ids=None):
+        return server_utils.validate_historylists(batch, object_ids or list(batch), 'tok', db.session, KEY)
+
+    def test_chunked_in_query(self):
+        selects = self.record_statements('SELECT')
+        self.assertTrue(self.validate(self.batch))
+        # 5 ids in chunks of 2
+        self.assertEqual(len(selects), 3)
+        self.assertTrue(all(' IN ' in statement for statement in selects))
+
+    def test_mismatch_past_the_first_chunk(self):
+        batch = dict(self.batch)
+        batch[self.ids[-1]] = _entries(counter=2)
+        self.assertFalse(self.validate(batch))
+
+    def test_other_tokens_digests_do_not_count(self):
+        self.store('other', {self.ids[0]: _entries(2)})
+        self.assertTrue(server_utils.validate_historylists({self.ids[0]: _entries(2)}, [self.ids[0]],
+                                                           'other', db.session, KEY))
+        self.assertFalse(self.validate({self.ids[0]: _entries(2)}))
+
+    def test_unknown_ids(self):
+        unknown = str(uuid.uuid4())
+        for policy, empty, non_empty in (('require_empty', True, False), ('trust', True, True),
+                                         ('reject', False, False)):
+            self.app.config['UNKNOWN_OBJECT_HISTORY'] = policy
+            with self.subTest(policy=policy):
+                self.assertIs(self.validate({**self.batch, unknown: []}), empty)
+                self.assertIs(self.validate({**self.batch, unknown: _entries()}), non_empty)
+                # an id missing from the header is an empty history
+                self.assertIs(self.validate(self.batch, self.ids + [unknown]), empty)
+
+    def test_default_requires_empty(self):
+        unknown = str(uuid.uuid4())
+        self.assertTrue(self.validate({unknown: []}))
+        self.assertFalse(self.validate({unknown: _entries()}))
+
+
+class UpsertDigestsTest(ServerUtilsTestCase):
+    config = {'HISTORY_WRITE_CHUNK_SIZE': 2}
+
+    def test_insert_then_update(self):
+        object_id = str(uuid.uuid4())
+        server_utils.upsert_digests(db.session, 'tok', {object_id: 'a'})
+        server_utils.upsert_digests(db.session, 'tok', {object_id: 'b'})
+        self.assertEqual(self.stored('tok'), {object_id: 'b'})
+
+    def test_on_conflict_per_chunk(self):
+        ids = [str(uuid.uuid4()) for _ in range(5)]
+        server_utils.upsert_digests(db.session, 'tok', {object_id: 'a' for object_id in ids[:3]})
+        inserts = self.record_statements('INSERT')
+        # 3 known and 2 new objects, in chunks of 2
+        server_utils.upsert_digests(db.session, 'tok', {object_id: 'b' for object_id in ids})
+        self.assertEqual(len(inserts), 3)
+        self.assertTrue(all('ON CONFLICT' in statement for statement in inserts))
+        self.assertEqual(self.stored('tok'), {object_id: 'b' for object_id in ids})
+
+    def test_merge_fallback(self):
+        ids = [str(uuid.uuid4()) for _ in range(3)]
+        server_utils.upsert_digests(db.session, 'tok', {ids[0]: 'a'})
+        # a database without INSERT ... ON CONFLICT
+        with mock.patch.object(db.engine.dialect, 'name', 'mysql'):
+            inserts = self.record_statements('INSERT')
+            server_utils.upsert_digests(db.session, 'tok', {object_id: 'b' for object_id in ids})
+        self.assertTrue(inserts)
+        self.assertFalse(any('ON CONFLICT' in statement for statement in inserts))
+        self.assertEqual(self.stored('tok'), {object_id: 'b' for object_id in ids})
+
+    def test_other_tokens_untouched(self):
+        object_id = str(uuid.uuid4())
+        server_utils.upsert_digests(db.session, 'other', {object_id: 'a'})
+        server_utils.upsert_digests(db.session, 'tok', {object_id: 'b'})
+        self.assertEqual(self.stored('other'), {object_id: 'a'})
+        self.assertEqual(self.stored('tok'), {object_id: 'b'})
+
+    def test_uncommitted(self):
+        object_id = str(uuid.uuid4())
+        server_utils.upsert_digests(db.session, 'tok', {object_id: 'a'}, commit=False)
+        db.session.rollback()
+        self.assertEqual(self.stored('tok'), {})
+
+
+class DeleteDigestsTest(ServerUtilsTestCase):
+    config = {'HISTORY_WRITE_CHUNK_SIZE': 2}
+
+    def setUp(self):
+        super().setUp()
+        self.ids = [str(uuid.uuid4()) for _ in range(5)]
+        for token in ('tok', 'other'):
+            server_utils.upsert_digests(db.session, token, {object_id: token for object_id in self.ids})
+
+    def test_delete(self):
+        deletes = self.record_statements('DELETE')
+        self.assertEqual(server_utils.delete_digests(db.session, 'tok', self.ids[:3]), 3)
+        # 3 ids in chunks of 2
+        self.assertEqual(len(deletes), 2)
+        self.assertEqual(self.stored('tok'), {object_id: 'tok' for object_id in self.ids[3:]})
+        self.assertEqual(self.stored('other'), {object_id: 'other' for object_id in self.ids})
+
+    def test_delete_unknown(self):
+        self.assertEqual(server_utils.delete_digests(db.session, 'tok', [str(uuid.uuid4())]), 0)
+        self.assertEqual(len(self.stored('tok')), 5)
+
+    def test_purge(self):
+        server_utils.history_digest_cache.maxsize = 16
+        server_utils.history_digest_cache.put_many('other', {self.ids[0]: 'other', self.ids[4]: 'other'})
+        self.assertEqual(server_utils.purge_histories(db.session, self.ids[:3]), 6)
+        for token in ('tok', 'other'):
+            self.assertEqual(self.stored(token), {object_id: token for object_id in self.ids[3:]})
+        # cached digests of the purged objects go too
+        self.assertEqual(server_utils.history_digest_cache.get_many('other', [self.ids[0], self.ids[4]]),
+                         {self.ids[4]: 'other'})
+
+
+class DigestCacheTest(ServerUtilsTestCase):
+    def digest_cache(self):
+        return DigestCache(maxsize=16)
+
+    def setUp(self):
+        super().setUp()
+        self.ids = [str(uuid.uuid4()) for _ in range(2)]
+        self.batch = {object_id: _entries() for object_id in self.ids}
+        server_utils.store_digests(db.session, 'tok', {object_id: history_list_digest(object_id, entries, KEY)
+                                                       for object_id, entries in self.batch.items()})
+
+    def validate(self, batch, token='tok'):
+        return server_utils.validate_historylists(batch, list(batch), token, db.session, KEY)
+
+    def test_write_through(self):
+        self.assertEqual(self.stored('tok'), server_utils.history_digest_cache.get_many('tok', self.ids))
+        selects = self.record_statements('SELECT')
+        self.assertTrue(self.validate(self.batch))
+        self.assertEqual(selects, [])
+
+    def test_deleted_digests_are_evicted(self):
+        server_utils.store_digests(db.session, 'tok', {self.ids[0]: None})
+        self.assertEqual(list(server_utils.history_digest_cache.get_many('tok', self.ids)), [self.ids[1]])
+        self.assertEqual(list(self.stored('tok')), [self.ids[1]])
+
+    def test_stale_entry_checked_against_database(self):
+        # another worker wrote a newer digest
+        newer = {self.ids[0]: _entries(counter=2)}
+        HistoryListHash.query.filter_by(object_id=uuid.UUID(self.ids[0])).update(
+            {'history_list_hash': history_list_digest(self.ids[0], newer[self.ids[0]], KEY)})
+        db.session.commit()
+        self.assertTrue(self.validate(newer))
+
+    def test_revocation_evicts_token(self):
+        from server.website.oauth2 import evict_revoked_token
+        server_utils.history_digest_cache.put_many('other', {self.ids[0]: 'x'})
+        evict_revoked_token(mock.Mock(access_token='tok'))
+        self.assertEqual(server_utils.history_digest_cache.get_many('tok', self.ids), {})
+        self.assertEqual(server_utils.history_digest_cache.get_many('other', self.ids), {self.ids[0]: 'x'})
+        # validation goes back to the database
+        selects = self.record_statements('SELECT')
+        self.assertTrue(self.validate(self.batch))
+        self.assertEqual(len(selects), 1)
+
+
+class FusedHistoryUpdateTest(ServerUtilsTestCase):
+    def setUp(self):
+        super().setUp()
+        db.session.add(OAuth2Client(client_id='cid', client_secret='secret', hmac_key=KEY))
+        db.session.add(OAuth2Token(client_id='cid', token_type='Bearer', access_token='tok', scope='profile',
+                                   issued_at=0, expires_in=3600, policy='p'))
+        db.session.commit()
+        self.ids = [str(uuid.uuid4()) for _ in range(2)]
+        self.history = {object_id: _entries(counter=2) for object_id in self.ids}
+
+    def register(self, fused):
+        db.session.add(UpdateProgram(file_name='updater.wasm', client_id='cid', serialized_module=b'', fused=fused))
+        db.session.commit()
+
+    def update(self, output=None):
+        headers = {'Authorization': 'Bearer tok', 'Authorization-History': json.dumps({i: _entries() for i in self.ids})}
+        with self.app.test_request_context('/api/events', method='POST', headers=headers):
+            if output is None:
+                # the policy was the fused program
+                g.fused_history = self.history
+            with mock.patch.object(server_utils, 'run_update_program', return_value=json.dumps(output)) as run:
+                new_history = server_utils.insert_batch_history_wasm(None, request, self.ids, db.session)
+        self.assertEqual(json.loads(new_history), self.history)
+        self.assertEqual(self.stored('tok'), {object_id: history_list_digest(object_id, entries, KEY)
+                                              for object_id, entries in self.history.items()})
+        return run
+
+    def test_fused_policy(self):
+        self.register(fused=False)
+        self.update().assert_not_called()
+
+    def test_fused_update_program(self):
+        self.register(fused=True)
+        self.update({'verdict': 'Accept', 'history': self.history}).assert_called_once()
+
+    def test_update_program(self):
+        self.register(fused=False)
+        self.update(self.history).assert_called_once()
@@ -0,0 +1,85 @@
+import base64
+import unittest
+
+from historylib import wire
+from historylib.canonical import history_list_bytes
+from historylib.wire import WireFormatError, HistoryTooLargeError
+
+
+def _entry(api, method, counter, timestamp):
+    return {'api': api, 'method': method, 'counter': counter, 'timestamp': timestamp}
+
+
+class WireCodecTest(unittest.TestCase):
+    def test_round_trip(self):
+        batch = {
+            'b7a2a1b4-0c1f-4c56-9a0e-53f5d4a3c1e2': [
+                _entry('/api/events', 'POST', 1, 1705279436.833235),
+                _entry('/api/events/<event_id>', 'GET', 3, 1705279437),
+            ],
+            'not-a-uuid': [_entry('/api/events', 'DELETE', -2, -5)],
+            'B7A2A1B4-0C1F-4C56-9A0E-53F5D4A3C1E2': [],
+        }
+        decoded = wire.loads(wire.dumps(batch))
+        self.assertEqual(decoded, batch)
+        self.assertEqual(list(decoded), list(batch))
+        for obj_id, entries in batch.items():
+            # numbers keep their JSON type, so digests are unchanged
+            self.assertEqual(history_list_bytes(obj_id, decoded[obj_id]), history_list_bytes(obj_id, entries))
+
+    def test_large_string_table(self):
+        batch = {'obj': [_entry('/api/%d' % i, 'GET', i, i) for i in range(300)]}
+        self.assertEqual(wire.loads(wire.dumps(batch)), batch)
+
+    def test_big_numbers(self):
+        batch = {'obj': [_entry('/a', 'GET', 2 ** 40, -(2 ** 50)), _entry('/a', 'PUT', 0, 0.0)]}
+        self.assertEqual(wire.loads(wire.dumps(batch)), batch)
+
+    def test_unencodable_batches(self):
+        for batch in ({'obj': [_entry('/a', 'GET', 1, '1')]},
+                      {'obj': [_entry('/a', 'GET', 1.5, 1)]},
+                      {'obj': [{'api': '/a', 'method': 'GET'}]},
+                      {'obj': {'summary': []}}):
+            with self.assertRaises(WireFormatError):
+                wire.dumps(batch)
+
+    def test_malformed_values(self):
+        encoded = wire.dumps({'obj': [_entry('/a', 'GET', 1, 1)]})
+        data = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+        # empty string table, one object, then its flags byte
+        unknown_flags = b'HW\x01\x00\x01\x02\x03obj\x00'
+        for bad in (data[:-1], data + b'\x00', b'XX\x01' + data[3:], data[:3], unknown_flags):
+            with self.assertRaises(WireFormatError):
+                wire.loads(base64.urlsafe_b64encode(bad).decode())
+        with self.assertRaises(WireFormatError):
+            wire.loads('{"obj": []}')
+
+    def test_loads_header(self):
+        self.assertEqual(wire.loads_header('{"obj": []}', binary=False), {'obj': []})
+        self.assertEqual(wire.loads_header('', binary=True), {})
+        self.assertEqual(wire.loads_header(wire.dumps({'obj': []}), binary=True), {'obj': []})
+
+
+class WireCompressionTest(unittest.TestCase):
+    def test_round_trip(self):
+        value = '{"obj": []}' * 100
+        compressed = wire.compress(value)
+        self.assertLess(len(compressed), len(value))
+        self.assertEqual(wire.decompress(compressed, max_size=len(value)), value)
+        self.assertEqual(wire.decompress(compressed, chunk_size=7), value)
+
+    def test_size_cap(self):
+        compressed = wire.compress('a' * 100000)
+        with self.assertRaises(HistoryTooLargeError):
+            wire.decompress(compressed, max_size=1000)
+
+    def test_malformed(self):
+        compressed = wire.compress('{"obj": []}')
+        for bad in (compressed[:-4], 'AAAA', '!!!'):
+            with self.assertRaises(WireFormatError):
+                wire.decompress(bad)
+        with self.assertRaises(WireFormatError):
+            wire.decompress(compressed, encoding='br')
+        self.assertFalse(wire.is_compressed(None))
+        self.assertFalse(wire.is_compressed('identity'))
+        self.assertTrue(wire.is_compressed('deflate'))
@@ -0,0 +1,62 @@
+import unittest
+
+from flask import Flask
+
+from historylib.write_behind import WriteBehindQueue, WriteBehindError, ASYNC, GROUP
+
+
+class WriteBehindQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.app = Flask(__name__)
+        self.committed = {}
+        self.fail = False
+        self.errors = []
+
+    def flush(self, writes):
+        if self.fail:
+            raise RuntimeError('database is locked')
+        self.committed.update(writes)
+
+    def queue(self, mode):
+        queue = WriteBehindQueue(mode, interval=0.001)
+        queue.start(self.app, self.flush, lambda writes, error: self.errors.append((dict(writes), error)))
+        self.addCleanup(queue.close)
+        return queue
+
+    def test_group_commits_before_returning(self):
+        queue = self.queue(GROUP)
+        queue.submit({('tok', 'a'): 'd1', ('tok', 'b'): None})
+        self.assertEqual(self.committed, {('tok', 'a'): 'd1', ('tok', 'b'): None})
+        self.assertEqual(queue.pending('tok', ['a', 'b']), {})
+
+    def test_group_failure_raises(self):
+        queue = self.queue(GROUP)
+        self.fail = True
+        with self.assertRaises(WriteBehindError):
+            queue.submit({('tok', 'a'): 'd1'})
+        self.assertEqual(queue.poisoned('tok', ['a']), set())
+
+    def test_async_pending_until_committed(self):
+        queue = self.queue(ASYNC)
+        queue.submit({('tok', 'a'): 'd1'})
+        queue.submit({('tok', 'a'): 'd2'})
+        self.assertIn(queue.pending('tok', ['a']), ({'a': 'd2'}, {}))
+        queue.drain()
+        self.assertEqual(self.committed, {('tok', 'a'): 'd2'})
+
+    def test_dropped_async_batch_is_poisoned_until_rewritten(self):
+        queue = self.queue(ASYNC)
+        self.fail = True
+        queue.submit({('tok', 'a'): 'd1', ('tok', 'b'): 'd1'})
+        with self.assertRaises(WriteBehindError):
+            queue.drain()
+        self.assertEqual(len(self.errors), 1)
+        self.assertEqual(queue.pending('tok', ['a', 'b']), {})
+        self.assertEqual(queue.poisoned('tok', ['a', 'b', 'c']), {'a', 'b'})
+        self.assertEqual(queue.poisoned('other', ['a']), set())
+        self.assertEqual(queue.stats()['poisoned'], 2)
+
+        self.fail = False
+        queue.submit({('tok', 'a'): 'd2'})
+        queue.drain()
+        self.assertEqual(queue.poisoned('tok', ['a', 'b']), {'b'})
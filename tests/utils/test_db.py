@@ -0,0 +1,110 @@
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+
+from utils.db import add_missing_columns, database_uri, engine_options, init_db
+
+
+class InitDbTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'db.sqlite')
+
+    def init(self, **config):
+        app = Flask(__name__)
+        app.config.update(config)
+        db = SQLAlchemy()
+        init_db(app, db)
+        context = app.app_context()
+        context.push()
+        self.addCleanup(context.pop)
+        self.addCleanup(db.engine.dispose)
+        return app, db
+
+    def pragma(self, db, name):
+        with db.engine.connect() as connection:
+            return connection.exec_driver_sql(f'PRAGMA {name}').scalar()
+
+    def test_sqlite_file(self):
+        app, db = self.init(SQLALCHEMY_DATABASE_URI='sqlite:///' + self.path, DB_POOL_SIZE=3,
+                            SQLITE_MMAP_SIZE=1 << 20, SQLITE_BUSY_TIMEOUT_MS=1234)
+        self.assertEqual(self.pragma(db, 'journal_mode'), 'wal')
+        # NORMAL
+        self.assertEqual(self.pragma(db, 'synchronous'), 1)
+        self.assertEqual(self.pragma(db, 'mmap_size'), 1 << 20)
+        self.assertEqual(self.pragma(db, 'busy_timeout'), 1234)
+        self.assertEqual(db.engine.pool.size(), 3)
+        self.assertTrue(db.engine.pool._pre_ping)
+
+    def test_pool_options(self):
+        options = engine_options({'SQLALCHEMY_DATABASE_URI': 'postgres://u@localhost/db', 'DB_MAX_OVERFLOW': 0})
+        self.assertEqual(options, {'pool_size': 10, 'max_overflow': 0, 'pool_timeout': 30,
+                                   'pool_recycle': 1800, 'pool_pre_ping': True})
+        # nothing to size for the in-memory database
+        self.assertEqual(engine_options({'SQLALCHEMY_DATABASE_URI': 'sqlite://'}), {})
+
+    def test_explicit_engine_options_win(self):
+        app, db = self.init(SQLALCHEMY_DATABASE_URI='sqlite:///' + self.path,
+                            SQLALCHEMY_ENGINE_OPTIONS={'pool_pre_ping': False})
+        self.assertFalse(app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_pre_ping'])
+        self.assertEqual(app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'], 10)
+        self.assertFalse(db.engine.pool._pre_ping)
+
+    def test_memory_database_has_no_pragmas(self):
+        app, db = self.init(SQLALCHEMY_DATABASE_URI='sqlite://')
+        self.assertEqual(self.pragma(db, 'journal_mode'), 'memory')
+
+    def test_postgres_scheme(self):
+        self.assertEqual(database_uri('postgres://u@localhost/db'), 'postgresql://u@localhost/db')
+        self.assertEqual(database_uri('sqlite://'), 'sqlite://')
+
+
+class AddMissingColumnsTest(unittest.TestCase):
+    def setUp(self):
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        self.path = os.path.join(tmpdir.name, 'db.sqlite')
+        # A table created before artifact_path was added to the model
+        with sqlite3.connect(self.path) as connection:
+            connection.execute('CREATE TABLE policy (policy_hash VARCHAR(255) PRIMARY KEY, serialized_module BLOB)')
+            connection.execute("INSERT INTO policy VALUES ('abc', x'00')")
+        connection.close()
+
+    def app_db(self, required=False):
+        app = Flask(__name__)
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.path
+        db = SQLAlchemy()
+
+        class Policy(db.Model):
+            policy_hash = db.Column(db.String(255), primary_key=True)
+            serialized_module = db.Column(db.LargeBinary)
+            artifact_path = db.Column(db.String(512))
+            decision_ttl = db.Column(db.Integer, nullable=not required)
+
+        db.init_app(app)
+        return app, db, Policy
+
+    def test_adds_nullable_columns(self):
+        app, db, Policy = self.app_db()
+        with app.app_context():
+            add_missing_columns(db)
+            # a second run finds nothing to add
+            add_missing_columns(db)
+            policy = db.session.get(Policy, 'abc')
+            self.assertIsNone(policy.artifact_path)
+            policy.artifact_path = '/artifacts/ab/abc.cwasm'
+            db.session.commit()
+            self.assertEqual(db.session.get(Policy, 'abc').artifact_path, '/artifacts/ab/abc.cwasm')
+            db.engine.dispose()
+
+    def test_rejects_required_columns(self):
+        app, db, _ = self.app_db(required=True)
+        with app.app_context():
+            with self.assertRaises(RuntimeError):
+                add_missing_columns(db)
+            db.engine.dispose()
@@ -0,0 +1,26 @@
+import unittest
+from unittest import mock
+
+from server.website import oauth2
+from historylib import server_utils
+from historylib.digest_cache import DigestCache
+
+
+class EvictRevokedTokenTest(unittest.TestCase):
+    def setUp(self):
+        self.auth_context_cache = oauth2.AuthContextCache()
+        self.digest_cache = DigestCache()
+        for patcher in (mock.patch.object(oauth2, 'auth_context_cache', self.auth_context_cache),
+                        mock.patch.object(server_utils, 'history_digest_cache', self.digest_cache)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        for id_, token in enumerate(('tok', 'other'), 1):
+            self.auth_context_cache.put(token, 'token', oauth2.OAuth2Token(id=id_, access_token=token))
+            self.digest_cache.put_many(token, {'obj': 'digest'})
+
+    def test_revocation_evicts_the_token(self):
+        oauth2._on_token_revoked(oauth2.authorization, token=mock.Mock(access_token='tok'))
+        self.assertIsNone(self.auth_context_cache.get('tok', 'token'))
+        self.assertEqual(self.digest_cache.get_many('tok', ['obj']), {})
+        self.assertEqual(self.auth_context_cache.get('other', 'token').access_token, 'other')
+        self.assertEqual(self.digest_cache.get_many('other', ['obj']), {'obj': 'digest'})
@@ -0,0 +1,105 @@
+"""Database engine configuration shared by the server and the proxy.
+
+Use ``init_db(app, db)`` in place of ``db.init_app(app)``. It builds
+``SQLALCHEMY_ENGINE_OPTIONS`` from the ``DB_*`` settings (pool size, overflow,
+pre-ping) and, for SQLite files, sets the ``SQLITE_*`` pragmas (journal mode,
+synchronous, mmap size) on every new connection. Options already given in
+``SQLALCHEMY_ENGINE_OPTIONS`` win over the ones derived here.
+
+Call ``add_missing_columns(db)`` after ``db.create_all()``, which creates
+missing tables but leaves existing ones alone.
+"""
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import make_url
+
+
+def database_uri(uri):
+    """``uri`` with the ``postgres://`` scheme some hosts hand out renamed to ``postgresql://``."""
+    if uri and uri.startswith('postgres://'):
+        return 'postgresql://' + uri[len('postgres://'):]
+    return uri
+
+
+def is_sqlite_memory(url):
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(config):
+    """Engine options for ``config['SQLALCHEMY_DATABASE_URI']``."""
+    url = make_url(database_uri(config['SQLALCHEMY_DATABASE_URI']))
+    if is_sqlite_memory(url):
+        # One shared connection (StaticPool, set up by Flask-SQLAlchemy), nothing to size
+        return {}
+    return {
+        'pool_size': config.get('DB_POOL_SIZE', 10),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 20),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+    }
+
+
+def sqlite_pragmas(config):
+    """PRAGMA statements run on every new connection to a SQLite file."""
+    pragmas = []
+    journal_mode = config.get('SQLITE_JOURNAL_MODE', 'WAL')
+    if journal_mode:
+        pragmas.append(f'PRAGMA journal_mode={journal_mode}')
+    synchronous = config.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+    if synchronous:
+        pragmas.append(f'PRAGMA synchronous={synchronous}')
+    mmap_size = config.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)
+    if mmap_size is not None:
+        pragmas.append(f'PRAGMA mmap_size={int(mmap_size)}')
+    # Milliseconds a connection waits for another one's write lock before "database is locked"
+    pragmas.append(f"PRAGMA busy_timeout={int(config.get('SQLITE_BUSY_TIMEOUT_MS', 5000))}")
+    return pragmas
+
+
+def init_db(app, db):
+    """Set up ``db`` (a Flask-SQLAlchemy instance) for ``app`` with the configured engine."""
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri(app.config['SQLALCHEMY_DATABASE_URI'])
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {**engine_options(app.config),
+                                               **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})}
+    db.init_app(app)
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    if url.get_backend_name() == 'sqlite' and not is_sqlite_memory(url):
+        with app.app_context():
+            set_sqlite_pragmas(db.engine, app.config)
+
+
+def set_sqlite_pragmas(engine, config):
+    """Run :func:`sqlite_pragmas` on every new connection of ``engine``."""
+    pragmas = sqlite_pragmas(config)
+    event.listen(engine, 'connect', lambda conn, record: _execute(conn, pragmas))
+
+
+def add_missing_columns(db):
+    """Add the columns of ``db``'s models that their existing tables lack, e.g.
+    in a database created before the column was added. Only nullable columns
+    can be added in place; existing rows get NULL."""
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        quote = connection.dialect.identifier_preparer.quote
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                if not column.nullable:
+                    raise RuntimeError(f'{table.name}.{column.name} is missing and not nullable, '
+                                       'the table has to be rebuilt')
+                column_type = column.type.compile(dialect=connection.dialect)
+                connection.exec_driver_sql(
+                    f'ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column_type}')
+
+
+def _execute(dbapi_connection, statements):
+    cursor = dbapi_connection.cursor()
+    try:
+        for statement in statements:
+            cursor.execute(statement)
+    finally:
+        cursor.close()
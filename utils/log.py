@@ -12,11 +12,20 @@ class RequestLog:
     request_method: str
     policy_hash: str = ""
     policy_succeeds: bool = False
+    policy_cache_hit: bool = False
+    decision_cache_hit: bool = False
+    decision_cache_hit_rate: float = 0.0  # Hit rate of the process' decision cache so far
+    digest_cache_hit_rate: float = 0.0  # Hit rate of the process' history digest cache so far
+    auth_context_cache_hit_rate: float = 0.0  # Hit rate of the process' token/client/policy row cache so far
+    policy_denied_objects: int = 0  # Objects denied by a per-object verdict map
+    policy_budget_exceeded: bool = False  # Policy ran out of fuel or past its deadline
     # Request parameters
     request_size: int = 0
     request_data_size: int = 0
     history_length: int = 0
     history_size: int = 0
+    history_compressed_size: int = 0  # Authorization-History as sent, when compressed
+    history_compression_ratio: float = 0.0  # Inflated / compressed size of Authorization-History
     # Response parameters
     response_data_size: int = 0
     # Latency info
@@ -25,6 +34,10 @@ class RequestLog:
     history_validation_time: float = 0.0
     policy_execution_time: float = 0.0
     history_update_time: float = 0.0    # Time to update the history hash value in the database
+    history_decompress_time: float = 0.0    # Time to inflate a compressed Authorization-History
+    history_compress_time: float = 0.0    # Time to compress Set-Authorization-History
+    history_write_wait_time: float = 0.0    # Time waiting for the write-behind queue (the group commit)
+    history_write_queue_depth: int = 0    # Digest writes queued or being committed after this request's
     resource_api_time: float = 0.0
 
     def __str__(self):